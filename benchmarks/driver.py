@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+# run one entry point of scripts/ with tracing on, and write its metrics as JSON.
+# usage: driver.py METRICS_FILE SCRIPT [ARGS...], run in the scripts directory
+
+import os
+import sys
+import json
+import time
+import runpy
+import resource
+
+if __name__ == '__main__':
+  metrics_file, script = sys.argv[1], sys.argv[2]
+  sys.path.insert(0, os.getcwd())
+  sys.argv = [script] + sys.argv[3:]
+
+  import tracing
+  tracing.enable()
+
+  start = time.monotonic()
+  error = None
+  try:
+    runpy.run_path(script, run_name='__main__')
+  except SystemExit as e:
+    if e.code not in [None, 0]:
+      error = 'exit {}'.format(e.code)
+  except Exception as e:
+    error = str(e)
+
+  spans = tracing.tracer.spans
+  with open(metrics_file, 'w') as f:
+    json.dump({
+      'seconds': time.monotonic() - start,
+      'spawns': tracing.tracer.started.get('cli', 0),
+      'traced_http': tracing.tracer.started.get('http', 0),
+      'cloudant_requests': tracing.tracer.started.get('cloudant', 0),
+      # kilobytes on Linux. the children are the CLI processes
+      'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+      'children_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+      'slowest': [
+        {'name': x.name, 'cat': x.cat, 'seconds': x.duration()}
+        for x in sorted(spans, key=lambda x: x.duration(), reverse=True)[:5]
+      ],
+      'error': error
+    }, f)
+
+  sys.exit(0 if error is None else 1)
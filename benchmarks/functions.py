@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# deploy Functions entities through scripts/functions_backend.py against the OpenWhisk API of benchmarks/stubs.py,
+# then deploy them again and delete them. it fails when an entity isn't deployed as expected.
+# usage: run by driver.py in the scripts directory like the other scenarios, with FUNCTIONS_API_HOST set
+
+import os
+import sys
+import argparse
+import tempfile
+import util
+from functions_backend import RestBackend, PAGE_SIZE
+
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description="""
+  deploy, re-deploy and delete Functions entities by the REST backend.
+  """)
+  parser.add_argument('-n', '--namespace', default='bench-functions', help='namespace name')
+  parser.add_argument('-p', '--package', default='bench', help='package name')
+  # more actions than a page, so listings are paged
+  parser.add_argument('-a', '--actions', default=PAGE_SIZE + 50, type=int, help='number of actions')
+
+  return parser.parse_args(args)
+
+def check(condition, message):
+  if not condition:
+    print(util.bcolors.FAIL + message + util.bcolors.ENDC)
+    raise Exception(message)
+
+def deploy(args, code, parameters=True):
+  util.create_functions_namespace(args.namespace)
+  util.create_functions_package(args.package)
+  for i in range(args.actions):
+    util.create_functions_action(
+      args.package, 'action-{}'.format(i), code, 'nodejs:10', '60000', {'index': i} if parameters else None
+    )
+  util.update_functions_action_to_web(args.package, 'action-0', 'raw')
+  util.bind_functions_predefined_to('/whisk.system/cloudant', 'bench-cloudant')
+  util.create_functions_sequence('bench-sequence', ['{}/action-0'.format(args.package), '{}/action-1'.format(args.package)])
+  util.create_functions_trigger('bench-trigger')
+  util.create_functions_rule('bench-rule', 'bench-trigger', args.package, 'action-1')
+  util.create_functions_api('bench-api', '/bench', '/items', 'get', '{}/action-0'.format(args.package), 'json')
+
+def verify(args, backend):
+  actions = util.get_functions_action_list(args.namespace, args.package)
+  check(len(actions) == args.actions, '{} actions in {}, not {}'.format(len(actions), args.package, args.actions))
+  check(len(util.inventory.rows('actions')) == args.actions + 1, 'the action list is not paged')
+
+  # a re-deploy without parameters and the web update keep the rest of the action
+  action = backend.call('GET', backend.entity_path('actions', '{}/action-0'.format(args.package))).json()
+  annotations = {x['key']: x['value'] for x in action.get('annotations', [])}
+  parameters = {x['key']: x['value'] for x in action.get('parameters', [])}
+  check(len(action['exec'].get('code', '')) > 0, 'action-0 lost its code')
+  check(annotations.get('web-export') is True and annotations.get('raw-http') is True, 'action-0 is not a web action')
+  check(parameters.get('index') == 0, 'action-0 lost its parameters')
+  check(util.inventory.exists('apis', 'get /bench/items'), 'no api GET /bench/items')
+
+def delete(args, backend):
+  util.delete_functions_rule('bench-rule')
+  util.delete_functions_trigger('bench-trigger')
+  backend.delete('actions', 'bench-sequence', 'actions')
+  for i in range(args.actions):
+    util.delete_functions_action(args.package, 'action-{}'.format(i))
+  util.delete_functions_package('bench-cloudant')
+  util.delete_functions_package(args.package)
+  util.delete_functions_namespace(args.namespace)
+  util.inventory.invalidate()
+  check(not util.inventory.exists('namespaces', args.namespace), 'namespace {} is left'.format(args.namespace))
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv[1:])
+  backend = RestBackend('jp-tok', 'benchmark-resource-group-id')
+  util.use_functions_backend(backend)
+
+  with tempfile.NamedTemporaryFile('w', suffix='.js') as f:
+    f.write('function main(params) { return {index: params.index}; }\n')
+    f.flush()
+    deploy(args, f.name)
+    # a re-deploy of the same entities, like apply, from a fresh inventory
+    util.inventory.invalidate()
+    deploy(args, f.name, parameters=False)
+  verify(args, backend)
+  delete(args, backend)
+  util.inventory.report()
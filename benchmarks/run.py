@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from urllib import request
+import tenants
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+# allowed growth over the baseline. counts are deterministic, time and memory are not
+TOLERANCE = {'seconds': 0.5, 'spawns': 0.0, 'http': 0.05, 'rss_kb': 0.25}
+
+
+'''
+Offline deploy benchmarks.
+each tenant size runs the scenarios below against the fake ibmcloud CLI and the HTTP stubs,
+and records wall time, spawned processes, HTTP requests and peak RSS of the deploy process.
+'''
+def scenarios(tenant):
+  data = '../data/tenants/{}/cloudant/assets.json;assets'.format(tenant)
+  return [
+    ('main-create', ['main.py', '-o', 'create', '-t', tenant]),
+    # a re-deploy with nothing changed
+    ('main-apply', ['main.py', '-o', 'apply', '-t', tenant]),
+    # the seed loader alone, re-seeding data that is already there
+    ('cloudant-reseed', [
+      'service_cloudant.py', '-o', 'create', '-n', 'cloudant', '-k', 'cloudant-key', '-b', 'assets', '-d', data
+    ]),
+    ('main-delete', ['main.py', '-o', 'delete', '-t', tenant]),
+    # the Functions helpers on the REST backend, against the OpenWhisk API of the stubs
+    ('functions-rest', [os.path.join(HERE, 'functions.py')]),
+  ]
+
+class Environment:
+  def __init__(self, root, latency):
+    self.root = root
+    self.state = os.path.join(root, 'ibmcloud.json')
+    self.log = os.path.join(root, 'ibmcloud.log')
+    self.stub = subprocess.Popen(
+      [sys.executable, os.path.join(HERE, 'stubs.py'), '-s', self.state],
+      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    self.url = self.stub.stdout.readline().decode('utf-8').strip()
+    self.env = dict(
+      os.environ,
+      PATH=os.path.join(HERE, 'fake_ibmcloud') + os.pathsep + os.environ.get('PATH', ''),
+      APIKEY='benchmark',
+      FAKE_IBMCLOUD_STATE=self.state,
+      FAKE_IBMCLOUD_LOG=self.log,
+      FAKE_IBMCLOUD_LATENCY=json.dumps(latency),
+      FAKE_STUB_URL=self.url,
+      COS_ENDPOINT=self.url + '/s3',
+      IAM_TOKEN_URL=self.url + '/iam/oidc/token',
+      APPID_API_HOST=self.url + '/appid',
+      FUNCTIONS_API_HOST=self.url,
+    )
+    self.env.pop('IAM_TOKEN_CACHE', None)
+
+  def http_requests(self):
+    with request.urlopen(self.url + '/_stub/stats') as res:
+      return sum(json.loads(res.read().decode('utf-8')).values())
+
+  def run(self, command, verbose=False):
+    metrics_file = os.path.join(self.root, 'metrics.json')
+    before = self.http_requests()
+    start = time.monotonic()
+    p1 = subprocess.Popen(
+      [sys.executable, os.path.join(HERE, 'driver.py'), metrics_file] + command,
+      cwd=os.path.join(self.root, 'scripts'), env=self.env,
+      stdout=None if verbose else subprocess.DEVNULL, stderr=None if verbose else subprocess.DEVNULL
+    )
+    p1.communicate()
+    seconds = time.monotonic() - start
+
+    with open(metrics_file) as f:
+      metrics = json.load(f)
+    if p1.returncode != 0:
+      raise Exception('{} failed: {}'.format(' '.join(command), metrics.get('error')))
+    return {
+      'seconds': round(seconds, 3),
+      'spawns': metrics['spawns'],
+      # the stubs count every request, including the ones python-cloudant sends
+      'http': self.http_requests() - before,
+      'rss_kb': metrics['rss_kb'],
+      'slowest': metrics['slowest'],
+    }
+
+  def close(self):
+    self.stub.terminate()
+    self.stub.wait()
+
+
+def compare(results, baseline):
+  regressions = []
+  for name, metrics in results.items():
+    base = baseline.get(name)
+    if base is None:
+      continue
+    for metric, tolerance in TOLERANCE.items():
+      if metrics[metric] > base[metric] * (1 + tolerance) + (0.1 if metric == 'seconds' else 0):
+        regressions.append('{} {}: {} > baseline {} (+{:.0f}%)'.format(
+          name, metric, metrics[metric], base[metric], tolerance * 100
+        ))
+  return regressions
+
+def report(results):
+  print('{:<28} {:>10} {:>8} {:>8} {:>10}'.format('scenario', 'seconds', 'spawns', 'http', 'rss_kb'))
+  for name, m in results.items():
+    print('{:<28} {:>10.2f} {:>8} {:>8} {:>10}'.format(name, m['seconds'], m['spawns'], m['http'], m['rss_kb']))
+    for s in m['slowest'][:3]:
+      print('    {:>8.2f}s  {:<8} {}'.format(s['seconds'], s['cat'], s['name']))
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description="""
+  run the offline deploy benchmarks with a fake ibmcloud CLI and local HTTP stubs,
+  and fail when a result regresses against the baseline.
+  """)
+  parser.add_argument('-s', '--sizes', default='1000,10000,100000', help='comma-separated numbers of assets')
+  parser.add_argument('-l', '--latency', default='{"default": 0}',
+    help='JSON of seconds per ibmcloud command prefix, like {"default": 0.5, "provision": 10}')
+  parser.add_argument('-b', '--baseline', default=BASELINE, help='baseline file')
+  parser.add_argument('-u', '--update-baseline', action='store_true', help='write the results as the baseline')
+  parser.add_argument('-o', '--output', help='file path to write the results as JSON')
+  parser.add_argument('-v', '--verbose', action='store_true', help='show output of the scripts')
+
+  return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv[1:])
+
+  results = {}
+  for size in [int(x) for x in args.sizes.split(',')]:
+    root = tempfile.mkdtemp(prefix='covsafe-bench-')
+    env = None
+    try:
+      tenant = tenants.create(root, size)
+      env = Environment(root, json.loads(args.latency))
+      for name, command in scenarios(tenant):
+        print('running {} with {} assets'.format(name, size), flush=True)
+        results['{}/{}'.format(size, name)] = env.run(command, args.verbose)
+    finally:
+      if env is not None:
+        env.close()
+      shutil.rmtree(root)
+
+  report(results)
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+  if args.update_baseline:
+    baseline = {k: {m: v[m] for m in TOLERANCE.keys()} for k, v in results.items()}
+    with open(args.baseline, 'w') as f:
+      json.dump(baseline, f, indent=2, sort_keys=True)
+    print('wrote baseline to {}'.format(args.baseline))
+  elif os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f))
+    for x in regressions:
+      print('REGRESSION ' + x)
+    sys.exit(1 if len(regressions) > 0 else 0)
+  else:
+    print('no baseline at {}. run with --update-baseline to record one'.format(args.baseline))
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import hashlib
+import threading
+import uuid
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+
+'''
+Local stand-ins for the HTTP services a deploy talks to, served from one port by path prefix:
+  /s3            S3 API for scripts/s3.py (objects, multipart uploads, listing, multi-object delete)
+  /iam           IAM token endpoint
+  /appid         App ID management API
+  /eventstreams  Event Streams admin API, reading topics from the fake ibmcloud state
+  /api/v1        OpenWhisk API of IBM Cloud Functions for scripts/functions_backend.py (IAM namespaces,
+                 packages, actions, triggers and rules paged by limit and skip, and the apimgmt web actions
+                 of API Gateway). an update replaces the whole entity, and an action without exec is refused
+  /              CouchDB-compatible API for python-cloudant (_session, databases, _bulk_docs, _all_docs,
+                 _index, design docs and views that are always built),
+                 at the root since python-cloudant drops the path of the server URL
+all data is kept in memory. GET /_stub/stats returns the number of requests per service.
+'''
+class State:
+  def __init__(self, cli_state=None):
+    self.lock = threading.Lock()
+    self.cli_state = cli_state
+    self.stats = {}
+    self.databases = {}
+    self.buckets = {}
+    self.uploads = {}
+    self.apps = []
+    self.users = []
+    self.namespaces = {}
+
+  def count(self, service):
+    with self.lock:
+      self.stats[service] = self.stats.get(service, 0) + 1
+
+
+def revision(doc, previous=None):
+  n = 1 if previous is None else int(previous.split('-')[0]) + 1
+  body = json.dumps({k: v for k, v in doc.items() if k not in ['_id', '_rev']}, sort_keys=True)
+  return '{}-{}'.format(n, hashlib.md5(body.encode()).hexdigest())
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  # headers and body are written separately, so Nagle would hold the body until the client acks the headers
+  disable_nagle_algorithm = True
+  state = None
+
+  def log_message(self, *args):
+    pass
+
+  def reply(self, status, body=b'', headers=None, content_type='application/json'):
+    if isinstance(body, (dict, list)):
+      body = json.dumps(body).encode()
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    for k, v in (headers or {}).items():
+      self.send_header(k, v)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    if self.command != 'HEAD':
+      self.wfile.write(body)
+
+  def dispatch(self):
+    u = parse.urlsplit(self.path)
+    self.query = dict(parse.parse_qsl(u.query, keep_blank_values=True))
+    n = int(self.headers.get('Content-Length') or 0)
+    self.body = self.rfile.read(n) if n > 0 else b''
+    parts = [parse.unquote(x) for x in u.path.split('/')[1:]]
+    service = parts[0] if len(parts) > 0 else ''
+
+    if service == '_stub':
+      return self.reply(200, self.state.stats)
+
+    route = {
+      's3': self.s3, 'iam': self.iam, 'appid': self.appid, 'eventstreams': self.eventstreams,
+      'api': self.openwhisk,
+    }.get(service)
+    self.state.count(service if route is not None else 'couchdb')
+    with self.state.lock:
+      if route is None:
+        return self.couchdb([x for x in parts if len(x) > 0])
+      return route(parts[1:] if service == 's3' else [x for x in parts[1:] if len(x) > 0])
+
+  do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = dispatch
+
+  def json_body(self):
+    return json.loads(self.body.decode('utf-8') or 'null')
+
+  '''
+  CouchDB
+  '''
+  def couchdb(self, parts):
+    dbs = self.state.databases
+    if len(parts) == 0:
+      return self.reply(200, {'couchdb': 'Welcome', 'version': '2.3.1'})
+    if parts[0] == '_session':
+      return self.reply(200, {'ok': True, 'name': 'benchmark', 'roles': []},
+        headers={'Set-Cookie': 'AuthSession=benchmark; Path=/'})
+    if parts[0] == '_all_dbs':
+      return self.reply(200, sorted(dbs.keys()))
+
+    name = parts[0]
+    if len(parts) == 1:
+      if self.command == 'PUT':
+        if name in dbs:
+          return self.reply(412, {'error': 'file_exists'})
+        dbs[name] = {}
+        return self.reply(201, {'ok': True})
+      if name not in dbs:
+        return self.reply(404, {'error': 'not_found'})
+      if self.command == 'DELETE':
+        del dbs[name]
+        return self.reply(200, {'ok': True})
+      return self.reply(200, {'db_name': name, 'doc_count': len(dbs[name])})
+
+    if name not in dbs:
+      return self.reply(404, {'error': 'not_found'})
+    docs = dbs[name]
+
+    if parts[1] == '_bulk_docs':
+      out = []
+      for doc in self.json_body()['docs']:
+        doc_id = doc.get('_id') or uuid.uuid4().hex
+        current = docs.get(doc_id)
+        if current is not None and current['_rev'] != doc.get('_rev'):
+          out.append({'id': doc_id, 'error': 'conflict', 'reason': 'Document update conflict.'})
+          continue
+        doc = dict(doc, _id=doc_id, _rev=revision(doc, None if current is None else current['_rev']))
+        # deleted documents leave _all_docs, and can be created again without a revision
+        if doc.get('_deleted') is True:
+          docs.pop(doc_id, None)
+        else:
+          docs[doc_id] = doc
+        out.append({'ok': True, 'id': doc_id, 'rev': doc['_rev']})
+      return self.reply(201, out)
+
+    if parts[1] == '_all_docs':
+      keys = self.json_body()['keys'] if self.command == 'POST' else sorted(docs.keys())
+      if self.command != 'POST':
+        if 'startkey' in self.query:
+          keys = [x for x in keys if x >= json.loads(self.query['startkey'])]
+        keys = keys[int(self.query.get('skip', 0)):]
+        if 'limit' in self.query:
+          keys = keys[:int(self.query['limit'])]
+      include = self.query.get('include_docs') == 'true'
+      rows = []
+      for key in keys:
+        doc = docs.get(key)
+        if doc is None:
+          rows.append({'key': key, 'error': 'not_found'})
+        else:
+          row = {'id': key, 'key': key, 'value': {'rev': doc['_rev']}}
+          if include:
+            row['doc'] = doc
+          rows.append(row)
+      return self.reply(200, {'total_rows': len(docs), 'offset': 0, 'rows': rows})
+
+    # Mango indexes are design docs with a view of the fields, like Cloudant
+    if parts[1] == '_index':
+      body = self.json_body()
+      doc_id = '_design/{}'.format(body.get('ddoc') or body['name'])
+      view = {'map': {'fields': body['index']['fields']}, 'options': {'def': body['index']}}
+      current = docs.get(doc_id)
+      if current is not None and current.get('views', {}).get(body['name']) == view:
+        return self.reply(200, {'result': 'exists', 'id': doc_id, 'name': body['name']})
+      doc = dict(current or {'_id': doc_id, 'language': 'query', 'views': {}})
+      doc['views'] = dict(doc['views'], **{body['name']: view})
+      doc['_rev'] = revision(doc, None if current is None else current['_rev'])
+      docs[doc_id] = doc
+      return self.reply(200, {'result': 'created', 'id': doc_id, 'name': body['name']})
+
+    if len(parts) >= 5 and parts[1] == '_design' and parts[3] == '_view':
+      ddoc = docs.get('_design/{}'.format(parts[2]))
+      if ddoc is None or parts[4] not in ddoc.get('views', {}):
+        return self.reply(404, {'error': 'not_found'})
+      return self.reply(200, {'total_rows': len(docs), 'offset': 0, 'rows': []})
+
+    doc_id = '/'.join(parts[1:])
+    doc = docs.get(doc_id)
+    if self.command == 'PUT':
+      body = self.json_body()
+      if doc is not None and doc['_rev'] != body.get('_rev'):
+        return self.reply(409, {'error': 'conflict', 'reason': 'Document update conflict.'})
+      body = dict(body, _id=doc_id, _rev=revision(body, None if doc is None else doc['_rev']))
+      docs[doc_id] = body
+      return self.reply(201, {'ok': True, 'id': doc_id, 'rev': body['_rev']})
+    if doc is None:
+      return self.reply(404, {'error': 'not_found'})
+    return self.reply(200, doc)
+
+  '''
+  S3
+  '''
+  def s3(self, parts):
+    buckets = self.state.buckets
+    bucket = parts[0] if len(parts) > 0 else ''
+    key = '/'.join(parts[1:])
+    xmlns = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+    if len(bucket) == 0:
+      return self.reply(200, '<ListAllMyBucketsResult xmlns="{}"><Buckets>{}</Buckets></ListAllMyBucketsResult>'.format(
+        xmlns, ''.join('<Bucket><Name>{}</Name></Bucket>'.format(escape(x)) for x in buckets.keys())
+      ).encode(), content_type='application/xml')
+
+    objects = buckets.setdefault(bucket, {})
+    if len(key) == 0:
+      if self.command == 'GET':
+        keys = sorted(x for x in objects.keys() if x.startswith(self.query.get('prefix', '')))
+        token = self.query.get('continuation-token')
+        keys = [x for x in keys if token is None or x > token]
+        size = int(self.query.get('max-keys', 1000))
+        page = keys[:size]
+        truncated = len(keys) > size
+        return self.reply(200, '<ListBucketResult xmlns="{}">{}<IsTruncated>{}</IsTruncated>{}</ListBucketResult>'.format(
+          xmlns, ''.join('<Contents><Key>{}</Key></Contents>'.format(escape(x)) for x in page),
+          'true' if truncated else 'false',
+          '<NextContinuationToken>{}</NextContinuationToken>'.format(escape(page[-1])) if truncated else ''
+        ).encode(), content_type='application/xml')
+      if self.command == 'POST' and 'delete' in self.query:
+        for x in ElementTree.fromstring(self.body).iter('Key'):
+          objects.pop(x.text, None)
+        return self.reply(200, '<DeleteResult xmlns="{}"/>'.format(xmlns).encode(), content_type='application/xml')
+      if self.command == 'DELETE':
+        buckets.pop(bucket, None)
+        return self.reply(204)
+      return self.reply(200)
+
+    if 'uploads' in self.query:
+      upload_id = uuid.uuid4().hex
+      self.state.uploads[upload_id] = {}
+      return self.reply(200, '<InitiateMultipartUploadResult xmlns="{}"><UploadId>{}</UploadId></InitiateMultipartUploadResult>'.format(
+        xmlns, upload_id
+      ).encode(), content_type='application/xml')
+
+    if 'uploadId' in self.query:
+      parts = self.state.uploads.get(self.query['uploadId'])
+      if parts is None:
+        return self.reply(404)
+      if self.command == 'PUT':
+        parts[int(self.query['partNumber'])] = self.body
+        return self.reply(200, headers={'ETag': '"{}"'.format(hashlib.md5(self.body).hexdigest())})
+      del self.state.uploads[self.query['uploadId']]
+      if self.command == 'POST':
+        numbers = sorted(parts.keys())
+        etag = '{}-{}'.format(
+          hashlib.md5(b''.join(hashlib.md5(parts[n]).digest() for n in numbers)).hexdigest(), len(numbers)
+        )
+        objects[key] = (b''.join(parts[n] for n in numbers), etag)
+      return self.reply(200)
+
+    if self.command == 'PUT':
+      objects[key] = (self.body, hashlib.md5(self.body).hexdigest())
+      return self.reply(200, headers={'ETag': '"{}"'.format(objects[key][1])})
+    if self.command == 'DELETE':
+      objects.pop(key, None)
+      return self.reply(204)
+    if key not in objects:
+      return self.reply(404)
+    return self.reply(200, objects[key][0], headers={'ETag': '"{}"'.format(objects[key][1])},
+      content_type='application/octet-stream')
+
+  '''
+  IAM, App ID and Event Streams
+  '''
+  def iam(self, parts):
+    return self.reply(200, {'access_token': uuid.uuid4().hex, 'expires_in': 3600})
+
+  def appid(self, parts):
+    # management/v4/TENANT/...
+    path = '/'.join(parts[3:])
+    if path.startswith('config/idps/cloud_directory'):
+      return self.reply(200, {'isActive': True})
+    if path.startswith('config/idps/'):
+      return self.reply(200, {'isActive': False})
+    if path == 'config/redirect_uris':
+      return self.reply(204)
+    if path == 'applications':
+      if self.command == 'POST':
+        app = dict(self.json_body(), clientId=uuid.uuid4().hex, tenantId=parts[2], secret=uuid.uuid4().hex,
+          oAuthServerUrl='http://127.0.0.1/oauth/v4/{}'.format(parts[2]))
+        self.state.apps.append(app)
+        return self.reply(200, app)
+      return self.reply(200, {'applications': self.state.apps})
+    if path == 'cloud_directory/Users':
+      return self.reply(200, {'Resources': self.state.users})
+    if path == 'cloud_directory/sign_up':
+      user = self.json_body()
+      self.state.users.append({'displayName': user['emails'][0]['value']})
+      return self.reply(201, {'id': uuid.uuid4().hex})
+    return self.reply(200, {})
+
+  def eventstreams(self, parts):
+    topics = []
+    if self.state.cli_state is not None and os.path.exists(self.state.cli_state):
+      with open(self.state.cli_state) as f:
+        topics = json.load(f).get('topics', [])
+    return self.reply(200, [{'name': x, 'partitions': 1} for x in topics])
+
+
+  '''
+  OpenWhisk
+  '''
+  def openwhisk(self, parts):
+    # v1/namespaces[/ID[/COLLECTION[/NAME...]]] or v1/web/whisk.system/apimgmt/ACTION.http
+    namespaces = self.state.namespaces
+    if parts[1:4] == ['web', 'whisk.system', 'apimgmt']:
+      return self.apimgmt(parts[4])
+    if len(parts) == 2:
+      if self.command == 'POST':
+        body = self.json_body()
+        ns = {
+          'id': str(uuid.uuid4()), 'name': body['name'], 'resource_group_id': body.get('resource_group_id'),
+          'packages': {}, 'actions': {}, 'triggers': {}, 'rules': {}, 'apis': {}
+        }
+        namespaces[ns['id']] = ns
+        return self.reply(201, {k: v for k, v in ns.items() if k in ['id', 'name', 'resource_group_id']})
+      rows = sorted(namespaces.values(), key=lambda x: x['name'])
+      offset, limit = int(self.query.get('offset', 0)), int(self.query.get('limit', 200))
+      return self.reply(200, {
+        'namespaces': [{'id': x['id'], 'name': x['name']} for x in rows[offset:offset + limit]],
+        'total_count': len(rows), 'offset': offset, 'limit': limit
+      })
+
+    ns = namespaces.get(parts[2])
+    if ns is None:
+      return self.reply(404, {'error': 'The requested resource does not exist.'})
+    if len(parts) == 3:
+      if self.command == 'DELETE':
+        del namespaces[parts[2]]
+        return self.reply(200, {'id': parts[2]})
+      return self.reply(200, {'id': ns['id'], 'name': ns['name']})
+
+    entities = ns.get(parts[3]) if parts[3] != 'apis' else None
+    if entities is None:
+      return self.reply(404, {'error': 'The requested resource does not exist.'})
+    name = '/'.join(parts[4:])
+    if len(name) == 0:
+      skip, limit = int(self.query.get('skip', 0)), int(self.query.get('limit', 30))
+      if limit > 200:
+        return self.reply(400, {'error': 'The value {} exceeds the allowed limit 200.'.format(limit)})
+      rows = [self.entity(ns, k, v, False) for k, v in sorted(entities.items())]
+      return self.reply(200, rows[skip:skip + (limit or len(rows))])
+
+    current = entities.get(name)
+    if self.command == 'PUT':
+      if current is not None and self.query.get('overwrite') != 'true':
+        return self.reply(409, {'error': 'resource already exists'})
+      body = self.json_body() or {}
+      if parts[3] == 'actions' and 'exec' not in body:
+        return self.reply(400, {'error': 'exec undefined'})
+      entities[name] = dict(body, version='0.0.{}'.format(1 if current is None else int(current['version'][4:]) + 1))
+      return self.reply(200, self.entity(ns, name, entities[name], True))
+    if current is None:
+      return self.reply(404, {'error': 'The requested resource does not exist.'})
+    if self.command == 'DELETE':
+      del entities[name]
+      return self.reply(200, self.entity(ns, name, current, False))
+    entity = self.entity(ns, name, current, self.query.get('code') != 'false')
+    if parts[3] == 'packages':
+      entity['actions'] = [
+        {'name': k.split('/')[-1]} for k in sorted(ns['actions'].keys()) if k.startswith(name + '/')
+      ]
+    return self.reply(200, entity)
+
+  # an entity in a package has "NAMESPACE/PACKAGE" as its namespace
+  def entity(self, ns, name, body, code):
+    path = name.split('/')
+    entity = dict(body, namespace='/'.join([ns['id']] + path[:-1]), name=path[-1])
+    if 'exec' in entity and not code:
+      entity['exec'] = {k: v for k, v in entity['exec'].items() if k != 'code'}
+    return entity
+
+  # API Gateway by the apimgmt actions, scoped by spaceguid like the wsk CLI calls them
+  def apimgmt(self, action):
+    ns = self.state.namespaces.get(self.query.get('spaceguid'))
+    if ns is None or len(self.query.get('accesstoken', '')) == 0:
+      return self.reply(401, {'error': 'unauthorized'})
+    url = 'http://{}:{}/gws/apigateway/api/{}'.format(*self.server.server_address, ns['id'])
+    if action == 'getApi.http':
+      return self.reply(200, {'apis': [
+        {'id': k, 'key': k, 'value': {'namespace': ns['id'], 'gwApiActivated': True, 'gwApiUrl': url, 'apidoc': v}}
+        for k, v in sorted(ns['apis'].items()) if k == self.query.get('basepath', k)
+      ]})
+    if action == 'createApi.http':
+      doc = self.json_body()['apidoc']
+      swagger = ns['apis'].setdefault(doc['gatewayBasePath'], {
+        'swagger': '2.0', 'basePath': doc['gatewayBasePath'], 'info': {'title': doc['apiName']}, 'paths': {}
+      })
+      swagger['paths'].setdefault(doc['gatewayPath'], {})[doc['gatewayMethod'].lower()] = {
+        'operationId': doc['action']['name'],
+        'x-openwhisk': {
+          'namespace': doc['action']['namespace'], 'action': doc['action']['name'], 'url': doc['action']['backendUrl']
+        }
+      }
+      return self.reply(200, {'apidoc': swagger, 'gwApiUrl': url})
+    if action == 'deleteApi.http':
+      ns['apis'].pop(self.query.get('basepath'), None)
+      return self.reply(200, {})
+    return self.reply(404, {'error': 'no apimgmt action {}'.format(action)})
+
+
+def serve(port=0, cli_state=None):
+  handler = type('StubHandler', (Handler,), {'state': State(cli_state)})
+  server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+  server.daemon_threads = True
+  return server
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description="""
+  serve the HTTP stubs for the offline benchmarks.
+  the URL is printed to stdout once it's ready.
+  """)
+  parser.add_argument('-p', '--port', default=0, type=int, help='port. 0 picks a free one')
+  parser.add_argument('-s', '--cli-state', help='state file of the fake ibmcloud, for Event Streams topics')
+
+  return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv[1:])
+  server = serve(args.port, args.cli_state)
+  print('http://127.0.0.1:{}'.format(server.server_address[1]), flush=True)
+  server.serve_forever()
@@ -0,0 +1,106 @@
+import os
+import json
+import glob
+import random
+import shutil
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# a floor map is 1080x1920, cut into congestion areas of 67.5x60 like the c4c tenant
+AREA_HEIGHT = 67.5
+AREA_WIDTH = 60
+AREAS_PER_FLOOR = int(1080 / AREA_HEIGHT) * int(1920 / AREA_WIDTH)
+
+
+'''
+Synthetic tenants for the benchmarks.
+a tenant of N assets is a site with one building and as many floors as N areas need,
+with staff and shops scaled along. the tree mirrors the repo, so scripts/ runs against it as it is.
+'''
+def assets(n, rng):
+  site = 'bench-site'
+  building = 'bench-building'
+  floors = max(1, -(-n // AREAS_PER_FLOOR))
+  out = [
+    {
+      'id': site, 'name': site, 'description': 'synthetic site', 'type': 'site', 'belongings': [building],
+      'mapCoordinate': {'lat': 0, 'lng': 0, 'height': 1080, 'width': 1920},
+      'realCoordinate': {}, 'settings': {}, 'isLogical': True
+    },
+    {
+      'id': building, 'name': building, 'description': 'synthetic building', 'type': 'building',
+      'belongs': site, 'belongings': ['bench-floor-{}'.format(i) for i in range(floors)],
+      'mapCoordinate': {'lat': 0, 'lng': 0, 'height': 1080, 'width': 1920},
+      'realCoordinate': {}, 'settings': {}, 'isLogical': True
+    }
+  ]
+
+  areas = []
+  for f in range(floors):
+    floor = 'bench-floor-{}'.format(f)
+    count = min(AREAS_PER_FLOOR, n - f * AREAS_PER_FLOOR)
+    names = []
+    for i in range(count):
+      lat = (i // int(1920 / AREA_WIDTH)) * AREA_HEIGHT
+      lng = (i % int(1920 / AREA_WIDTH)) * AREA_WIDTH
+      name = 'congestion-{}-{:g}-{:g}'.format(f, lat, lng)
+      names.append(name)
+      areas.append({
+        'id': name, 'name': name, 'description': 'logical congestion area', 'type': 'area',
+        'subType': rng.choice(['store', 'aisle', 'toilet', 'parking']), 'belongs': floor, 'belongings': [],
+        'mapCoordinate': {'lat': lat, 'lng': lng, 'height': AREA_HEIGHT, 'width': AREA_WIDTH},
+        'realCoordinate': {}, 'settings': {'coef': rng.random()}, 'isLogical': True
+      })
+    out.append({
+      'id': floor, 'name': floor, 'description': 'synthetic floor', 'type': 'floor', 'belongs': building,
+      'belongings': names, 'mapCoordinate': {'lat': 0, 'lng': 0, 'height': 1080, 'width': 1920},
+      'realCoordinate': {}, 'settings': {}, 'isLogical': True
+    })
+  return out + areas
+
+def staff(areas, n, rng):
+  return [{
+    'type': 'staff', 'id': 'st{:06d}'.format(i), 'deviceId': ['{:08X}-0000-4000-8000-000000000000'.format(i)],
+    'roles': rng.sample(['counter', 'aisle-arrangement', 'store-cleaning', 'ware-house', 'toilet-cleaning'], 2),
+    'belongs': rng.choice(areas)['id'],
+    'duration': {
+      'slot': {'start': '09:00:00', 'end': '17:00:00'},
+      'on_job': rng.randint(10, 100), 'last_rest': rng.randint(0, 120)
+    }
+  } for i in range(n)]
+
+def shops(n):
+  return [{
+    'name': 'bench-shop-{}'.format(i),
+    'image': {'url': 'http://127.0.0.1/files', 'options': {'body': json.dumps({'key': 'shop-{}.png'.format(i)})}}
+  } for i in range(n)]
+
+# build ROOT/scripts (a copy of the repo's) and ROOT/data/{common,tenants/TENANT}, and return the tenant name
+def create(root, n, seed=0):
+  rng = random.Random(seed)
+  tenant = 'bench-{}'.format(n)
+
+  shutil.copytree(os.path.join(REPO, 'scripts'), os.path.join(root, 'scripts'),
+    ignore=shutil.ignore_patterns('__pycache__', '.credentials*', '.namespaces'))
+  shutil.copytree(os.path.join(REPO, 'data', 'common'), os.path.join(root, 'data', 'common'))
+
+  base = os.path.join(root, 'data', 'tenants', tenant)
+  os.makedirs(os.path.join(base, 'cloudant'))
+  os.makedirs(os.path.join(base, 'cos'))
+  # the same index definitions as c4c
+  shutil.copytree(os.path.join(REPO, 'data', 'tenants', 'c4c', 'cloudant', 'indexes'),
+    os.path.join(base, 'cloudant', 'indexes'))
+
+  docs = assets(n, rng)
+  areas = [x for x in docs if x['type'] == 'area']
+  for name, data in [
+    ('assets', docs), ('assets_staff', staff(areas, max(1, n // 20), rng)), ('shops', shops(max(1, n // 50)))
+  ]:
+    with open(os.path.join(base, 'cloudant', '{}.json'.format(name)), 'w') as f:
+      json.dump(data, f)
+
+  # images of shops and the floor map, reusing the c4c ones
+  images = sorted(glob.glob(os.path.join(REPO, 'data', 'tenants', 'c4c', 'cos', '*')))
+  for i in range(max(1, n // 100)):
+    shutil.copyfile(images[i % len(images)], os.path.join(base, 'cos', 'shop-{}.png'.format(i)))
+
+  return tenant
@@ -24,92 +24,210 @@
 #
 
 # GOAL: To generate dummy dat to simulate store-staffs' and their devices' parameters
+#
+# staff are drawn in NumPy batches with a fixed seed, so millions of them are generated in seconds
+# and the same seed always gives the same staff. records are streamed to a JSON array, NDJSON,
+# or straight into Cloudant by the seed loader of scripts/, without keeping them all in memory.
+#
+#   python3 create-assets-staff.py                              # 17 staff and 3 managers to ../cloudant/assets_staff.json
+#   python3 create-assets-staff.py -n 1000000 -o staff.ndjson   # NDJSON, which the seed loader reads as well
+#   python3 create-assets-staff.py -n 1000000 -c ../../../../scripts/.credentials   # into the assets_staff database
 
-import random
+import argparse
 import json
+import os
+import sys
+import numpy as np
 
-def main(dict):
+HERE = os.path.dirname(os.path.abspath(__file__))
+ASSETS = os.path.join(HERE, "..", "cloudant", "assets.json")
+OUTPUT = os.path.join(HERE, "..", "cloudant", "assets_staff.json")
+SCRIPTS = os.path.join(HERE, "..", "..", "..", "..", "scripts")
+DEVICE_ID = "E9B0E15F-19D0-4721-A7E4-DB6C0B220FB4"
+BATCH = 100000
 
-    data = {
-        "staff": {
-            "id": ["st0001", "st0002", "st0003", "st0004", "st0005", "st0006", "st0007", "st0008", "st0009", "st0010", "st0011", "st0012", "st0013", "st0014", "st0015", "st0016", "st0017"],
-            "deviceId": ["D8AA1D5F-A10E-4C09-98BA-BD481709E11D", "D8AA1D5F-A10E-4C09-98BA-BD481709E12D", "D8AA1D5F-A10E-4C09-98BA-BD481709E13D", "D8AA1D5F-A10E-4C09-98BA-BD481709E14D", "D8AA1D5F-A10E-4C09-98BA-BD481709E15D", "D8AA1D5F-A10E-4C09-98BA-BD481709E16D", "D8AA1D5F-A10E-4C09-98BA-BD481709E17D", "D8AA1D5F-A10E-4C09-98BA-BD481709E18D", "D8AA1D5F-A10E-4C09-98BA-BD481709E19D", "D8AA1D5F-A10E-4C09-98BA-BD481709E20D", "D8AA1D5F-A10E-4C09-98BA-BD481709E21D", "D8AA1D5F-A10E-4C09-98BA-BD481709E22D", "D8AA1D5F-A10E-4C09-98BA-BD481709E23D", "D8AA1D5F-A10E-4C09-98BA-BD481709E24D", "D8AA1D5F-A10E-4C09-98BA-BD481709E25D", "D8AA1D5F-A10E-4C09-98BA-BD481709E26D", "D8AA1D5F-A10E-4C09-98BA-BD481709E27D"],
-            "roles": ["counter", "aisle-arrangement", "store-cleaning", "ware-house", "toilet-cleaning"],
-            "time_slot": {
-                "slot01": {"start": "9:00:00", "end": "11:00:00"},
-                "slot02": {"start": "10:00:00", "end": "12:00:00"},
-                "slot03": {"start": "11:00:00", "end": "13:00:00"},
-                "slot04": {"start": "12:00:00", "end": "14:00:00"},
-                "slot05": {"start": "13:00:00", "end": "15:00:00"},
-                "slot06": {"start": "14:00:00", "end": "16:00:00"},
-                "slot07": {"start": "15:00:00", "end": "17:00:00"},
-                "slot08": {"start": "16:00:00", "end": "18:00:00"},
-                "slot09": {"start": "17:00:00", "end": "19:00:00"},
-                "slot10": {"start": "18:00:00", "end": "20:00:00"},
-                "slot11": {"start": "19:00:00", "end": "21:00:00"},
-                "slot12": {"start": "20:00:00", "end": "22:00:00"}
-            },
-            "belongs": ["congestion-0-0", "congestion-67.5-0", "congestion-135-0", "congestion-202.5-0", "congestion-877.5-0", "congestion-945-0", "congestion-1012.5-0", "congestion-0-60", "congestion-67.5-60", "congestion-135-60", "congestion-202.5-60", "congestion-877.5-60", "congestion-945-60", "congestion-1012.5-60", "congestion-0-120", "congestion-67.5-120", "congestion-135-120", "congestion-202.5-120", "congestion-877.5-120", "congestion-945-120", "congestion-1012.5-120", "congestion-0-180", "congestion-67.5-180", "congestion-135-180", "congestion-202.5-180", "congestion-877.5-180", "congestion-945-180", "congestion-1012.5-180", "congestion-0-240", "congestion-67.5-240", "congestion-135-240", "congestion-202.5-240", "congestion-877.5-240", "congestion-945-240", "congestion-1012.5-240", "congestion-0-300", "congestion-67.5-300", "congestion-135-300", "congestion-202.5-300", "congestion-877.5-300", "congestion-945-300", "congestion-1012.5-300", "congestion-0-360", "congestion-67.5-360", "congestion-135-360", "congestion-202.5-360", "congestion-877.5-360", "congestion-945-360", "congestion-1012.5-360", "congestion-0-420", "congestion-67.5-420", "congestion-135-420", "congestion-202.5-420", "congestion-877.5-420", "congestion-945-420", "congestion-1012.5-420", "congestion-0-480", "congestion-67.5-480", "congestion-877.5-480", "congestion-945-480", "congestion-1012.5-480", "congestion-0-540", "congestion-67.5-540", "congestion-877.5-540", "congestion-945-540", "congestion-1012.5-540", "congestion-0-600", "congestion-67.5-600", "congestion-877.5-600", "congestion-945-600", "congestion-1012.5-600", "congestion-0-660", "congestion-67.5-660", "congestion-877.5-660", "congestion-945-660", "congestion-1012.5-660", "congestion-0-720", "congestion-67.5-720", "congestion-877.5-720", "congestion-945-720", "congestion-1012.5-720", "congestion-0-780", "congestion-67.5-780", "congestion-877.5-780", "congestion-945-780", "congestion-1012.5-780", "congestion-0-840", "congestion-67.5-840", "congestion-742.5-840", "congestion-810-840", "congestion-877.5-840", "congestion-945-840", "congestion-1012.5-840", "congestion-0-900", "congestion-67.5-900", "congestion-742.5-900", "congestion-810-900", "congestion-877.5-900", "congestion-945-900", "congestion-1012.5-900", "congestion-0-960", "congestion-67.5-960", "congestion-742.5-960", "congestion-810-960", "congestion-877.5-960", "congestion-945-960", "congestion-1012.5-960", "congestion-0-1020", "congestion-67.5-1020", "congestion-742.5-1020", "congestion-810-1020", "congestion-877.5-1020", "congestion-945-1020", "congestion-1012.5-1020", "congestion-0-1080", "congestion-67.5-1080", "congestion-742.5-1080", "congestion-810-1080", "congestion-877.5-1080", "congestion-945-1080", "congestion-1012.5-1080", "congestion-0-1140", "congestion-67.5-1140", "congestion-742.5-1140", "congestion-810-1140", "congestion-877.5-1140", "congestion-945-1140", "congestion-1012.5-1140", "congestion-0-1200", "congestion-67.5-1200", "congestion-742.5-1200", "congestion-810-1200", "congestion-877.5-1200", "congestion-945-1200", "congestion-1012.5-1200", "congestion-67.5-1260", "congestion-742.5-1260", "congestion-810-1260", "congestion-877.5-1260", "congestion-945-1260", "congestion-1012.5-1260", "congestion-67.5-1320", "congestion-742.5-1320", "congestion-810-1320", "congestion-877.5-1320", "congestion-945-1320", "congestion-1012.5-1320", "congestion-67.5-1380", "congestion-742.5-1380", "congestion-810-1380", "congestion-877.5-1380", "congestion-945-1380", "congestion-1012.5-1380", "congestion-67.5-1440", "congestion-742.5-1440", "congestion-810-1440", "congestion-877.5-1440", "congestion-945-1440", "congestion-1012.5-1440", "congestion-67.5-1500", "congestion-742.5-1500", "congestion-810-1500", "congestion-877.5-1500", "congestion-945-1500", "congestion-1012.5-1500", "congestion-67.5-1560", "congestion-742.5-1560", "congestion-810-1560", "congestion-877.5-1560", "congestion-945-1560", "congestion-1012.5-1560", "congestion-67.5-1620", "congestion-135-1620", "congestion-202.5-1620", "congestion-742.5-1620", "congestion-810-1620", "congestion-877.5-1620", "congestion-945-1620", "congestion-67.5-1680", "congestion-135-1680", "congestion-202.5-1680", "congestion-742.5-1680", "congestion-810-1680", "congestion-877.5-1680", "congestion-67.5-1740", "congestion-135-1740", "congestion-202.5-1740", "congestion-742.5-1740", "congestion-810-1740", "congestion-135-1800", "congestion-202.5-1800", "congestion-135-1860", "congestion-202.5-1860"]
-        },
-
-        "manager": {
-            "id": ["mg0001", "mg0002", "mg0003"],
-            "deviceId": ["D8AA1D5F-A10E-4C09-98BA-BD481709E28D", "D8AA1D5F-A10E-4C09-98BA-BD481709E29D", "D8AA1D5F-A10E-4C09-98BA-BD481709E30D"],
-            "roles": ["logistics", "customer-service", "orders"],
-            "time_slot": {
-                "slot01": {"start": "9:00:00", "end": "17:00:00"},
-                "slot02": {"start": "14:00:00", "end": "22:00:00"}
-            },
-            "belongs": ["imaginary-shopping-mall-1st-floor", "imaginary-shopping-mall-2nd-floor"]
-        }
+# staff work in areas, and managers on floors, of assets.json
+KINDS = {
+    "staff": {
+        "prefix": "st",
+        "roles": ["counter", "aisle-arrangement", "store-cleaning", "ware-house", "toilet-cleaning"],
+        "time_slot": [{"start": "{}:00:00".format(h), "end": "{}:00:00".format(h + 2)} for h in range(9, 21)],
+        "belongs": "area"
+    },
+    "manager": {
+        "prefix": "mg",
+        "roles": ["logistics", "customer-service", "orders"],
+        "time_slot": [{"start": "9:00:00", "end": "17:00:00"}, {"start": "14:00:00", "end": "22:00:00"}],
+        "belongs": "floor"
     }
+}
 
-    madeData = []
-    for x in range(0, 17):
-        madeData.append(makeData(data["staff"], "staff", x)["returnVal"])
-    for x in range(0, 3):
-        madeData.append(makeData(data["manager"], "manager", x)["returnVal"])
+
+def main(dict):
+    belongs = load_belongs(dict.get("assets", ASSETS))
+    madeData = list(generate(dict.get("staff", 17), dict.get("managers", 3), belongs, dict.get("seed", 0)))
 
     return {"docs": json.dumps({"docs": (madeData)}),
             "dbname": "assets_staff"
             }
 
 
-def makeData(dict, typeA, x):
-    # target = random.choices([list(data.keys())], weights=[80, 20], k=1)
-    #     target = random.choices(["staff","manager"], weights=[90, 10], k=1)
-    target = list(dict.keys())[0]
-    dict0 = dict  # dict[target[0]]
-    sampleStaffData = {
-        "type": typeA,
-        # "_id": dict0["id"][x],
-        "id": dict0["id"][x],
-        # dict0["deviceId"][x],
-        "deviceId":   ["E9B0E15F-19D0-4721-A7E4-DB6C0B220FB4"],
-        "roles": list(set(random.choices(dict0["roles"], k=random.randint(1, 3)))),
-        "belongs": random.choice(dict0["belongs"]),
-        "duration": {
-            "slot": dict0["time_slot"][random.choice(list(dict0["time_slot"]))],
-            "on_job": random.randint(10, 100),
-            "last_rest": random.randint(0, 120)
+def load_belongs(path):
+    belongs = {"area": [], "floor": []}
+    with open(path) as f:
+        for asset in json.load(f):
+            if asset.get("type") in belongs:
+                belongs[asset["type"]].append(asset["id"])
+    return belongs
+
+
+def draw(rng, kind, n, nbelongs):
+    # one array per field for each batch of the n records
+    nroles = len(kind["roles"])
+    for start in range(0, n, BATCH):
+        size = min(BATCH, n - start)
+        # 1 to 3 distinct roles: the first ones of a random order of all roles, coded for role_set()
+        order = np.argsort(rng.random((size, nroles)), axis=1)[:, :3]
+        count = rng.integers(1, min(3, nroles) + 1, size=size)
+        yield start, {
+            "roles": (order * [nroles * nroles, nroles, 1]).sum(axis=1) * 4 + count,
+            "belongs": rng.integers(0, nbelongs, size=size),
+            "slot": rng.integers(0, len(kind["time_slot"]), size=size),
+            "on_job": rng.integers(10, 101, size=size),
+            "last_rest": rng.integers(0, 121, size=size)
         }
-    }
 
-    return {"returnVal": sampleStaffData}
+
+def role_set(kind, index):
+    nroles = len(kind["roles"])
+    order = [index // 4 // (nroles * nroles), index // 4 // nroles % nroles, index // 4 % nroles]
+    return [kind["roles"][j] for j in order[:index % 4]]
+
+
+def columns(staff, managers, belongs, seed=0):
+    for index, (typeA, count) in enumerate([("staff", staff), ("manager", managers)]):
+        kind = KINDS[typeA]
+        targets = belongs[kind["belongs"]]
+        if count > 0 and len(targets) == 0:
+            raise Exception("no {} in the assets for {}".format(kind["belongs"], typeA))
+
+        # each type has its own stream, so the number of managers doesn't change the staff
+        rng = np.random.default_rng([seed, index])
+        width = max(4, len(str(count)))
+        for start, arrays in draw(rng, kind, count, len(targets)):
+            ids = ["{}{:0{}d}".format(kind["prefix"], x, width) for x in range(start + 1, start + len(arrays["slot"]) + 1)]
+            yield typeA, kind, targets, ids, arrays
+
+
+def generate(staff, managers, belongs, seed=0):
+    roleSets = {}
+    for typeA, kind, targets, ids, arrays in columns(staff, managers, belongs, seed):
+        roles, belongsAt, slot, onJob, lastRest = (
+            arrays[k].tolist() for k in ["roles", "belongs", "slot", "on_job", "last_rest"]
+        )
+        for i in range(len(ids)):
+            if (typeA, roles[i]) not in roleSets:
+                roleSets[(typeA, roles[i])] = role_set(kind, roles[i])
+            yield {
+                "type": typeA,
+                "id": ids[i],
+                "deviceId": [DEVICE_ID],
+                "roles": list(roleSets[(typeA, roles[i])]),
+                "belongs": targets[belongsAt[i]],
+                "duration": {
+                    "slot": dict(kind["time_slot"][slot[i]]),
+                    "on_job": onJob[i],
+                    "last_rest": lastRest[i]
+                }
+            }
+
+
+def lines(staff, managers, belongs, seed=0):
+    # the same records as generate() as JSON text, formatted from pieces serialized once
+    template = (
+        '{{"type": {}, "id": "{}", "deviceId": {}, "roles": {}, "belongs": {}, '
+        '"duration": {{"slot": {}, "on_job": {}, "last_rest": {}}}}}'
+    )
+    device = json.dumps([DEVICE_ID])
+    roleSets = {}
+    for typeA, kind, targets, ids, arrays in columns(staff, managers, belongs, seed):
+        typeJSON = json.dumps(typeA)
+        targetsJSON = [json.dumps(x) for x in targets]
+        slotsJSON = [json.dumps(x) for x in kind["time_slot"]]
+        roles, belongsAt, slot, onJob, lastRest = (
+            arrays[k].tolist() for k in ["roles", "belongs", "slot", "on_job", "last_rest"]
+        )
+        for i in range(len(ids)):
+            if (typeA, roles[i]) not in roleSets:
+                roleSets[(typeA, roles[i])] = json.dumps(role_set(kind, roles[i]))
+            yield template.format(
+                typeJSON, ids[i], device, roleSets[(typeA, roles[i])], targetsJSON[belongsAt[i]],
+                slotsJSON[slot[i]], onJob[i], lastRest[i]
+            )
+
+
+def write_json(docs, f):
+    # a JSON array written element by element
+    f.write("[")
+    for i, doc in enumerate(docs):
+        if i > 0:
+            f.write(",\n")
+        f.write(doc)
+    f.write("]\n")
+
+
+def write_ndjson(docs, f):
+    for doc in docs:
+        f.write(doc)
+        f.write("\n")
+
+
+def load_cloudant(docs, credential_file, database, diff=True):
+    sys.path.insert(0, SCRIPTS)
+    import credentials
+    import cloudant_loader
+    import service_cloudant
+
+    cred = credentials.get_store(credential_file).get_service_credentials("CLOUDANT", "writer")
+    if cred is None:
+        raise Exception("no Cloudant credentials in {}".format(credential_file))
+
+    client = service_cloudant.connect(cred)
+    client.create_database(database)
+    cloudant_loader.load_docs(client, database, ((x, len(json.dumps(x))) for x in docs), diff=diff)
+    client.disconnect()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="""
+    generate staff and managers of the imaginary shopping mall.
+    """)
+    parser.add_argument("-a", "--assets", default=ASSETS, help="assets.json to take areas and floors from")
+    parser.add_argument("-n", "--staff", default=17, type=int, help="number of staff")
+    parser.add_argument("-m", "--managers", default=3, type=int, help="number of managers")
+    parser.add_argument("-s", "--seed", default=0, type=int, help="random seed")
+    parser.add_argument("-o", "--output", default=OUTPUT,
+                        help="file path to write. *.ndjson is written as NDJSON, - is NDJSON to stdout, others are a JSON array")
+    parser.add_argument("-c", "--credential-file",
+                        help="write to Cloudant with the writer credentials in this file instead of --output")
+    parser.add_argument("-d", "--database", default="assets_staff", help="database written with --credential-file")
+    parser.add_argument("--append", action="store_true",
+                        help="post all records to Cloudant instead of writing only new or changed ones")
+
+    return parser.parse_args(args)
 
 
 if __name__ == "__main__":
-    assets = main({})
-    with open('../cloudant/assets_staff.json', 'w') as f:
-        f.write(json.dumps(json.loads(assets['docs'])['docs']))
-
-#     dataFormat = {
-#   "type": "",
-#   "id": "",
-#   "roles": ["",""],
-#   "belongs": "",
-#   "duration": {
-#     "on_job": 0,
-#     "last_rest": 0
-#   }
-# }
+    args = parse_args(sys.argv[1:])
+    belongs = load_belongs(args.assets)
+
+    if args.credential_file is not None:
+        load_cloudant(generate(args.staff, args.managers, belongs, args.seed), args.credential_file, args.database, not args.append)
+    elif args.output == "-":
+        write_ndjson(lines(args.staff, args.managers, belongs, args.seed), sys.stdout)
+    else:
+        with open(args.output, "w") as f:
+            if args.output.endswith(".ndjson"):
+                write_ndjson(lines(args.staff, args.managers, belongs, args.seed), f)
+            else:
+                write_json(lines(args.staff, args.managers, belongs, args.seed), f)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import contextlib
+import base64
+import json
+import sys
+import time
+from urllib import parse
+import numpy as np
+
+# helpers of scripts/, for the IAM token cache, the pooled HTTP session and the credential files.
+# the action zip built by scripts/function_dummy_generator.py has them next to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+import util
+import http_client
+import credentials
+
+# period of counting in the payload, and of the periodic trigger, in msec
+PERIOD = 1000 * 60 * 5
+TICK = 1.0
+STRUCTURAL = ['site', 'building', 'outside', 'floor']
+# events are batched by the producer until a batch is full or has waited this long
+KAFKA_BATCH_BYTES = 512 * 1024
+KAFKA_LINGER_MS = 50
+
+# load factor by hour of day, interpolated between hours
+CURVES = {
+  'flat': [1.0] * 24,
+  'mall': [
+    0.05, 0.05, 0.05, 0.05, 0.05, 0.1, 0.2, 0.3, 0.5, 0.8, 1.0, 1.2,
+    1.5, 1.4, 1.1, 1.0, 1.1, 1.3, 1.5, 1.3, 0.9, 0.5, 0.2, 0.1
+  ],
+}
+
+# kinds of events, as generate() of dummy-generator.js makes them
+CONGESTION = 0
+SANITIZATION = 1
+DISINFECTION = 2
+
+
+'''
+Synthetic sensor events at a target rate.
+an event is the JSON that generate() of dummy-generator.js makes: deviceType, deviceId, eventType and
+data of payload and time. each tick draws the values of all its events at once by NumPy, and formats them
+into a template per asset, so the rate isn't bound by building an object per event.
+'''
+class Generator:
+  # rate is events per second. without it, each asset sends one event per period like dummy-generator.js.
+  # curve is a name of CURVES or 24 load factors, which scale both the rate and the congestion
+  def __init__(self, assets, rate=None, curve='flat', period=PERIOD, seed=None):
+    self.period = int(period)
+    if isinstance(curve, str):
+      curve = CURVES[curve] if curve in CURVES else curve.split(',')
+    self.curve = [float(x) for x in curve]
+    if len(self.curve) != 24:
+      raise Exception('a load curve needs 24 values, one per hour')
+
+    self.kinds = []
+    self.coefs = []
+    self.templates = []
+    for asset in assets:
+      kind = event_kind(asset)
+      if kind is None:
+        continue
+      coef = (asset.get('settings') or {}).get('coef')
+      self.kinds.append(kind)
+      self.coefs.append(1 + coef if coef else 1)
+      self.templates.append(template(asset, kind, self.period))
+
+    if len(self.kinds) == 0:
+      raise Exception('there is no assets')
+    self.kinds = np.array(self.kinds)
+    self.coefs = np.array(self.coefs, dtype=float)
+    self.rate = float(rate) if rate is not None else len(self.kinds) * 1000 / self.period
+    self.rng = np.random.default_rng(seed)
+    # events are spread over ticks by carrying the fraction, and over assets by a cursor
+    self.carry = 0.0
+    self.cursor = 0
+
+  def load(self, ms):
+    hours = (ms / 1000 / 3600) % 24
+    h = int(hours)
+    return self.curve[h] + (self.curve[(h + 1) % 24] - self.curve[h]) * (hours - h)
+
+  # events between start and start + seconds, as JSON text sorted by time
+  def tick(self, start, seconds):
+    load = self.load(start)
+    self.carry += self.rate * seconds * load
+    n = int(self.carry)
+    self.carry -= n
+    if n == 0:
+      return []
+
+    # every asset sends as evenly as the number of events allows
+    full, rest = divmod(n, len(self.kinds))
+    index = np.concatenate([
+      np.tile(np.arange(len(self.kinds)), full), (self.cursor + np.arange(rest)) % len(self.kinds)
+    ])
+    self.cursor = (self.cursor + rest) % len(self.kinds)
+
+    kinds = self.kinds[index]
+    r = self.rng.random(n)
+    a = np.zeros(n, dtype=np.int64)
+    b = np.zeros(n, dtype=np.int64)
+
+    congestion = kinds == CONGESTION
+    a[congestion] = np.floor(np.minimum(0.99, r[congestion] * self.coefs[index[congestion]] * load) * 50)
+    sanitization = kinds == SANITIZATION
+    a[sanitization] = np.floor(r[sanitization] * 10)
+    disinfection = kinds == DISINFECTION
+    a[disinfection] = np.floor(r[disinfection] * 100)
+    b[disinfection] = np.floor((100 - a[disinfection]) / 100 * 100)
+
+    # distinct timestamps, since the same timestamp of all data might cause an error when getting data from es
+    ms = start + (np.arange(n) * (seconds * 1000 / n)).astype(np.int64)
+    times = np.datetime_as_string(ms.astype('datetime64[ms]'), unit='ms')
+
+    templates = self.templates
+    return [
+      templates[i].format(a=x, b=y, t=t)
+      for i, x, y, t in zip(index.tolist(), a.tolist(), b.tolist(), times.tolist())
+    ]
+
+
+def event_kind(asset):
+  if asset.get('type') in STRUCTURAL:
+    return None
+  if asset.get('type') in ['area', 'line']:
+    return CONGESTION
+  if asset.get('type') == 'thing':
+    return {'handwash_stand': SANITIZATION, 'garbage_bin': DISINFECTION}.get(asset.get('subType'))
+  return None
+
+# JSON of an event with the fields {a}, {b} and {t} for its values and time
+def template(asset, kind, period):
+  id = asset['id']
+  if kind == CONGESTION:
+    device_type = '{}_people_counter'.format(asset['type'])
+    payload = {'area': id, 'count': '@A@', 'period': period}
+  elif kind == SANITIZATION:
+    device_type = 'handwash_monitor'
+    payload = {'handwashStand': id, 'count': '@A@', 'period': period}
+  else:
+    device_type = 'garbage_bin_monitor'
+    payload = {'garbageBin': id, 'distance': '@A@', 'max_depth': 100, 'amount_rate': '@B@'}
+
+  text = json.dumps({
+    'deviceType': device_type,
+    'deviceId': '{}-{}'.format(device_type, id),
+    'eventType': 'send_data',
+    'data': {'payload': payload, 'time': '@T@'}
+  })
+  text = text.replace('{', '{{').replace('}', '}}')
+  return text.replace('"@A@"', '{a}').replace('"@B@"', '{b}').replace('"@T@"', '"{t}Z"')
+
+
+'''
+sinks
+'''
+class FileSink:
+  # NDJSON to a file, or to stdout by '-'
+  def __init__(self, path='-'):
+    self.file = sys.stdout if path == '-' else open(path, 'a')
+
+  def send(self, events):
+    if len(events) > 0:
+      self.file.write('\n'.join(events))
+      self.file.write('\n')
+
+  def close(self):
+    self.file.flush()
+    if self.file is not sys.stdout:
+      self.file.close()
+
+class KafkaSink:
+  # Event Streams or any Kafka. each event is a message, since the data recorder reads them one by one,
+  # and the messages of a tick go out in a few large batches per partition
+  def __init__(self, credentials, topic):
+    from kafka import KafkaProducer
+
+    self.topic = topic
+    self.producer = KafkaProducer(
+      bootstrap_servers=credentials['kafka_brokers_sasl'],
+      security_protocol='SASL_SSL',
+      sasl_mechanism='PLAIN',
+      sasl_plain_username=credentials.get('user', 'token'),
+      sasl_plain_password=credentials['api_key'],
+      batch_size=KAFKA_BATCH_BYTES,
+      linger_ms=KAFKA_LINGER_MS
+    )
+
+  def send(self, events):
+    for event in events:
+      self.producer.send(self.topic, event.encode('utf-8'))
+
+  def close(self):
+    self.producer.flush()
+    self.producer.close()
+
+
+# generate ticks from start (msec). in realtime, a tick is sent once its time has passed
+def run(generator, sink, start, ticks, seconds=TICK, realtime=False):
+  sent = 0
+  begin = time.monotonic()
+  i = 0
+  while ticks is None or i < ticks:
+    t = start + int(i * seconds * 1000)
+    if realtime:
+      wait = (t + seconds * 1000) / 1000 - time.time()
+      if wait > 0:
+        time.sleep(wait)
+    events = generator.tick(t, seconds)
+    sink.send(events)
+    sent += len(events)
+    i += 1
+  return sent, time.monotonic() - begin
+
+
+'''
+assets
+'''
+def get_assets(credentials, database):
+  url = credentials['url'].rstrip('/')
+  u = parse.urlsplit(url)
+  headers = {}
+  if u.username is not None:
+    url = parse.urlunsplit((u.scheme, u.hostname + ('' if u.port is None else ':{}'.format(u.port)), u.path, '', ''))
+    auth = '{}:{}'.format(parse.unquote(u.username), parse.unquote(u.password or ''))
+    headers['Authorization'] = 'Basic ' + base64.b64encode(auth.encode()).decode()
+  elif 'password' in credentials:
+    auth = '{}:{}'.format(credentials['username'], credentials['password'])
+    headers['Authorization'] = 'Basic ' + base64.b64encode(auth.encode()).decode()
+  else:
+    headers['Authorization'] = util.iam_token_cache.get(credentials['apikey'])
+
+  res = http_client.session.request(
+    'GET', '{}/{}/_all_docs?include_docs=true'.format(url, parse.quote(database, safe='')), headers=headers
+  )
+  if res.status != 200:
+    raise Exception('cannot read {} by {}'.format(database, res.reason))
+  return [x['doc'] for x in res.json()['rows'] if 'doc' in x]
+
+def as_json(value):
+  return value if isinstance(value, (dict, list)) else json.loads(value)
+
+
+# IBM Cloud Functions: main function
+# generate the events of the last trigger period, and push them to Event Streams
+def main(params):
+  try:
+    assets = get_assets(as_json(params['cloudant-credentials']), params['cloudant-assets-db'])
+    generator = Generator(
+      assets, params.get('rate'), params.get('curve', 'flat'), params.get('period', PERIOD)
+    )
+    seconds = float(params.get('trigger-period', PERIOD / 1000))
+    sink = KafkaSink(as_json(params['es-credentials']), params['es-topic'])
+    try:
+      sent, elapsed = run(generator, sink, int(time.time() * 1000 - seconds * 1000), 1, seconds)
+    finally:
+      sink.close()
+  except Exception as e:
+    return {'error': str(e)}
+  return {'message': '{} events were sent in {:.1f}s'.format(sent, elapsed)}
+
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description="""
+  generate dummy sensor events of assets at a target rate, to a file, stdout or Event Streams.
+  """)
+  parser.add_argument('-a', '--assets', help='assets JSON file, like data/tenants/c4c/cloudant/assets.json')
+  parser.add_argument('-c', '--credential-file',
+    help='credential file of scripts/. assets are read from Cloudant without --assets, and events go to Event Streams by --kafka')
+  parser.add_argument('-b', '--database', default='assets', help='database of assets')
+  parser.add_argument('-r', '--rate', type=float,
+    help='events per second. one event per asset per period by default')
+  parser.add_argument('-l', '--curve', default='flat',
+    help='load curve: {} or 24 comma-separated factors for each hour'.format('|'.join(CURVES.keys())))
+  parser.add_argument('-p', '--period', default=PERIOD, type=int, help='counting period in the payload in msec')
+  parser.add_argument('-t', '--tick', default=TICK, type=float, help='seconds of events generated at once')
+  parser.add_argument('-n', '--ticks', type=int, help='number of ticks. endless by default')
+  parser.add_argument('-s', '--start', help='ISO 8601 time of the first event. now by default')
+  parser.add_argument('--realtime', action='store_true', help='send each tick when its time comes')
+  parser.add_argument('--seed', type=int, help='random seed')
+  parser.add_argument('-o', '--output', default='-', help='NDJSON file to append events. - is stdout')
+  parser.add_argument('-k', '--kafka', action='store_true', help='send events to Event Streams instead of --output')
+  parser.add_argument('-e', '--topic', default='covsafe', help='topic of Event Streams')
+
+  return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv[1:])
+  store = credentials.get_store(args.credential_file) if args.credential_file is not None else None
+
+  if args.assets is not None:
+    with open(args.assets) as f:
+      assets = json.load(f)
+  elif store is not None and store.get('CLOUDANT_READER_CREDENTIALS') is not None:
+    # the helpers of scripts/ report to stdout, which can be the event stream
+    with contextlib.redirect_stdout(sys.stderr):
+      assets = get_assets(store.get_json('CLOUDANT_READER_CREDENTIALS'), args.database)
+  else:
+    raise Exception('give assets by --assets or --credential-file')
+
+  generator = Generator(assets, args.rate, args.curve, args.period, args.seed)
+
+  if args.kafka:
+    if store is None or store.get('EVENT_STREAMS_WRITER_CREDENTIALS') is None:
+      raise Exception('--kafka needs EVENT_STREAMS_WRITER_CREDENTIALS in --credential-file')
+    sink = KafkaSink(store.get_json('EVENT_STREAMS_WRITER_CREDENTIALS'), args.topic)
+  else:
+    sink = FileSink(args.output)
+
+  if args.start is not None:
+    start = int(np.datetime64(args.start.rstrip('Z'), 'ms').astype(np.int64))
+  else:
+    start = int(time.time() * 1000)
+
+  try:
+    sent, elapsed = run(generator, sink, start, args.ticks, args.tick, args.realtime)
+  except KeyboardInterrupt:
+    sent, elapsed = None, None
+  finally:
+    sink.close()
+  if sent is not None:
+    print('{} events in {:.1f}s ({:.0f} events/s)'.format(sent, elapsed, sent / max(elapsed, 1e-6)), file=sys.stderr)
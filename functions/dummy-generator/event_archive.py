@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import dummy_generator
+import credentials
+
+VERSION = 1
+CHUNK = 100000
+BATCH = 1000
+
+
+'''
+Columnar archive of sensor events, to record a busy day and replay it.
+an archive is a directory of raw column files and meta.json:
+  time.bin    int64 msec of data.time
+  device.bin  int32 index of the dictionary in meta.json
+  N.bin       the numbers of payloads, one typed column per field name, like count or distance
+the dictionary holds each device's event as a template with everything but the time and the numbers,
+so an event is rebuilt by formatting one row. columns are memory-mapped on replay,
+and a batch of events is located by a binary search on the time column without reading the rest.
+events of several partitions or producers arrive out of order, so the rows are sorted by time on close.
+'''
+class ArchiveWriter:
+  def __init__(self, path):
+    self.path = path
+    os.makedirs(path, exist_ok=True)
+    self.count = 0
+    # column name -> dtype. time and device come first
+    self.columns = {'time': 'int64', 'device': 'int32'}
+    self.files = {x: open(self.column_file(x), 'wb') for x in self.columns.keys()}
+    self.templates = {}
+    self.shapes = {}
+    self.buffer = {x: [] for x in self.columns.keys()}
+
+  def column_file(self, name):
+    return os.path.join(self.path, '{}.bin'.format(name))
+
+  # one event, as a dict or its JSON text
+  def add(self, event):
+    if isinstance(event, str):
+      event = json.loads(event)
+
+    payload = event['data']['payload']
+    fields = [k for k, v in payload.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    for field in fields:
+      if field not in self.columns:
+        self.add_column(field, 'float64' if isinstance(payload[field], float) else 'int64')
+      elif self.columns[field] == 'int64' and isinstance(payload[field], float):
+        raise Exception('{} has both integers and floats'.format(field))
+
+    shape = self.shape(event, fields)
+    if shape not in self.templates:
+      self.templates[shape] = len(self.templates)
+
+    self.buffer['time'].append(event['data']['time'].rstrip('Z'))
+    self.buffer['device'].append(self.templates[shape])
+    for name in list(self.columns.keys())[2:]:
+      self.buffer[name].append(payload.get(name, 0) if name in fields else 0)
+
+    self.count += 1
+    if len(self.buffer['time']) >= CHUNK:
+      self.flush()
+
+  # template of an event, looked up by everything but its numbers and time to save encoding each event
+  def shape(self, event, fields):
+    data = event['data']
+    try:
+      key = (
+        tuple(x for x in event.items() if x[0] != 'data'),
+        tuple(x for x in data.items() if x[0] not in ['payload', 'time']),
+        tuple((k, None if k in fields else v) for k, v in data['payload'].items())
+      )
+      hash(key)
+    except TypeError:
+      return template(event, fields, list(self.columns.keys()))
+    if key not in self.shapes:
+      self.shapes[key] = template(event, fields, list(self.columns.keys()))
+    return self.shapes[key]
+
+  # a field seen for the first time is zero for the events before
+  def add_column(self, name, dtype):
+    self.flush()
+    self.columns[name] = dtype
+    self.files[name] = open(self.column_file(name), 'wb')
+    np.zeros(self.count, dtype=dtype).tofile(self.files[name])
+    self.buffer[name] = []
+
+  def flush(self):
+    if len(self.buffer['time']) == 0:
+      return
+    for name, dtype in self.columns.items():
+      if name == 'time':
+        values = np.array(self.buffer[name], dtype='datetime64[ms]').astype(np.int64)
+      else:
+        values = np.array(self.buffer[name], dtype=dtype)
+      values.tofile(self.files[name])
+      self.buffer[name] = []
+
+  def close(self):
+    self.flush()
+    for f in self.files.values():
+      f.close()
+    self.sort()
+    with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+      json.dump({
+        'version': VERSION,
+        'count': self.count,
+        'columns': self.columns,
+        'dictionary': sorted(self.templates.keys(), key=lambda x: self.templates[x]),
+        'sorted': True
+      }, f)
+
+  # reorder the rows of all columns by time. events of the same time keep their order
+  def sort(self):
+    times = np.fromfile(self.column_file('time'), dtype=np.int64)
+    if np.all(times[1:] >= times[:-1]):
+      return
+    order = np.argsort(times, kind='stable')
+    for name, dtype in self.columns.items():
+      np.fromfile(self.column_file(name), dtype=dtype)[order].tofile(self.column_file(name))
+
+class Archive:
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, 'meta.json')) as f:
+      meta = json.load(f)
+    if meta['version'] != VERSION:
+      raise Exception('archive version {} is not supported'.format(meta['version']))
+
+    self.count = meta['count']
+    self.dictionary = meta['dictionary']
+    self.columns = {
+      name: np.memmap(os.path.join(path, '{}.bin'.format(name)), dtype=dtype, mode='r', shape=(self.count,))
+      if self.count > 0 else np.zeros(0, dtype=dtype)
+      for name, dtype in meta['columns'].items()
+    }
+    self.time = self.columns['time']
+    # archives without the flag are checked, as they might be captured before rows were sorted
+    self.sorted = meta.get('sorted')
+    if self.sorted is None:
+      self.sorted = bool(np.all(self.time[1:] >= self.time[:-1]))
+
+  # events i to j as JSON text. shift moves their time by msec
+  def lines(self, i, j, shift=0):
+    times = np.datetime_as_string((self.time[i:j] + shift).astype('datetime64[ms]'), unit='ms')
+    values = [self.columns[x][i:j].tolist() for x in list(self.columns.keys())[2:]]
+    dictionary = self.dictionary
+    return [
+      dictionary[row[1]].format(*row)
+      for row in zip(times.tolist(), self.columns['device'][i:j].tolist(), *values)
+    ]
+
+
+# JSON of an event with {0} for its time and {N} for the number in the Nth column
+def template(event, fields, columns):
+  payload = dict(event['data']['payload'])
+  for field in fields:
+    payload[field] = '@{}@'.format(columns.index(field))
+  text = json.dumps(dict(event, data=dict(event['data'], payload=payload, time='@0@')))
+  text = text.replace('{', '{{').replace('}', '}}')
+  for field in fields:
+    n = columns.index(field)
+    text = text.replace('"@{}@"'.format(n), '{%d}' % n)
+  return text.replace('"@0@"', '"{0}Z"')
+
+
+'''
+capture and replay
+'''
+def capture(events, path, max_events=None):
+  writer = ArchiveWriter(path)
+  try:
+    for event in events:
+      writer.add(event)
+      if max_events is not None and writer.count >= max_events:
+        break
+  finally:
+    writer.close()
+  return writer.count
+
+# speed 1 sends events as they were timed, 10 does ten times faster, and 0 does as fast as possible.
+# events due by now are sent together, up to batch events at once
+def replay(archive, sink, speed=1.0, batch=BATCH, shift=0):
+  if archive.count == 0:
+    return 0
+  if not archive.sorted:
+    raise Exception('events in {} are not sorted by time. please capture them again'.format(archive.path))
+  begin = time.monotonic()
+  first = int(archive.time[0])
+  i = 0
+  while i < archive.count:
+    j = min(i + batch, archive.count)
+    if speed > 0:
+      due = first + (time.monotonic() - begin) * 1000 * speed
+      k = int(np.searchsorted(archive.time, due, side='right'))
+      if k <= i:
+        time.sleep(max(0, min(1.0, (int(archive.time[i]) - due) / 1000 / speed)))
+        continue
+      j = min(j, k)
+    sink.send(archive.lines(i, j, shift))
+    i = j
+  return archive.count
+
+def iter_ndjson(f):
+  for line in f:
+    if len(line.strip()) > 0:
+      yield line
+
+def iter_kafka(credentials, topic, duration=None):
+  from kafka import KafkaConsumer
+
+  consumer = KafkaConsumer(
+    topic,
+    bootstrap_servers=credentials['kafka_brokers_sasl'],
+    security_protocol='SASL_SSL',
+    sasl_mechanism='PLAIN',
+    sasl_plain_username=credentials.get('user', 'token'),
+    sasl_plain_password=credentials['api_key'],
+    auto_offset_reset='latest',
+    consumer_timeout_ms=1000
+  )
+  end = None if duration is None else time.monotonic() + duration
+  try:
+    while end is None or time.monotonic() < end:
+      for message in consumer:
+        yield message.value.decode('utf-8')
+        if end is not None and time.monotonic() >= end:
+          return
+  finally:
+    consumer.close()
+
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description="""
+  record sensor events into a columnar archive, and replay them at any speed.
+  """)
+  parser.add_argument('-o', '--operation', default='info', help='capture|replay|info')
+  parser.add_argument('-d', '--archive', required=True, help='archive directory')
+  parser.add_argument('-i', '--input', default='-', help='NDJSON file of events to capture. - is stdin')
+  parser.add_argument('-w', '--output', default='-', help='NDJSON file to append replayed events. - is stdout')
+  parser.add_argument('-k', '--kafka', action='store_true',
+    help='capture from or replay to Event Streams instead of --input or --output')
+  parser.add_argument('-c', '--credential-file', help='credential file of scripts/ for --kafka')
+  parser.add_argument('-e', '--topic', default='covsafe', help='topic of Event Streams')
+  parser.add_argument('-n', '--max-events', type=int, help='number of events to capture')
+  parser.add_argument('-t', '--duration', type=float, help='seconds to capture from Event Streams')
+  parser.add_argument('-x', '--speed', default=1.0, type=float, help='replay speed. 0 is unthrottled')
+  parser.add_argument('-b', '--batch', default=BATCH, type=int, help='max number of events sent at once')
+  parser.add_argument('--now', action='store_true', help='shift the time of replayed events to start now')
+
+  return parser.parse_args(args)
+
+def kafka_credentials(args, role):
+  key = 'EVENT_STREAMS_{}_CREDENTIALS'.format(role)
+  cred = credentials.get_store(args.credential_file).get_json(key) if args.credential_file is not None else None
+  if cred is None:
+    raise Exception('--kafka needs {} in --credential-file'.format(key))
+  return cred
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv[1:])
+  start = time.monotonic()
+
+  if args.operation == 'capture':
+    if args.kafka:
+      events = iter_kafka(kafka_credentials(args, 'READER'), args.topic, args.duration)
+      count = capture(events, args.archive, args.max_events)
+    elif args.input == '-':
+      count = capture(iter_ndjson(sys.stdin), args.archive, args.max_events)
+    else:
+      with open(args.input) as f:
+        count = capture(iter_ndjson(f), args.archive, args.max_events)
+
+  elif args.operation == 'replay':
+    archive = Archive(args.archive)
+    shift = int(time.time() * 1000) - int(archive.time[0]) if args.now and archive.count > 0 else 0
+    if args.kafka:
+      sink = dummy_generator.KafkaSink(kafka_credentials(args, 'WRITER'), args.topic)
+    else:
+      sink = dummy_generator.FileSink(args.output)
+    try:
+      count = replay(archive, sink, args.speed, args.batch, shift)
+    finally:
+      sink.close()
+
+  elif args.operation == 'info':
+    archive = Archive(args.archive)
+    count = archive.count
+    if count > 0:
+      print('{} events of {} devices from {} to {}'.format(
+        count, len(archive.dictionary),
+        np.datetime64(int(archive.time[0]), 'ms'), np.datetime64(int(archive.time[-1]), 'ms')
+      ))
+    for name, column in archive.columns.items():
+      print('{:<12} {}'.format(name, column.dtype))
+
+  else:
+    raise Exception('no operation {}. please check usage of this script'.format(args.operation))
+
+  elapsed = time.monotonic() - start
+  print('{} events in {:.1f}s ({:.0f} events/s)'.format(count, elapsed, count / max(elapsed, 1e-6)), file=sys.stderr)
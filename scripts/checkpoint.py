@@ -0,0 +1,114 @@
+import os
+import json
+import datetime
+import threading
+import util
+
+VERSION = 1
+JOURNAL_FILE = './.journal'
+
+
+'''
+Checkpoint journal.
+a deploy appends a line for each step it completed, with the outputs of the step, to a JSON-lines file
+synced to disk, so a deploy that failed halfway can go on with --resume from the first step not in it.
+steps are the nodes of main.py and the parts of service_*.create, like cloudant/credentials, run by step().
+a completed step isn't run again on resume, and returns the outputs recorded for it instead.
+the first line holds the options of the deploy, and a journal of other options can't be resumed.
+the journal is off unless start() is called, and step() just runs the function then.
+'''
+class Journal:
+  def __init__(self):
+    self.path = None
+    self.lock = threading.Lock()
+    self.entries = {}
+    self.resumed = set()
+
+  def start(self, path, options, resume=False):
+    header = {'journal': VERSION, 'options': options}
+    if not resume:
+      with self.lock:
+        self.path = path
+        self.entries = {}
+        self.write(header, 'w')
+      return
+
+    if not os.path.exists(path):
+      print(util.bcolors.FAIL + 'no journal {} to resume. run it without --resume'.format(path) + util.bcolors.ENDC)
+      raise Exception('no journal {} to resume'.format(path))
+
+    with open(path) as f:
+      lines = f.read().splitlines()
+    if len(lines) == 0 or json.loads(lines[0]) != header:
+      print(util.bcolors.FAIL + 'the journal {} was written by a deploy with other options'.format(path) + util.bcolors.ENDC)
+      raise Exception('the journal {} was written by a deploy with other options'.format(path))
+
+    entries = {}
+    valid = [lines[0]]
+    for line in lines[1:]:
+      try:
+        entry = json.loads(line)
+      except ValueError:
+        # the last line is torn when the deploy died writing it. the step runs again
+        continue
+      entries[entry['step']] = entry.get('outputs')
+      valid.append(line)
+    with self.lock:
+      self.path = path
+      self.entries = entries
+      # drop a torn line, so the lines appended from now on start on a line of their own
+      if len(valid) < len(lines):
+        tmp = path + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+          f.write(''.join(x + '\n' for x in valid))
+          f.flush()
+          os.fsync(f.fileno())
+        os.replace(tmp, path)
+    print(util.bcolors.OKBLUE + 'resuming after {} completed steps: {}'.format(
+      len(entries), ', '.join(entries.keys()) or 'none'
+    ) + util.bcolors.ENDC)
+
+  def enabled(self):
+    return self.path is not None
+
+  def write(self, entry, mode='a'):
+    fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if mode == 'w' else os.O_APPEND), 0o600)
+    with os.fdopen(fd, mode) as f:
+      f.write(json.dumps(entry) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+
+  def record(self, name, outputs):
+    with self.lock:
+      self.write({
+        'step': name, 'outputs': outputs,
+        'at': datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+      })
+      self.entries[name] = outputs
+
+  # run a step unless the journal has it. outputs should be JSON values, like ids, credentials and URLs
+  def step(self, name, func):
+    util.check_cancelled()
+    if not self.enabled():
+      return func()
+    with self.lock:
+      if name in self.entries:
+        self.resumed.add(name)
+        print(util.bcolors.OKBLUE + 'step {} completed before, skipped'.format(name) + util.bcolors.ENDC)
+        return self.entries[name]
+
+    outputs = func()
+    self.record(name, outputs)
+    return outputs
+
+  # the deploy finished, and there is nothing to resume
+  def finish(self):
+    with self.lock:
+      if self.path is not None and os.path.exists(self.path):
+        os.remove(self.path)
+      self.path = None
+      self.entries = {}
+
+
+journal = Journal()
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse
+import util
+import http_client
+import tracing
+
+# seconds to wait for all indexes of a database to be built
+BUILD_TIMEOUT = 1800
+POLL_INTERVAL = 5
+# seconds a view query waits for its answer, longer than the 60s Cloudant answers a view being built with an error
+VIEW_TIMEOUT = 90
+
+
+'''
+Declarative indexes.
+a definition file is a JSON array for one database, kept in the data tree as indexes/DATABASE.json.
+an item is either a Mango index, the body of POST /DATABASE/_index, or a design document with views:
+  {"ddoc": "assets-type", "name": "type", "type": "json", "index": {"fields": ["type"]}}
+  {"_id": "_design/logs", "language": "javascript", "views": {"by-time": {"map": "function (doc) {...}"}}}
+applying the same definitions again changes nothing. once they're defined,
+each view is queried until it answers, which is when Cloudant has built it.
+requests go over the pooled connections of http_client, signed by the writer credentials.
+'''
+def read_definitions(path):
+  with open(path) as f:
+    definitions = json.load(f)
+  if not isinstance(definitions, list):
+    print(util.bcolors.FAIL + '{} is not a list of indexes'.format(path) + util.bcolors.ENDC)
+    raise Exception('{} is not a list of indexes'.format(path))
+
+  for d in definitions:
+    if 'index' in d:
+      # each Mango index gets its own design document, so it's built independently of the others
+      d.setdefault('ddoc', d.get('name'))
+      d.setdefault('type', 'json')
+      if d['ddoc'] is None:
+        print(util.bcolors.FAIL + 'an index in {} has no name'.format(path) + util.bcolors.ENDC)
+        raise Exception('an index in {} has no name'.format(path))
+    elif not str(d.get('_id', '')).startswith('_design/'):
+      print(util.bcolors.FAIL + 'an item in {} is neither an index nor a design doc'.format(path) + util.bcolors.ENDC)
+      raise Exception('an item in {} is neither an index nor a design doc'.format(path))
+  return definitions
+
+# (DESIGN DOC ID, VIEW) pairs the definitions build
+def views(definitions):
+  ret = []
+  for d in definitions:
+    if 'index' in d:
+      if d['type'] == 'json':
+        ret.append(('_design/{}'.format(d['ddoc']), d['name']))
+    else:
+      ret.extend((d['_id'], x) for x in d.get('views', {}).keys())
+  return ret
+
+# path under the database, like /_index. the token of IAM credentials is taken from the cache on each request
+def request(cred, database, method, path, body=None, timeout=None):
+  url, auth = util.cloudant_endpoint(cred)
+  return http_client.session.request(
+    method, '{}/{}{}'.format(url, parse.quote(database, safe=''), path), body=body,
+    headers={'Authorization': auth, 'Accept': 'application/json'}, timeout=timeout
+  )
+
+def define_index(cred, database, definition):
+  with tracing.tracer.span('_index {}'.format(definition['name']), 'cloudant'):
+    res = request(cred, database, 'POST', '/_index', definition)
+  if res.status not in [200, 201]:
+    print(util.bcolors.FAIL + 'cannot create index {} due to {}'.format(definition['name'], res.body) + util.bcolors.ENDC)
+    raise Exception('cannot create index {}'.format(definition['name']))
+  return res.json().get('result') == 'created'
+
+# a design doc is written only when it differs from the one in the database
+def define_design_doc(cred, database, definition):
+  path = '/{}'.format(definition['_id'])
+  with tracing.tracer.span('GET {}'.format(definition['_id']), 'cloudant'):
+    res = request(cred, database, 'GET', path)
+  if res.status == 200:
+    current = res.json()
+    if all(current.get(k) == v for k, v in definition.items()):
+      return False
+    definition = dict(definition, _rev=current['_rev'])
+  elif res.status != 404:
+    print(util.bcolors.FAIL + 'cannot read {} due to {}'.format(definition['_id'], res.body) + util.bcolors.ENDC)
+    raise Exception('cannot read {}'.format(definition['_id']))
+
+  with tracing.tracer.span('PUT {}'.format(definition['_id']), 'cloudant'):
+    res = request(cred, database, 'PUT', path, definition)
+  if res.status not in [200, 201, 202]:
+    print(util.bcolors.FAIL + 'cannot write {} due to {}'.format(definition['_id'], res.body) + util.bcolors.ENDC)
+    raise Exception('cannot write {}'.format(definition['_id']))
+  return True
+
+# a query of a view blocks until the view is built. Cloudant answers it with an error after 60s
+# while a large database is still indexed, and it's queried again then. so is it when the query times out
+# or the connection drops, until the deadline
+def wait_for_view(cred, database, ddoc, view, deadline):
+  with tracing.tracer.span('wait {}/{}'.format(ddoc, view), 'wait') as span:
+    attempts = 0
+    while True:
+      attempts += 1
+      try:
+        res = request(cred, database, 'GET', '/{}/_view/{}?limit=0'.format(ddoc, view), timeout=VIEW_TIMEOUT)
+        if res.status == 200:
+          span.set(attempts=attempts)
+          return
+        if res.status not in [500, 502, 503, 504]:
+          print(util.bcolors.FAIL + 'cannot build {}/{} due to {}'.format(ddoc, view, res.body) + util.bcolors.ENDC)
+          raise Exception('cannot build {}/{}'.format(ddoc, view))
+      except (http_client.Timeout, ConnectionError):
+        pass
+
+      if time.monotonic() > deadline:
+        print(util.bcolors.FAIL + '{}/{} is not built in time'.format(ddoc, view) + util.bcolors.ENDC)
+        raise Exception('{}/{} is not built in time'.format(ddoc, view))
+      print(util.bcolors.OKBLUE + 'building {}/{}'.format(ddoc, view) + util.bcolors.ENDC)
+      util.sleep(POLL_INTERVAL)
+
+def apply_database(cred, database, files, timeout=BUILD_TIMEOUT):
+  definitions = [d for f in files for d in read_definitions(f)]
+
+  changed = 0
+  for d in definitions:
+    if 'index' in d:
+      changed += define_index(cred, database, d)
+    else:
+      changed += define_design_doc(cred, database, d)
+
+  start = time.monotonic()
+  targets = views(definitions)
+  for ddoc, view in targets:
+    wait_for_view(cred, database, ddoc, view, start + timeout)
+  print(util.bcolors.OKBLUE + '{}: {} indexes, {} changed, {} views built in {:.1f}s'.format(
+    database, len(definitions), changed, len(targets), time.monotonic() - start
+  ) + util.bcolors.ENDC)
+
+# units are (FILE, DATABASE) pairs, and cred is the Cloudant credentials. databases are indexed concurrently
+def apply(cred, units, workers=4, timeout=BUILD_TIMEOUT):
+  print(util.bcolors.OKGREEN + 'Starting to define indexes of Cloudant' + util.bcolors.ENDC)
+
+  files = {}
+  for file, database in units:
+    if not os.path.exists(file):
+      print(util.bcolors.FAIL + 'there is no index definition {}'.format(file) + util.bcolors.ENDC)
+      raise Exception('there is no index definition {}'.format(file))
+    files.setdefault(database, []).append(file)
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    futures = [executor.submit(apply_database, cred, database, f, timeout) for database, f in files.items()]
+    for x in futures:
+      x.result()
+
+# index definition files under a data directory, paired with their databases
+def find(directory, db_prefix=''):
+  directory = os.path.join(directory, 'indexes')
+  if not os.path.isdir(directory):
+    return []
+  return [
+    ('{}/{}'.format(directory, f), db_prefix + f[:-len('.json')])
+    for f in sorted(os.listdir(directory)) if f.endswith('.json')
+  ]
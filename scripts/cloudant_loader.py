@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import hashlib
+import random
+from concurrent.futures import ThreadPoolExecutor
+import util
+import tracing
+
+# Cloudant rejects a request larger than 10MB. batches are kept well under it
+BATCH_DOCS = 500
+BATCH_BYTES = 1024 * 1024
+READ_CHUNK = 64 * 1024
+MAX_RETRIES = 5
+# fields cos_presign writes into an image link, or the seed data has in it
+LINK_FIELDS = ['url', 'urls', 'expires', 'object', 'options']
+
+
+'''
+Streaming seed loader for Cloudant.
+seed files are JSON arrays or NDJSON, which are parsed incrementally and cut into size-bounded batches,
+so a file is never loaded into memory at once.
+'''
+# yield each element of a top-level JSON array with the size of its text
+def iter_json_array(path, chunk_size=READ_CHUNK):
+  decoder = json.JSONDecoder()
+  with open(path, encoding='utf-8') as f:
+    buf = ''
+    pos = 0
+    started = False
+    eof = False
+    while True:
+      # skip whitespace and separators
+      while pos < len(buf) and buf[pos] in ' \t\r\n,':
+        pos += 1
+
+      if not started and pos < len(buf):
+        if buf[pos] != '[':
+          raise Exception('{} is not a JSON array'.format(path))
+        started = True
+        pos += 1
+        continue
+
+      if started and pos < len(buf) and buf[pos] == ']':
+        return
+
+      if pos < len(buf):
+        try:
+          doc, end = decoder.raw_decode(buf, pos)
+          # an element might be cut in the middle by the end of the buffer, like '2.' of '2.5'.
+          # it's complete only when a delimiter follows
+          if eof or (end < len(buf) and buf[end] in ' \t\r\n,]'):
+            yield doc, end - pos
+            pos = end
+            continue
+        except ValueError:
+          if eof:
+            raise Exception('broken JSON in {} at {}'.format(path, pos))
+
+      if eof:
+        if not started:
+          raise Exception('{} is not a JSON array'.format(path))
+        raise Exception('unterminated JSON array in {}'.format(path))
+
+      chunk = f.read(chunk_size)
+      eof = len(chunk) == 0
+      buf = buf[pos:] + chunk
+      pos = 0
+
+# yield each line of an NDJSON file with its size
+def iter_ndjson(path):
+  with open(path, encoding='utf-8') as f:
+    for n, line in enumerate(f):
+      if len(line.strip()) == 0:
+        continue
+      try:
+        yield json.loads(line), len(line)
+      except ValueError:
+        raise Exception('broken JSON in {} at line {}'.format(path, n + 1))
+
+def iter_file(path):
+  if path.endswith('.ndjson'):
+    return iter_ndjson(path)
+  return iter_json_array(path)
+
+def iter_batches(docs, max_docs=BATCH_DOCS, max_bytes=BATCH_BYTES):
+  batch = []
+  size = 0
+  for doc, nbytes in docs:
+    if len(batch) > 0 and (len(batch) >= max_docs or size + nbytes > max_bytes):
+      yield batch, size
+      batch = []
+      size = 0
+    batch.append(doc)
+    size += nbytes
+
+  if len(batch) > 0:
+    yield batch, size
+
+
+class Stats:
+  def __init__(self, database):
+    self.database = database
+    self.docs = 0
+    self.bytes = 0
+    self.requests = 0
+    self.retried = 0
+    self.unchanged = 0
+    self.pruned = 0
+    self.start = time.monotonic()
+    self.end = None
+
+  def elapsed(self):
+    return max((self.end or time.monotonic()) - self.start, 1e-6)
+
+  def report(self):
+    print(
+      util.bcolors.OKBLUE +
+      '{}: {} docs, {} bytes in {:.1f}s ({:.0f} docs/s, {:.0f} bytes/s), {} requests, {} docs retried, {} unchanged, {} pruned'.format(
+        self.database, self.docs, self.bytes, self.elapsed(),
+        self.docs / self.elapsed(), self.bytes / self.elapsed(), self.requests, self.retried, self.unchanged, self.pruned
+      ) +
+      util.bcolors.ENDC
+    )
+
+
+# write one batch, and retry only the documents that failed with backoff
+def write_batch(db, docs, stats, max_retries=MAX_RETRIES):
+  pending = docs
+  for attempt in range(max_retries + 1):
+    if attempt > 0:
+      stats.retried += len(pending)
+      util.sleep(min(30, 2 ** attempt / 2 + random.uniform(0, 2 ** attempt / 2)))
+
+    stats.requests += 1
+    try:
+      with tracing.tracer.span('_bulk_docs {}'.format(stats.database), 'cloudant', docs=len(pending), attempt=attempt):
+        ret = db.bulk_docs(pending)
+    except Exception as e:
+      # the whole request failed, like 429 Too Many Requests
+      print(util.bcolors.WARNING + 'bulk write to {} failed: {}'.format(stats.database, e) + util.bcolors.ENDC)
+      continue
+
+    if len(ret) != len(pending):
+      print(util.bcolors.FAIL + 'might not write all data' + util.bcolors.ENDC)
+      raise Exception('might not write all data')
+
+    failed = [doc for doc, r in zip(pending, ret) if r.get('ok') is not True]
+    conflicts = [r for r in ret if r.get('error') == 'conflict']
+    if len(conflicts) > 0:
+      # a conflict won't be resolved by writing the same revision again
+      print(
+        util.bcolors.FAIL +
+        'failed to write {} docs to {} due to conflicts'.format(len(conflicts), stats.database) +
+        util.bcolors.ENDC
+      )
+      raise Exception('failed to write data to {}'.format(stats.database))
+
+    if len(failed) == 0:
+      return
+    pending = failed
+
+  print(util.bcolors.FAIL + 'failed to write some data to {}'.format(stats.database) + util.bcolors.ENDC)
+  raise Exception('failed to write some data to {}'.format(stats.database))
+
+'''
+Differential seeding.
+each document gets a stable key, and only the documents whose content differs from the database are
+written with the current revision, so re-seeding the same data writes nothing.
+with signed, image links are compared by the key they point at, as cos_presign signs them after the seed.
+documents missing from the seed are left, unless prune deletes them. a database seeded by posting documents,
+which gave them ids generated by the server, is pruned once, or it keeps both copies of each document.
+'''
+# _id in the seed data is kept. otherwise, id or name of assets/staff/shops is used.
+# a document without them, like view-config, is keyed by its position in the data,
+# so inserting one shifts the keys of the ones after it, which are all written again
+def stable_key(doc, database, index):
+  for k in ['_id', 'id', 'name']:
+    if isinstance(doc.get(k), str) and len(doc[k]) > 0:
+      return doc[k]
+  return '{}-{}'.format(database, index)
+
+# key an image link points at, signed or as in the seed data, or None when it isn't an image link
+def link_key(link):
+  try:
+    if 'object' in link:
+      return link['object']['key']
+    return json.loads(link['options']['body'])['key']
+  except (KeyError, TypeError, ValueError):
+    return None
+
+# the document with its image links reduced to their keys
+def unsigned(doc):
+  if isinstance(doc, list):
+    return [unsigned(x) for x in doc]
+  if not isinstance(doc, dict):
+    return doc
+  key = link_key(doc)
+  if key is None:
+    return {k: unsigned(v) for k, v in doc.items()}
+  return dict({k: unsigned(v) for k, v in doc.items() if k not in LINK_FIELDS}, link=key)
+
+def content_hash(doc, signed=False):
+  body = {k: v for k, v in doc.items() if k not in ['_id', '_rev']}
+  if signed:
+    body = unsigned(body)
+  return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+# look up the current revisions of a batch by one _all_docs request and drop unchanged documents
+def diff_batch(db, docs, stats, signed=False):
+  with tracing.tracer.span('_all_docs {}'.format(stats.database), 'cloudant', docs=len(docs)):
+    res = db.all_docs(keys=[x['_id'] for x in docs], include_docs=True)
+  stats.requests += 1
+  current = {x['key']: x.get('doc') for x in res['rows'] if x.get('doc') is not None}
+
+  changed = []
+  for doc in docs:
+    existing = current.get(doc['_id'])
+    if existing is None:
+      changed.append(doc)
+    elif content_hash(existing, signed) != content_hash(doc, signed):
+      changed.append(dict(doc, _rev=existing['_rev']))
+  stats.unchanged += len(docs) - len(changed)
+  return changed
+
+# delete the documents whose ids aren't in seeded, keeping design docs. ids are read by pages of _all_docs,
+# and the documents are deleted once all pages are read, so deleting doesn't shift the pages
+def prune(db, seeded, stats, page=BATCH_DOCS):
+  stale = []
+  params = {'limit': page}
+  while True:
+    with tracing.tracer.span('_all_docs {}'.format(stats.database), 'cloudant', limit=page):
+      rows = db.all_docs(**params)['rows']
+    stats.requests += 1
+    stale.extend(
+      {'_id': x['id'], '_rev': x['value']['rev'], '_deleted': True}
+      for x in rows if x['id'] not in seeded and not x['id'].startswith('_design/')
+    )
+    if len(rows) < page:
+      break
+    params = {'limit': page, 'startkey': rows[-1]['key'], 'skip': 1}
+
+  for i in range(0, len(stale), page):
+    write_batch(db, stale[i:i + page], stats)
+  stats.pruned = len(stale)
+
+def keyed(docs, database):
+  for i, (doc, nbytes) in enumerate(docs):
+    if isinstance(doc, dict):
+      doc = dict(doc, _id=stable_key(doc, database, i))
+    yield doc, nbytes
+
+def load_database(client, database, files, max_docs=BATCH_DOCS, max_bytes=BATCH_BYTES, diff=True, signed=False,
+  prune_missing=False):
+  def docs():
+    for file in files:
+      yield from iter_file(file)
+  return load_docs(client, database, docs(), max_docs, max_bytes, diff, signed, prune_missing)
+
+# docs are (DOCUMENT, SIZE) pairs from any iterator, like a generator of synthetic data.
+# prune_missing deletes the documents of the database not in docs, which needs diff for their ids
+def load_docs(client, database, docs, max_docs=BATCH_DOCS, max_bytes=BATCH_BYTES, diff=True, signed=False,
+  prune_missing=False):
+  db = client.get(database)
+  stats = Stats(database)
+  seeded = set()
+  if diff:
+    docs = keyed(docs, database)
+  for batch, size in iter_batches(docs, max_docs, max_bytes):
+    stats.docs += len(batch)
+    stats.bytes += size
+    if diff:
+      seeded.update(x['_id'] for x in batch)
+      batch = diff_batch(db, batch, stats, signed)
+    if len(batch) > 0:
+      write_batch(db, batch, stats)
+  if diff and prune_missing:
+    prune(db, seeded, stats, max_docs)
+  stats.end = time.monotonic()
+  stats.report()
+  return stats
+
+# units are (FILE, DATABASE) pairs. each database is loaded by its own worker.
+# diff=False posts every document as it is, which gives new ids to the documents without _id.
+# signed=True keeps the links presigned since the last seed when they point at the same keys.
+# prune_missing=True deletes the documents not in the files from their databases
+def load(client, units, workers=4, max_docs=BATCH_DOCS, max_bytes=BATCH_BYTES, diff=True, signed=False,
+  prune_missing=False):
+  print(util.bcolors.OKGREEN + 'Starting to load data into Cloudant' + util.bcolors.ENDC)
+
+  files = {}
+  for file, database in units:
+    if not os.path.exists(file):
+      print(util.bcolors.FAIL + 'there is no data {}'.format(file) + util.bcolors.ENDC)
+      raise Exception('there is no data {}'.format(file))
+    files.setdefault(database, []).append(file)
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    futures = [
+      executor.submit(load_database, client, database, f, max_docs, max_bytes, diff, signed, prune_missing)
+      for database, f in files.items()
+    ]
+    results = [x.result() for x in futures]
+
+  for stats in results:
+    print(util.bcolors.OKBLUE + 'write all data to {}'.format(stats.database) + util.bcolors.ENDC)
+  return results
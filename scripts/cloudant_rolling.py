@@ -0,0 +1,120 @@
+import datetime
+import util
+import tracing
+import cloudant_indexes
+
+PERIODS = ['day', 'week', 'month']
+# periods kept, counting the current one
+RETENTION = 30
+# periods created ahead, so writers never find the next database missing at midnight
+AHEAD = 1
+
+
+'''
+Rolling log databases.
+a log database like log_risk_calculation is split into one database per period, named BASE-PERIOD:
+  day    log_risk_calculation-2020-10-18
+  week   log_risk_calculation-2020-w42
+  month  log_risk_calculation-2020-10
+periods are in UTC. expired periods are dropped by deleting their databases,
+which takes one request however many documents they have, instead of deleting documents one by one.
+'''
+def ordinal(period, when):
+  if period == 'day':
+    return when.toordinal()
+  if period == 'week':
+    # the ordinal of day 1 is a Monday
+    return (when.toordinal() - 1) // 7
+  if period == 'month':
+    return when.year * 12 + when.month - 1
+  print(util.bcolors.FAIL + 'no period {}. it should be one of {}'.format(period, '|'.join(PERIODS)) + util.bcolors.ENDC)
+  raise Exception('no period {}'.format(period))
+
+def start_of(period, n):
+  if period == 'day':
+    return datetime.date.fromordinal(n)
+  if period == 'week':
+    return datetime.date.fromordinal(n * 7 + 1)
+  return datetime.date(n // 12, n % 12 + 1, 1)
+
+def suffix(period, n):
+  when = start_of(period, n)
+  if period == 'day':
+    return when.strftime('%Y-%m-%d')
+  if period == 'week':
+    year, week, _ = when.isocalendar()
+    return '{}-w{:02d}'.format(year, week)
+  return when.strftime('%Y-%m')
+
+def database_name(base, period, n):
+  return '{}-{}'.format(base, suffix(period, n))
+
+# the ordinal of a database of the base, or None when it's not one
+def parse(base, period, name):
+  if not name.startswith(base + '-'):
+    return None
+  text = name[len(base) + 1:]
+  try:
+    if period == 'day':
+      when = datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    elif period == 'week':
+      when = datetime.datetime.strptime(text + '-1', '%G-w%V-%u').date()
+    else:
+      when = datetime.datetime.strptime(text + '-01', '%Y-%m-%d').date()
+  except ValueError:
+    return None
+  n = ordinal(period, when)
+  # names that only parse, like 2020-1-5, aren't ours
+  return n if database_name(base, period, n) == name else None
+
+def today():
+  return datetime.datetime.now(datetime.timezone.utc).date()
+
+# database a writer puts a log of now into, by the period a deploy recorded as CLOUDANT_LOG_PERIOD.
+# without a period, logs stay in the database of the base
+def name(base, period, now=None):
+  if not period:
+    return base
+  return database_name(base, period, ordinal(period, now or today()))
+
+# databases from the current period to the ones created ahead
+def current(base, period, ahead=AHEAD, now=None):
+  n = ordinal(period, now or today())
+  return [database_name(base, period, x) for x in range(n, n + ahead + 1)]
+
+# create the databases of the current and next periods with their indexes, and drop the expired ones.
+# index_units are (FILE, BASE) pairs, applied to each database of the base by the credentials of the client
+def rotate(client, cred, bases, period, retention=RETENTION, ahead=AHEAD, index_units=None, now=None):
+  print(util.bcolors.OKGREEN + 'Starting to rotate log databases by {}'.format(period) + util.bcolors.ENDC)
+
+  existing = set(client.all_dbs())
+  n = ordinal(period, now or today())
+  created = []
+  dropped = []
+  for base in bases:
+    for name in current(base, period, ahead, now):
+      if name not in existing:
+        with tracing.tracer.span('create {}'.format(name), 'cloudant'):
+          db = client.create_database(name)
+        if not db.exists():
+          print(util.bcolors.FAIL + 'failed to create database {}'.format(name) + util.bcolors.ENDC)
+          raise Exception('failed to create database {}'.format(name))
+        created.append(name)
+
+    for name in sorted(existing):
+      m = parse(base, period, name)
+      if m is not None and m <= n - retention:
+        with tracing.tracer.span('delete {}'.format(name), 'cloudant'):
+          client.delete_database(name)
+        dropped.append(name)
+
+  units = [
+    (f, name) for f, base in index_units or [] if base in bases for name in current(base, period, ahead, now)
+  ]
+  if len(units) > 0:
+    cloudant_indexes.apply(cred, units)
+
+  print(util.bcolors.OKBLUE + 'created {}, dropped {}'.format(
+    ', '.join(created) or 'nothing', ', '.join(dropped) or 'nothing'
+  ) + util.bcolors.ENDC)
+  return created, dropped
@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import util
+
+# hex digits of SHA-256 in a key
+HASH_LENGTH = 16
+MANIFEST = 'manifest.json'
+
+
+'''
+Content-addressed keys.
+an object is stored under a key with the hash of its content, like shop.3f2a9c0d1e4b5a6f.png,
+so it never changes once written and clients can cache it for good (Cache-Control: immutable).
+objects under a directory share one hash of the whole directory, like floormap.HASH/tiles/0/0/0.webp,
+so a tile template like floormap/tiles/{z}/{x}/{y}.webp still resolves.
+the seed documents that link the objects are rewritten to the hashed keys, and
+manifest.json, mapping the plain keys to the hashed ones, is uploaded under its plain key without caching.
+'''
+def file_hash(file):
+  sha = hashlib.sha256()
+  with open(file, 'rb') as f:
+    for data in iter(lambda: f.read(1024 * 1024), b''):
+      sha.update(data)
+  return sha.hexdigest()
+
+def hashed_name(key, digest):
+  root, ext = os.path.splitext(key)
+  return '{}.{}{}'.format(root, digest[:HASH_LENGTH], ext)
+
+# manifest of (FILE, KEY) pairs: hashed keys of flat objects and hashed names of top directories
+def manifest(objects):
+  ret = {'objects': {}, 'directories': {}}
+  directories = {}
+  for f, key in objects:
+    if '/' in key:
+      directories.setdefault(key.split('/')[0], []).append((f, key))
+    else:
+      ret['objects'][key] = hashed_name(key, file_hash(f))
+
+  for top, members in directories.items():
+    sha = hashlib.sha256()
+    for f, key in sorted(members, key=lambda x: x[1]):
+      sha.update('{}\0{}\0'.format(key, file_hash(f)).encode())
+    ret['directories'][top] = '{}.{}'.format(top, sha.hexdigest()[:HASH_LENGTH])
+    for _, key in members:
+      ret['objects'][key] = ret['directories'][top] + key[len(top):]
+  return ret
+
+# hashed key of a plain key or a template under a hashed directory, or None when it isn't uploaded
+def resolve(manifest, key):
+  if key in manifest['objects']:
+    return manifest['objects'][key]
+  top = key.split('/')[0]
+  if '/' in key and top in manifest['directories']:
+    return manifest['directories'][top] + key[len(top):]
+  return None
+
+# rewrite the keys of links like {"url": ..., "options": {"body": "{\"bucket\": ..., \"key\": ...}"}} in a document
+def rewrite(doc, manifest):
+  count = 0
+  if isinstance(doc, list):
+    for x in doc:
+      count += rewrite(x, manifest)
+  elif isinstance(doc, dict):
+    body = doc.get('options', {}).get('body') if isinstance(doc.get('options'), dict) else None
+    if isinstance(body, str):
+      try:
+        request = json.loads(body)
+      except ValueError:
+        request = None
+      if isinstance(request, dict) and resolve(manifest, request.get('key', '')) is not None:
+        request['key'] = resolve(manifest, request['key'])
+        doc['options']['body'] = json.dumps(request)
+        count += 1
+    for k, v in doc.items():
+      if k != 'options':
+        count += rewrite(v, manifest)
+  return count
+
+# manifest written by the last address() into out_dir, or None
+def last_manifest(out_dir):
+  path = os.path.join(out_dir, MANIFEST)
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+# objects get hashed keys with the immutable cache policy, and the manifest is added with no-cache.
+# documents are rewritten into out_dir. it returns the (FILE, KEY, CACHE) objects and
+# a dict from the documents to the rewritten ones
+def address(objects, documents, out_dir):
+  os.makedirs(out_dir, exist_ok=True)
+  m = manifest(objects)
+  path = os.path.join(out_dir, MANIFEST)
+  with open(path, 'w') as f:
+    json.dump(m, f, indent=2, sort_keys=True)
+  ret = [(f, m['objects'][key], 'immutable') for f, key in objects] + [(path, MANIFEST, 'no-cache')]
+
+  rewritten = {}
+  for document in documents:
+    with open(document) as f:
+      doc = json.load(f)
+    count = rewrite(doc, m)
+    if count == 0:
+      continue
+    rewritten[document] = os.path.join(out_dir, os.path.basename(document))
+    with open(rewritten[document], 'w') as f:
+      json.dump(doc, f, indent=2)
+    print(util.bcolors.OKBLUE + '{}: {} links to hashed keys'.format(document, count) + util.bcolors.ENDC)
+  return ret, rewritten
@@ -0,0 +1,216 @@
+import os
+import json
+import math
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import util
+import plan
+import cos_content
+
+# Pillow is optional. without it, images are uploaded as they are
+try:
+  from PIL import Image, features
+except ImportError:
+  Image = None
+
+TILE_SIZE = 256
+WEBP_QUALITY = 80
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg']
+MANIFEST = 'images.json'
+# version of the stage, so a manifest of an older one is staged again
+VERSION = 2
+
+
+'''
+Image stage before COS upload.
+the floor map of view-config is cut into a tile pyramid for the Leaflet CRS.Simple map,
+where a map unit is 2^ZOOM pixels at ZOOM and a tile at (X, Y) covers pixels [256X, 256X + 256).
+levels run from map.base.minZoom to the native resolution of the image. Leaflet scales the tiles
+of the nearest level for the zooms beyond them, so no level is upscaled.
+the floor of view-config is switched to the tiles, so the whole floor map isn't uploaded.
+the other images, like shop logos, are recompressed under the same key and get a WebP variant when it's smaller,
+which the links of view-config and the other documents, like shops, are rewritten to.
+the work is done on a process pool into a build directory, and redone only when the inputs change.
+'''
+def available():
+  return Image is not None
+
+def tile_format():
+  return 'webp' if features.check('webp') else 'png'
+
+# key of the floor map that view-config links to
+def floor_key(config):
+  link = config.get('map', {}).get('floor', {}).get('link', {})
+  try:
+    return json.loads(link['options']['body'])['key']
+  except (KeyError, TypeError, ValueError):
+    return None
+
+# zoom levels to cut, from the lowest one that doesn't fit in a tile to the native resolution
+def levels(size, bounds, min_zoom, max_zoom):
+  units = [bounds[1][0] - bounds[0][0], bounds[1][1] - bounds[0][1]]
+  native = math.ceil(math.log2(max(size[1] / units[0], size[0] / units[1])) - 1e-9)
+  whole = math.floor(math.log2(TILE_SIZE / max(units)))
+  high = min(native, max_zoom)
+  low = min(max(min_zoom, whole), high)
+  return list(range(low, high + 1))
+
+# cut one level into tiles. it runs in a worker process
+def cut_level(src, out_dir, key_dir, zoom, bounds, fmt):
+  scale = 2 ** zoom
+  # pixel box of the image at the level. y grows downwards, so the top is -lat1
+  x0, y0 = bounds[0][1] * scale, -bounds[1][0] * scale
+  x1, y1 = bounds[1][1] * scale, -bounds[0][0] * scale
+  with Image.open(src) as image:
+    level = image.convert('RGBA').resize((max(1, round(x1 - x0)), max(1, round(y1 - y0))), Image.LANCZOS)
+
+  objects = []
+  for tx in range(math.floor(x0 / TILE_SIZE), math.ceil(x1 / TILE_SIZE)):
+    for ty in range(math.floor(y0 / TILE_SIZE), math.ceil(y1 / TILE_SIZE)):
+      tile = Image.new('RGBA', (TILE_SIZE, TILE_SIZE))
+      tile.paste(level, (round(x0 - tx * TILE_SIZE), round(y0 - ty * TILE_SIZE)))
+      key = '{}/{}/{}/{}.{}'.format(key_dir, zoom, tx, ty, fmt)
+      path = os.path.join(out_dir, key)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      save(tile, path, fmt)
+      objects.append((path, key))
+  return objects
+
+# recompress an image under its key, and add the WebP variant when it's smaller. it runs in a worker process.
+# it returns the objects and the key of the variant, or None
+def optimize(src, out_dir, key):
+  with Image.open(src) as image:
+    path = os.path.join(out_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save(image, path, os.path.splitext(key)[1][1:].lower())
+    # keep the original when it's already smaller
+    if os.path.getsize(path) >= os.path.getsize(src):
+      path = src
+    if not features.check('webp'):
+      return [(path, key)], None
+
+    webp_key = os.path.splitext(key)[0] + '.webp'
+    webp = os.path.join(out_dir, webp_key)
+    save(image, webp, 'webp')
+  if os.path.getsize(webp) >= os.path.getsize(path):
+    return [(path, key)], None
+  return [(path, key), (webp, webp_key)], webp_key
+
+def save(image, path, fmt):
+  if fmt == 'webp':
+    image.save(path, 'WEBP', quality=WEBP_QUALITY)
+  elif fmt == 'png':
+    image.save(path, 'PNG', optimize=True)
+  else:
+    image.convert('RGB').save(path, 'JPEG', quality=85, optimize=True, progressive=True)
+
+# view-config whose floor is the tiled layer. its link asks the files API for a tile of the template,
+# and tiles holds the options of the layer
+def tiled_config(configs, floor, key_dir, zooms, fmt):
+  configs = copy.deepcopy(configs)
+  for config in configs:
+    if floor_key(config) != floor:
+      continue
+    link = config['map']['floor']['link']
+    body = dict(json.loads(link['options']['body']), key='{}/{{z}}/{{x}}/{{y}}.{}'.format(key_dir, fmt))
+    config['map']['floor']['link'] = dict(link, options=dict(link['options'], body=json.dumps(body)))
+    config['map']['floor']['tiles'] = {
+      'tileSize': TILE_SIZE,
+      'minNativeZoom': zooms[0],
+      'maxNativeZoom': zooms[-1]
+    }
+  return configs
+
+# files are uploaded with their names as keys. the staged objects are (FILE, KEY) pairs.
+# view-config and the documents are rewritten into out_dir when they link the tiles or a WebP variant,
+# and it returns a dict from them to the rewritten ones
+def stage(files, view_config, out_dir, documents=(), workers=None):
+  if not available():
+    print(util.bcolors.WARNING + 'Pillow is not installed. images are uploaded as they are' + util.bcolors.ENDC)
+    return [(x, os.path.basename(x)) for x in files], {}
+
+  source = plan.digest(files + [view_config] + list(documents))
+  staged = last_stage(out_dir)
+  if (
+    staged is not None and staged.get('version') == VERSION and staged['source'] == source and
+    all(os.path.exists(x[0]) for x in staged['objects'] + [(x,) for x in staged['rewritten'].values()])
+  ):
+    return [tuple(x) for x in staged['objects']], staged['rewritten']
+
+  print(util.bcolors.OKGREEN + 'Starting to stage images of {} files'.format(len(files)) + util.bcolors.ENDC)
+  with open(view_config) as f:
+    configs = json.load(f)
+  floors = set(floor_key(x) for x in configs if floor_key(x) is not None)
+  fmt = tile_format()
+
+  objects = []
+  variants = {}
+  tiled = None
+  # workers are spawned, not forked. the stage runs on a scheduler thread next to others holding locks
+  with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+    optimized = []
+    futures = []
+    for file in files:
+      key = os.path.basename(file)
+      if os.path.splitext(key)[1].lower() not in IMAGE_EXTENSIONS:
+        objects.append((file, key))
+        continue
+
+      # the floor map is linked only by its tiles
+      if key not in floors:
+        optimized.append((key, executor.submit(optimize, file, out_dir, key)))
+        continue
+      config = next(x for x in configs if floor_key(x) == key)
+      with Image.open(file) as image:
+        size = image.size
+      zooms = levels(
+        size, config['map']['floor']['bounds'],
+        config['map']['base'].get('minZoom', 0), config['map']['base'].get('maxZoom', 0)
+      )
+      key_dir = '{}/tiles'.format(os.path.splitext(key)[0])
+      futures.extend(
+        executor.submit(cut_level, file, out_dir, key_dir, z, config['map']['floor']['bounds'], fmt) for z in zooms
+      )
+      tiled = (key, key_dir, zooms)
+    for key, x in optimized:
+      staged_objects, variant = x.result()
+      objects.extend(staged_objects)
+      if variant is not None:
+        variants[key] = variant
+    for x in futures:
+      objects.extend(x.result())
+
+  if tiled is not None:
+    configs = tiled_config(configs, *tiled, fmt)
+  os.makedirs(out_dir, exist_ok=True)
+  rewritten = {}
+  for document in [view_config] + list(documents):
+    if document == view_config:
+      doc = configs
+    else:
+      with open(document) as f:
+        doc = json.load(f)
+    # the links are rewritten the way content keys are, by a manifest of the variants
+    count = cos_content.rewrite(doc, {'objects': variants, 'directories': {}})
+    if count == 0 and (document != view_config or tiled is None):
+      continue
+    rewritten[document] = os.path.join(out_dir, os.path.basename(document))
+    with open(rewritten[document], 'w') as f:
+      json.dump(doc, f, indent=2)
+
+  print(util.bcolors.OKBLUE + 'staged {} objects of {} bytes from {} files'.format(
+    len(objects), sum(os.path.getsize(x[0]) for x in objects), len(files)
+  ) + util.bcolors.ENDC)
+
+  with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+    json.dump({'version': VERSION, 'source': source, 'objects': objects, 'rewritten': rewritten}, f)
+  return objects, rewritten
+
+# manifest of the last stage into out_dir, with the staged objects, or None when nothing was staged there
+def last_stage(out_dir):
+  manifest = os.path.join(out_dir, MANIFEST)
+  if not os.path.exists(manifest):
+    return None
+  with open(manifest) as f:
+    return json.load(f)
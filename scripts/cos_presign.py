@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import re
+import sys
+import util
+import credentials
+import tracing
+import s3
+import cloudant_loader
+import service_cloudant
+
+# presigned URLs live as long as the signature v4 allows, and are signed again 2 days before they expire
+EXPIRES = s3.MAX_PRESIGN_EXPIRES
+REFRESH_BEFORE = 2 * 24 * 3600
+# databases whose documents link images
+DATABASES = 'shops,view-config'
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+'''
+Presigned image links.
+the seed data links an image through the files function, like
+  {"url": ".../public/api/files", "options": {"method": "post", "body": "{\"bucket\": ..., \"key\": \"shop.png\"}"}}
+which is rewritten in Cloudant to a GET of a URL presigned by the reader HMAC keys, which browsers and CDNs can cache:
+  {"url": "https://s3...?X-Amz-Signature=...", "options": {"method": "get"}, "object": {...}, "expires": "..."}
+a link of a tile template, like floormap/tiles/{z}/{x}/{y}.webp, gets "urls" of each tile keyed by Z/X/Y instead.
+the links are signed again by refresh() before they expire, which should run at least once in
+EXPIRES - REFRESH_BEFORE, like from cron.
+'''
+# get arguments
+def parse_args(args):
+  parser = argparse.ArgumentParser(description="""
+  sign image links of Cloudant documents by the COS reader HMAC keys, and sign them again before they expire.
+  """)
+  parser.add_argument('-o', '--operation', default='refresh', help='refresh')
+  parser.add_argument('-r', '--region', default='jp-tok', help='region name')
+  parser.add_argument('-c', '--credential-file', default='./.credentials',
+    help='file path of the service credentials. a tenant one gives the database and key prefixes')
+  parser.add_argument('-b', '--databases', default=DATABASES,
+    help='comma-separated list of databases whose documents link images, without the tenant prefix')
+  parser.add_argument('-e', '--expires', default=EXPIRES, type=int, help='seconds presigned URLs live')
+  parser.add_argument('--refresh-before', default=REFRESH_BEFORE, type=int,
+    help='seconds before the expiry when URLs are signed again')
+  parser.add_argument('-f', '--force', action='store_true', help='sign all links again')
+
+  return parser.parse_args(args)
+
+def now():
+  return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+
+def template_pattern(key):
+  pattern = re.escape(key)
+  for x in ['z', 'x', 'y']:
+    pattern = pattern.replace(re.escape('{' + x + '}'), '(?P<{}>-?[0-9]+)'.format(x))
+  return re.compile('^{}$'.format(pattern))
+
+# sign a link. keys are looked up under the prefix of the bucket the objects were uploaded to
+def sign(link, client, bucket, key, prefix, expires, signed_at):
+  signed = {
+    'options': {'method': 'get', 'headers': {'accept': link['options'].get('headers', {}).get('accept', 'image/*')}},
+    'object': {'bucket': bucket, 'key': key},
+    'expires': (signed_at + datetime.timedelta(seconds=expires)).strftime(TIME_FORMAT)
+  }
+  if '{z}' not in key:
+    signed['url'] = client.presign(bucket, prefix + key, expires)
+    return signed
+
+  pattern = template_pattern(prefix + key)
+  signed['urls'] = {}
+  for page in client.list_objects(bucket, prefix + key[:key.index('{')]):
+    for x in page:
+      m = pattern.match(x)
+      if m is not None:
+        signed['urls']['{}/{}/{}'.format(m.group('z'), m.group('x'), m.group('y'))] = client.presign(bucket, x, expires)
+  return signed
+
+# sign the links of a document that aren't signed yet or expire soon. it returns the number of links signed
+def sign_links(doc, client, bucket, prefix, expires, refresh_before, signed_at, force=False):
+  count = 0
+  if isinstance(doc, list):
+    for x in doc:
+      count += sign_links(x, client, bucket, prefix, expires, refresh_before, signed_at, force)
+    return count
+  if not isinstance(doc, dict):
+    return 0
+
+  for k, v in list(doc.items()):
+    # the bucket in the seed data is a placeholder. objects are in the bucket they were uploaded to
+    key = cloudant_loader.link_key(v) if isinstance(v, dict) else None
+    if key is None:
+      count += sign_links(v, client, bucket, prefix, expires, refresh_before, signed_at, force)
+      continue
+    if not force and 'expires' in v:
+      expiry = datetime.datetime.strptime(v['expires'], TIME_FORMAT)
+      if expiry - signed_at > datetime.timedelta(seconds=refresh_before):
+        continue
+    doc[k] = dict({x: y for x, y in v.items() if x not in ['url', 'urls', 'options']},
+      **sign(v, client, bucket, key, prefix, expires, signed_at))
+    count += 1
+  return count
+
+# sign the image links of the databases and write the documents that changed
+def refresh(cloudant_client, client, databases, bucket, prefix='', expires=EXPIRES, refresh_before=REFRESH_BEFORE,
+  force=False):
+  print(util.bcolors.OKGREEN + 'Starting to sign image links in {}'.format(', '.join(databases)) + util.bcolors.ENDC)
+
+  signed_at = now()
+  total = 0
+  for database in databases:
+    db = cloudant_client[database]
+    with tracing.tracer.span('_all_docs {}'.format(database), 'cloudant'):
+      rows = db.all_docs(include_docs=True)['rows']
+    docs = []
+    for row in rows:
+      doc = row.get('doc')
+      if doc is None or doc['_id'].startswith('_design/'):
+        continue
+      count = sign_links(doc, client, bucket, prefix, expires, refresh_before, signed_at, force)
+      if count > 0:
+        docs.append(doc)
+        total += count
+    if len(docs) > 0:
+      cloudant_loader.load_docs(cloudant_client, database, ((x, len(json.dumps(x))) for x in docs))
+
+  print(util.bcolors.OKBLUE + '{} links signed until {}'.format(
+    total, (signed_at + datetime.timedelta(seconds=expires)).strftime(TIME_FORMAT)
+  ) + util.bcolors.ENDC)
+  return total
+
+# refresh with the credentials, the bucket and the prefixes in a credential file
+def refresh_file(credential_file, region, databases=DATABASES.split(','), expires=EXPIRES,
+  refresh_before=REFRESH_BEFORE, force=False):
+  store = credentials.get_store(credential_file)
+  cred = store.get_service_credentials('CLOUDANT', 'writer')
+  hmac_keys = store.get_cos_hmac_keys('reader')
+  bucket = store.get('UI_COMPONENTS_BUCKET')
+  if cred is None or hmac_keys is None or bucket is None:
+    print(util.bcolors.FAIL + 'no Cloudant credentials, COS reader HMAC keys or bucket in {}'.format(
+      credential_file
+    ) + util.bcolors.ENDC)
+    raise Exception('no Cloudant credentials, COS reader HMAC keys or bucket in {}'.format(credential_file))
+
+  db_prefix = store.get('CLOUDANT_DB_PREFIX') or ''
+  cloudant_client = service_cloudant.connect(cred)
+  try:
+    return refresh(
+      cloudant_client, s3.S3Client(hmac_keys[0], hmac_keys[1], region), [db_prefix + x for x in databases],
+      bucket, store.get('COS_KEY_PREFIX') or '', expires, refresh_before, force
+    )
+  finally:
+    cloudant_client.disconnect()
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv[1:])
+  if args.operation == 'refresh':
+    refresh_file(
+      args.credential_file, args.region, args.databases.split(','), args.expires, args.refresh_before, args.force
+    )
+  else:
+    print(util.bcolors.WARNING + 'no option. please check usage of this script.' + util.bcolors.ENDC)
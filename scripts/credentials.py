@@ -0,0 +1,155 @@
+import os
+import json
+import fcntl
+import tempfile
+import threading
+import util
+
+
+'''
+Credential store over the KEY=VALUE file, like ./.credentials.
+the file is loaded once into an index, which is reloaded only when another process changed the file.
+every write re-reads the file under an exclusive lock and replaces it atomically,
+so parallel provisioning steps and sub-scripts never lose each other's entries.
+'''
+class CredentialStore:
+  def __init__(self, path):
+    self.path = path
+    self.index = {}
+    self.stat = None
+    self.lock = threading.RLock()
+
+  '''
+  reads
+  '''
+  def get(self, key, default=None):
+    with self.lock:
+      self._refresh()
+      return self.index.get(key, default)
+
+  def keys(self):
+    with self.lock:
+      self._refresh()
+      return list(self.index.keys())
+
+  def get_json(self, key):
+    value = self.get(key)
+    if value is None:
+      return None
+    try:
+      return json.loads(value)
+    except ValueError:
+      print(util.bcolors.FAIL + '{} in {} is not JSON'.format(key, self.path) + util.bcolors.ENDC)
+      raise Exception('{} in {} is not JSON'.format(key, self.path))
+
+  # service credentials stored as SERVICE_ROLE_CREDENTIALS, like CLOUDANT_WRITER_CREDENTIALS
+  def get_service_credentials(self, service, role):
+    return self.get_json('{}_{}_CREDENTIALS'.format(service.upper(), role.upper()))
+
+  def get_cos_hmac_keys(self, role='writer'):
+    cred = self.get_service_credentials('COS', role)
+    if cred is None or 'cos_hmac_keys' not in cred:
+      return None
+    return cred['cos_hmac_keys']['access_key_id'], cred['cos_hmac_keys']['secret_access_key']
+
+  '''
+  writes
+  '''
+  def set(self, key, value):
+    self.update({key: value})
+
+  def set_json(self, key, value):
+    self.update({key: json.dumps(value)})
+
+  def update(self, values):
+    with self.lock, self._file_lock():
+      self._load()
+      self.index.update({k: str(v) for k, v in values.items()})
+      self._write()
+
+  # drop all entries and start over with the given ones
+  def reset(self, values=None):
+    with self.lock, self._file_lock():
+      self.index = {k: str(v) for k, v in (values or {}).items()}
+      self._write()
+
+  def remove(self):
+    with self.lock:
+      for path in [self.path, self.path + '.lock']:
+        if os.path.exists(path):
+          os.remove(path)
+      self.index = {}
+      self.stat = None
+
+  '''
+  file
+  '''
+  def _file_lock(self):
+    return FileLock(self.path + '.lock')
+
+  def _current_stat(self):
+    try:
+      s = os.stat(self.path)
+    except FileNotFoundError:
+      return None
+    return (s.st_ino, s.st_size, s.st_mtime_ns)
+
+  def _refresh(self):
+    if self._current_stat() != self.stat:
+      self._load()
+
+  def _load(self):
+    self.stat = self._current_stat()
+    self.index = {}
+    if self.stat is None:
+      return
+    with open(self.path) as f:
+      for line in f:
+        # values are JSON that may contain '=', so only the first one separates the key
+        kv = line.rstrip('\n').split('=', 1)
+        if len(kv) == 2 and len(kv[0]) > 0:
+          self.index[kv[0]] = kv[1]
+
+  def _write(self):
+    directory = os.path.dirname(os.path.abspath(self.path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.credentials-')
+    try:
+      with os.fdopen(fd, 'w') as f:
+        for k, v in self.index.items():
+          f.write('{}={}\n'.format(k, v))
+        f.flush()
+        os.fsync(f.fileno())
+      os.chmod(tmp, 0o600)
+      os.replace(tmp, self.path)
+    except Exception:
+      os.remove(tmp)
+      raise
+    self.stat = self._current_stat()
+
+
+class FileLock:
+  def __init__(self, path):
+    self.path = path
+    self.fd = None
+
+  def __enter__(self):
+    self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(self.fd, fcntl.LOCK_EX)
+    return self
+
+  def __exit__(self, *args):
+    fcntl.flock(self.fd, fcntl.LOCK_UN)
+    os.close(self.fd)
+    self.fd = None
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+# one store per file in a process, so a file is parsed once however many scripts read it
+def get_store(path):
+  key = os.path.abspath(path)
+  with stores_lock:
+    if key not in stores:
+      stores[key] = CredentialStore(path)
+    return stores[key]
@@ -5,10 +5,16 @@ import subprocess
 import os
 import sys
 import json
+import zipfile
 import util
+import credentials
 
 ASSETS_DB = 'assets'
 ES_TOPIC = 'covsafe'
+PYTHON_GENERATOR = '../functions/dummy-generator/dummy_generator.py'
+# modules of scripts/ the generator imports, bundled next to it in the action zip
+PYTHON_MODULES = ['util.py', 'http_client.py', 's3.py', 'credentials.py', 'tracing.py']
+PYTHON_ACTION_ZIP = './.build/dummy-generator.zip'
 
 def parse_args(args):
   parser = argparse.ArgumentParser(description="""
@@ -28,6 +34,12 @@ def parse_args(args):
   parser.add_argument(
     '-c', '--credentials-file', default='./credentials', help='file to store service credentials'
   )
+  parser.add_argument('-k', '--kind', default='nodejs',
+    help='nodejs|python. python deploys dummy_generator.py, which supports the options below')
+  parser.add_argument('-e', '--rate', type=float,
+    help='events per second. one event per asset per 5 minutes by default')
+  parser.add_argument('-l', '--curve', default='flat',
+    help='load curve by hour of day: flat|mall or 24 comma-separated factors')
 
   return parser.parse_args(args)
 
@@ -41,6 +53,43 @@ def create(args):
 
   util.create_functions_package(args.package)
 
+  if args.kind == 'python':
+    create_python_action(args)
+  else:
+    create_nodejs_action(args)
+
+  # create trigger
+  # you are able to see its activation by polling the log by `ibmcloud fn activation poll`
+  util.create_functions_periodical_trigger(args.trigger, '"*/5 * * * *"')
+  util.create_functions_rule(args.rule, args.trigger, args.package, args.action)
+
+# the python generator talks to all brokers, so it gets the credentials as they are
+def create_python_action(args):
+  store = credentials.get_store(args.credentials_file)
+  parameters = {
+    'cloudant-credentials': store.get('CLOUDANT_READER_CREDENTIALS'),
+    'cloudant-assets-db': ASSETS_DB,
+    'es-topic': ES_TOPIC,
+    'es-credentials': store.get('EVENT_STREAMS_WRITER_CREDENTIALS'),
+    'curve': args.curve
+  }
+  if args.rate is not None:
+    parameters['rate'] = args.rate
+
+  util.create_functions_action(
+    args.package, args.action, build_python_action(PYTHON_ACTION_ZIP), 'python:3.7', '90000', parameters
+  )
+
+# the generator runs as __main__.py of the zip. numpy and kafka-python are preinstalled in the runtime
+def build_python_action(path):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+    z.write(PYTHON_GENERATOR, '__main__.py')
+    for x in PYTHON_MODULES:
+      z.write(x, x)
+  return path
+
+def create_nodejs_action(args):
   # create config.json for dummy-generator
   # currently, the kafka javascript lib 'kafka-node' might not support cluster Kafka
   # since I got NotLeaderForPartition error.
@@ -55,10 +104,9 @@ def create(args):
   topic = util.get_topic_detail(ES_TOPIC)
   leader = int(topic['partition_summaries'][0]['leader'])
   # get event streams credentials and update sasl list with only leader
-  es_credentials = util.get_credentials_value(
-    args.credentials_file, 'EVENT_STREAMS_WRITER_CREDENTIALS'
+  es_credentials = credentials.get_store(args.credentials_file).get_service_credentials(
+    'EVENT_STREAMS', 'WRITER'
   )
-  es_credentials = json.loads(es_credentials)
   es_credentials['kafka_brokers_sasl'] = list(
     filter(
       lambda x: x.startswith('broker-{}'.format(leader)), es_credentials['kafka_brokers_sasl']
@@ -86,11 +134,6 @@ def create(args):
   ], stdout=subprocess.PIPE)
   print(p1.communicate()[0].decode('utf-8'))
 
-  # create trigger
-  # you are able to see its activation by polling the log by `ibmcloud fn activation poll`
-  util.create_functions_periodical_trigger(args.trigger, '"*/5 * * * *"')
-  util.create_functions_rule(args.rule, args.trigger, args.package, args.action)
-
 
 def delete(args):
   args = parse_args(args)
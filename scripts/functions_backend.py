@@ -0,0 +1,288 @@
+import os
+import json
+import base64
+from urllib import parse
+import util
+import http_client
+
+# OpenWhisk REST API of IBM Cloud Functions.
+# FUNCTIONS_API_HOST and FUNCTIONS_AUTH (basic auth as "UUID:KEY") point it to another OpenWhisk,
+# like a local stub server.
+API_HOST = 'https://{}.functions.cloud.ibm.com'
+PAGE_SIZE = 200
+# fields of an entity sent back on update. a PUT replaces the entity, so omitted fields would be dropped
+ENTITY_FIELDS = ['exec', 'limits', 'parameters', 'annotations', 'publish', 'binding']
+
+
+'''
+Functions backend calling the OpenWhisk REST API directly over the pooled HTTP session.
+util.py dispatches the Functions helpers to it when it is installed by util.use_functions_backend().
+the CLI remains the default, and is still used for feed triggers and APIs with extra CLI options.
+benchmarks/stubs.py serves the same API for offline runs.
+'''
+class RestBackend:
+  def __init__(self, region, resource_group_id=None, host=None, auth=None):
+    self.host = (host or os.environ.get('FUNCTIONS_API_HOST') or API_HOST.format(region)).rstrip('/')
+    self.auth = auth or os.environ.get('FUNCTIONS_AUTH')
+    self.resource_group_id = resource_group_id
+    self.session = http_client.session
+    # '_' is the namespace of the credentials for basic auth.
+    # IAM namespaces are addressed by their id, which is set by target()
+    self.namespace = None
+    self.namespace_id = '_'
+
+  '''
+  plumbing
+  '''
+  def headers(self):
+    if self.auth is not None:
+      return {'Authorization': 'Basic ' + base64.b64encode(self.auth.encode()).decode()}
+    return {'Authorization': util.get_IAM_token()}
+
+  def call(self, method, path, body=None, query=None, ok=(200,)):
+    url = '{}/api/v1{}'.format(self.host, path)
+    if query is not None:
+      url = url + '?' + parse.urlencode(query)
+    res = self.session.request(method, url, body=body, headers=self.headers())
+    if res.status not in ok:
+      print(
+        util.bcolors.FAIL + '{} {} returned {} {}'.format(method, path, res.status, res.body) +
+        util.bcolors.ENDC
+      )
+      raise Exception('{} {} returned {}'.format(method, path, res.status))
+    return res
+
+  def entity_path(self, collection, name=''):
+    path = '/namespaces/{}/{}'.format(parse.quote(self.namespace_id), collection)
+    if len(name) > 0:
+      path = path + '/' + parse.quote(name)
+    return path
+
+  def qualified(self, name):
+    return '/{}/{}'.format(self.namespace_id, name.lstrip('/'))
+
+  # body to PUT back an entity read by GET, with some fields changed
+  def entity_body(self, current, **changes):
+    body = {k: v for k, v in current.items() if k in ENTITY_FIELDS}
+    body.update(changes)
+    return body
+
+  # read a whole collection page by page, so an existence check costs one request per 200 entities
+  def list(self, collection):
+    items = []
+    while True:
+      page = self.call(
+        'GET', self.entity_path(collection), query={'limit': PAGE_SIZE, 'skip': len(items)}
+      ).json()
+      items = items + page
+      if len(page) < PAGE_SIZE:
+        return items
+
+  def list_rows(self, collection):
+    rows = {}
+    for x in self.list(collection):
+      # entities in a package have "NAMESPACE/PACKAGE" as their namespace
+      path = x['namespace'].split('/')
+      name = '/'.join(path[1:] + [x['name']])
+      rows[name] = x
+    return rows
+
+  def list_namespaces(self):
+    if self.auth is not None:
+      return {x: {'id': x} for x in self.call('GET', '/namespaces').json()}
+
+    rows = {}
+    offset = 0
+    while True:
+      page = self.call('GET', '/namespaces', query={'limit': PAGE_SIZE, 'offset': offset}).json()
+      for x in page['namespaces']:
+        rows[x['name']] = x
+      offset = offset + len(page['namespaces'])
+      if len(page['namespaces']) == 0 or offset >= page.get('total_count', 0):
+        return rows
+
+  # fetchers used by util.inventory in place of the CLI list commands
+  def fetchers(self):
+    return {
+      'namespaces': lambda: {k: [k, 'IAM-based', v['id']] for k, v in self.list_namespaces().items()},
+      'packages': lambda: self.list_rows('packages'),
+      'actions': lambda: self.list_rows('actions'),
+      'triggers': lambda: self.list_rows('triggers'),
+      'rules': lambda: self.list_rows('rules'),
+      'apis': lambda: self.list_apis(),
+    }
+
+  def target(self, namespace):
+    row = util.inventory.get('namespaces', namespace)
+    if row is None:
+      raise Exception('no namespace {}'.format(namespace))
+    self.namespace = namespace
+    self.namespace_id = row[2]
+    util.inventory.invalidate(*util.Inventory.FUNCTIONS_KINDS)
+
+  '''
+  namespaces
+  '''
+  def create_functions_namespace(self, namespace):
+    if not util.inventory.exists('namespaces', namespace):
+      if self.resource_group_id is None:
+        raise Exception('resource group id is required to create namespace {}'.format(namespace))
+      self.call('POST', '/namespaces', body={
+        'name': namespace,
+        'resource_group_id': self.resource_group_id,
+        'resource_plan_id': 'functions-base-plan'
+      }, ok=(201,))
+      util.inventory.invalidate('namespaces')
+    self.target(namespace)
+
+  def delete_functions_namespace(self, namespace):
+    row = util.inventory.get('namespaces', namespace)
+    if row is not None:
+      self.call('DELETE', '/namespaces/{}'.format(row[2]), ok=(200, 204))
+    util.inventory.remove('namespaces', namespace)
+
+  '''
+  packages, actions, triggers and rules
+  '''
+  def create_functions_package(self, package):
+    if not util.inventory.exists('packages', package):
+      self.call('PUT', self.entity_path('packages', package), body={}, query={'overwrite': 'false'})
+      util.inventory.add('packages', package)
+
+  def create_functions_action(self, package, action, file, kind, timeout, parameters=None):
+    name = '{}/{}'.format(package, action)
+    with open(file, 'rb') as f:
+      code = f.read()
+    code_exec = {'kind': kind}
+    if file.endswith('.zip'):
+      code_exec['code'] = base64.b64encode(code).decode()
+      code_exec['binary'] = True
+    else:
+      code_exec['code'] = code.decode('utf-8')
+
+    body = {'exec': code_exec, 'limits': {'timeout': int(timeout)}}
+    # an update keeps the annotations, like web-export, and without parameters the ones bound before
+    if util.inventory.exists('actions', name):
+      current = self.call('GET', self.entity_path('actions', name), query={'code': 'false'}).json()
+      body = self.entity_body(current, **body)
+    if parameters is not None:
+      body['parameters'] = [{'key': k, 'value': v} for k, v in parameters.items()]
+    self.call('PUT', self.entity_path('actions', name), body=body, query={'overwrite': 'true'})
+    util.inventory.add('actions', name)
+
+  def update_functions_action_to_web(self, package, action, web_type):
+    name = '{}/{}'.format(package, action)
+    # the action is sent back whole with its code, as an update with only annotations would drop exec
+    current = self.call('GET', self.entity_path('actions', name)).json()
+    enabled = web_type not in ['false', 'no']
+    annotations = {x['key']: x['value'] for x in current.get('annotations', [])}
+    annotations['web-export'] = enabled
+    annotations['final'] = enabled
+    annotations['raw-http'] = enabled and web_type == 'raw'
+    self.call('PUT', self.entity_path('actions', name), body=self.entity_body(
+      current, annotations=[{'key': k, 'value': v} for k, v in annotations.items()]
+    ), query={'overwrite': 'true'})
+
+  def create_functions_trigger(self, trigger):
+    if not util.inventory.exists('triggers', trigger):
+      self.call('PUT', self.entity_path('triggers', trigger), body={}, query={'overwrite': 'false'})
+      util.inventory.add('triggers', trigger)
+
+  def create_functions_rule(self, rule, trigger, package, action):
+    self.call('PUT', self.entity_path('rules', rule), body={
+      'trigger': self.qualified(trigger),
+      'action': self.qualified('{}/{}'.format(package, action))
+    }, query={'overwrite': 'true'})
+    util.inventory.add('rules', rule)
+
+  def create_functions_sequence(self, sequence, actions):
+    if not util.inventory.exists('actions', sequence):
+      self.call('PUT', self.entity_path('actions', sequence), body={
+        'exec': {'kind': 'sequence', 'components': [self.qualified(x) for x in actions]}
+      }, query={'overwrite': 'false'})
+      util.inventory.add('actions', sequence)
+
+  '''
+  parameters
+  '''
+  # same parameter as 'ibmcloud fn service bind' sets
+  def bind_functions_to_service_credentials(self, target, service, key):
+    cred = util.inventory.get('service-keys', key)
+    if cred is None:
+      raise Exception('no service key {}'.format(key))
+
+    collection = 'actions' if '/' in target else 'packages'
+    current = self.call('GET', self.entity_path(collection, target)).json()
+    parameters = {x['key']: x['value'] for x in current.get('parameters', [])}
+    bx_creds = parameters.get('__bx_creds', {})
+    bx_creds[service] = dict(cred['credentials'], credentials=key, instance=cred.get('source_crn', ''))
+    parameters['__bx_creds'] = bx_creds
+    self.call('PUT', self.entity_path(collection, target), body=self.entity_body(
+      current, parameters=[{'key': k, 'value': v} for k, v in parameters.items()]
+    ), query={'overwrite': 'true'})
+
+  def bind_functions_predefined_to(self, target, package):
+    # target is like /whisk.system/cloudant
+    path = target.strip('/').split('/')
+    self.call('PUT', self.entity_path('packages', package), body={
+      'binding': {'namespace': path[0], 'name': path[1]}
+    }, query={'overwrite': 'true'})
+    util.inventory.add('packages', package)
+
+  def get_functions_action_list(self, namespace, package):
+    self.target(namespace)
+    return [x['name'] for x in self.call('GET', self.entity_path('packages', package)).json().get('actions', [])]
+
+  def get_functions_package_or_action_parameters(self, isAction, target):
+    collection = 'actions' if isAction is True else 'packages'
+    current = self.call('GET', self.entity_path(collection, target), query={'code': 'false'}).json()
+    print(util.bcolors.OKGREEN + json.dumps(current.get('parameters', []), indent=2) + util.bcolors.ENDC)
+    return current.get('parameters', [])
+
+  '''
+  API Gateway
+  '''
+  # the gateway is managed by the apimgmt web actions of whisk.system, as the wsk CLI does
+  def call_apimgmt(self, method, action, body=None, query=None):
+    query = dict(query or {}, spaceguid=self.namespace_id)
+    if self.auth is None:
+      query['accesstoken'] = util.get_IAM_token().split(' ')[-1]
+    return self.call(method, '/web/whisk.system/apimgmt/{}.http'.format(action), body=body, query=query)
+
+  # rows named "VERB BASE_PATH/API_PATH" like the ones of the CLI
+  def list_apis(self):
+    rows = {}
+    for api in self.call_apimgmt('GET', 'getApi').json().get('apis', []):
+      doc = api['value']['apidoc']
+      for path, operations in doc.get('paths', {}).items():
+        for verb in operations.keys():
+          rows['{} {}{}'.format(verb.lower(), doc['basePath'], path)] = api['value']
+    return rows
+
+  def create_functions_api(self, api_name, base_path, api_path, api_verb, action, response_type):
+    name = '{} {}{}'.format(api_verb.lower(), base_path, api_path)
+    if util.inventory.exists('apis', name):
+      return
+    self.call_apimgmt('POST', 'createApi', body={'apidoc': {
+      'namespace': self.namespace_id,
+      'apiName': api_name,
+      'gatewayBasePath': base_path,
+      'gatewayPath': api_path,
+      'gatewayMethod': api_verb.upper(),
+      'id': 'API:{}:{}'.format(self.namespace_id, base_path),
+      'action': {
+        'name': action,
+        'namespace': self.namespace_id,
+        'backendMethod': api_verb.upper(),
+        'backendUrl': '{}/api/v1/web/{}/{}.{}'.format(self.host, self.namespace_id, action, response_type),
+        'authkey': self.auth or ''
+      }
+    }}, query={'responsetype': response_type})
+    util.inventory.add('apis', name)
+
+  '''
+  deletion
+  '''
+  def delete(self, collection, name, kind):
+    self.call('DELETE', self.entity_path(collection, name), ok=(200, 404))
+    util.inventory.remove(kind, name)
@@ -0,0 +1,126 @@
+import json
+import gzip
+import socket
+import threading
+import http.client
+from urllib import parse
+import tracing
+
+
+# seconds until a request gives up when no timeout is given to the call
+DEFAULT_TIMEOUT = 60
+# methods sent again when a pooled connection fails. others, like POST, only when the request wasn't sent
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']
+
+
+# a request got no answer in its timeout. callers polling a slow endpoint catch it to try again
+class Timeout(TimeoutError):
+  pass
+
+
+'''
+HTTP client with keep-alive connection pooling.
+connections are kept per scheme, host and port, and reused across requests and threads.
+responses are requested with gzip and decompressed transparently.
+'''
+class Response:
+  def __init__(self, status, reason, headers, body):
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+    self.body = body
+
+  def ok(self):
+    return 200 <= self.status < 300
+
+  def json(self):
+    return json.loads(self.body.decode('utf-8')) if len(self.body) > 0 else None
+
+
+class Session:
+  def __init__(self, max_idle=8, timeout=DEFAULT_TIMEOUT):
+    self.max_idle = max_idle
+    self.timeout = timeout
+    self.idle = {}
+    self.lock = threading.Lock()
+
+  def request(self, method, url, body=None, headers=None, timeout=None):
+    u = parse.urlsplit(url)
+    key = (u.scheme, u.hostname, u.port)
+    path = u.path or '/'
+    if u.query:
+      path = path + '?' + u.query
+
+    headers = dict(headers or {})
+    headers.setdefault('Accept-Encoding', 'gzip')
+    if isinstance(body, (dict, list)):
+      body = json.dumps(body).encode()
+      headers.setdefault('Content-Type', 'application/json')
+
+    with tracing.tracer.span('{} {}'.format(method, u.hostname), 'http', url=tracing.redact_url(url)) as span:
+      res = self._request(method, url, key, path, body, headers, timeout)
+      span.set(status=res.status, bytes_out=len(body or b''), bytes_in=len(res.body))
+      return res
+
+  def _request(self, method, url, key, path, body, headers, timeout):
+    # a pooled connection might have been closed by the server, so retry once with a new one.
+    # a POST might have reached the server before the connection broke, and it's not sent twice
+    for attempt in range(2):
+      conn, reused = self._acquire(key)
+      conn.timeout = timeout or self.timeout
+      if conn.sock is not None:
+        conn.sock.settimeout(conn.timeout)
+      sent = False
+      try:
+        conn.request(method, path, body=body, headers=headers)
+        sent = True
+        res = conn.getresponse()
+        data = res.read()
+      except socket.timeout:
+        conn.close()
+        raise Timeout('{} {} timed out after {}s'.format(method, url, conn.timeout))
+      except (http.client.HTTPException, ConnectionError):
+        conn.close()
+        if reused and attempt == 0 and (method in IDEMPOTENT_METHODS or not sent):
+          continue
+        raise
+
+      if res.will_close:
+        conn.close()
+      else:
+        self._release(key, conn)
+
+      if res.getheader('Content-Encoding', '') == 'gzip':
+        data = gzip.decompress(data)
+
+      return Response(res.status, res.reason, res.headers, data)
+
+  def close(self):
+    with self.lock:
+      for conns in self.idle.values():
+        for conn in conns:
+          conn.close()
+      self.idle = {}
+
+  def _acquire(self, key):
+    with self.lock:
+      conns = self.idle.get(key, [])
+      if len(conns) > 0:
+        return conns.pop(), True
+
+    scheme, host, port = key
+    if scheme == 'https':
+      return http.client.HTTPSConnection(host, port), False
+    return http.client.HTTPConnection(host, port), False
+
+  def _release(self, key, conn):
+    with self.lock:
+      conns = self.idle.setdefault(key, [])
+      if len(conns) < self.max_idle:
+        conns.append(conn)
+        return
+    conn.close()
+
+
+# shared by every sub-script of one run
+session = Session()
@@ -2,21 +2,39 @@
 
 import argparse
 import os
+import re
 import sys
 import uuid
 import util
+import credentials
+from scheduler import Scheduler
+from functions_backend import RestBackend
+import plan
+import tracing
+import checkpoint
+import spatial_index
+import cos_images
+import cos_content
+import cos_presign
+import s3
+import cloudant_indexes
+import cloudant_rolling
 import service_app_id as app_id
 import service_cos as cos
 import service_cloudant as nosql
 import service_event_streams as es
 
 CREDENTIALS_FILE = './.credentials'
+BUILD_DIR = './.build'
 COVSAFE_VIEW = 'covsafe-view'
 ES_TOPICS = 'covsafe'
 APPID_REGISTERED_APP = 'covsafe'
 APPID_REGISTERED_USER = 'user@fake.email:JamesSmith:password'
 UI_COMPONENTS_BUCKET = 'UI_COMPONENTS_BUCKET'
+# bucket a plan reports before apply has named it
+UNNAMED_BUCKET = '(named by apply)'
 CLOUDANT_DB = 'assets,assets_staff,view-config,log_risk_calculation,log_risk_notifier,a_notification_template,ads,shops'
+LOG_DB = 'log_risk_calculation,log_risk_notifier'
 SERVICES = {
   'app_id': 'app-id',
   'cos': 'cos',
@@ -30,110 +48,491 @@ def parse_args(args):
   deploy covsafe solution to IBM Cloud.
   This requires an environment variable ${APIKEY} as your IAM API key.
   """)
-  parser.add_argument('-o', '--operation', default='create', help='create|delete the solution')
+  parser.add_argument('-o', '--operation', default='create',
+    help='create|delete the solution, or plan|apply to show the changes to the live state and make only them'
+  )
   parser.add_argument('-p', '--project', default='covsafe', help='Project Name')
   parser.add_argument(
     '-t', '--tenant', default='c4c', help='''
     Tenant ID to select data set. This should be one of dir name under /path/to/project/data/'
     '''
   )
+  parser.add_argument(
+    '-T', '--tenants', help='''
+    comma-separated tenant IDs deployed together instead of --tenant. they share the service instances,
+    and each has its own databases named TENANT_DATABASE, objects under TENANT/ and a credential file
+    '''
+  )
+  parser.add_argument('--tenant-jobs', default=2, type=int,
+    help='number of tenants seeded concurrently with --tenants'
+  )
   parser.add_argument('-r', '--region', default='jp-tok', help='Region Name')
   parser.add_argument('-g', '--resource-group', default='c4c-covid-19', help='Resource Group Name')
   parser.add_argument('-l', '--plan', default='lite',
     help='service plan. Event Streams is created as standard, and App ID is done as lite regardless of this value'
   )
+  parser.add_argument('--log-period',
+    help='{}. log databases are split into one database per period, and expired ones are dropped'.format(
+      '|'.join(cloudant_rolling.PERIODS)
+    )
+  )
+  parser.add_argument('--log-retention', default=cloudant_rolling.RETENTION, type=int,
+    help='number of periods of log databases kept with --log-period'
+  )
+  parser.add_argument('--content-keys', action='store_true',
+    help='upload objects under keys with the hash of their content, cached as immutable, and link the seed data to them'
+  )
+  parser.add_argument('--presign', action='store_true',
+    help='link images in Cloudant by presigned COS URLs instead of the files function. refresh them by cos_presign.py'
+  )
+  parser.add_argument('--resume', action='store_true',
+    help='go on with a create that failed, skipping the steps its journal {} records'.format(checkpoint.JOURNAL_FILE)
+  )
+  parser.add_argument('-j', '--jobs', default=4, type=int,
+    help='number of provisioning or deleting steps run concurrently'
+  )
+  parser.add_argument('--functions-backend', default='cli',
+    help='cli|rest. rest calls the OpenWhisk REST API directly instead of the ibmcloud fn CLI'
+  )
+  parser.add_argument('--trace',
+    help='file path to write a Chrome trace of CLI calls, HTTP requests, waits and steps'
+  )
+  parser.add_argument('--trace-top', default=tracing.TOP_N, type=int,
+    help='number of the slowest spans shown in the trace summary'
+  )
 
   return parser.parse_args(args)
 
+# options that don't change what a create deploys, so a create can be resumed with others
+JOURNAL_IGNORED_OPTIONS = ['resume', 'jobs', 'tenant_jobs', 'trace', 'trace_top']
+
+# each completed step is recorded in the checkpoint journal. --resume skips the steps recorded,
+# keeping the bucket name and the credentials of the run that failed
 def create(args):
-  init()
   args = parse_args(args)
+  options = {k: v for k, v in sorted(vars(args).items()) if k not in JOURNAL_IGNORED_OPTIONS}
+  checkpoint.journal.start(checkpoint.JOURNAL_FILE, options, args.resume)
+  if not args.resume:
+    init()
 
   util.login(args.region, args.resource_group)
+  if args.functions_backend == 'rest':
+    util.use_functions_backend(RestBackend(args.region, util.get_resource_group_id(args.resource_group)))
 
-  # create UI namespace for app ID
-  util.create_functions_namespace(COVSAFE_VIEW)
-  view_ns = util.get_functions_namespace_id(COVSAFE_VIEW)
-  view_api = 'https://{}.functions.appdomain.cloud/api/v1/web/{}/covsafe/view/callback'.format(
-    args.region, view_ns.strip()
+  sched = build_graph(args)
+  sched.run()
+  util.inventory.report()
+
+  post_create()
+  checkpoint.journal.finish()
+
+# print the difference between the desired state and the live one. apply runs only the steps it needs
+# a plan changes nothing, so the bucket name of a first deploy is chosen only by apply
+def diff(args, apply=False):
+  args = parse_args(args)
+  if apply and util.get_credentials_value(CREDENTIALS_FILE, UI_COMPONENTS_BUCKET) is None:
+    init()
+
+  util.login(args.region, args.resource_group)
+  if args.functions_backend == 'rest':
+    util.use_functions_backend(RestBackend(args.region, util.get_resource_group_id(args.resource_group)))
+
+  sched = build_graph(args)
+  p = desired_state(args)
+  p.sweep()
+  p.report()
+
+  if apply and len(p.steps()) > 0:
+    sched.select(p.steps())
+    sched.run()
+  util.inventory.report()
+
+  if apply:
+    post_create()
+
+# source files of the tenant's seed. listing them reads nothing, so plans and deletes go by them,
+# while staging the images and building the spatial index are left to the steps that seed
+def tenant_sources(tenant):
+  cosdir = '../data/tenants/{}/cos'.format(tenant)
+  return {
+    'cos': sorted(
+      '{}/{}'.format(cosdir, f) for f in os.listdir(cosdir) if os.path.isfile(os.path.join(cosdir, f))
+    ),
+    'view_config': '../data/common/cloudant/view-config.json',
+    'notification_template': '../data/common/cloudant/notification-template.json',
+    'assets': '../data/tenants/{}/cloudant/assets.json'.format(tenant),
+    'assets_staff': '../data/tenants/{}/cloudant/assets_staff.json'.format(tenant),
+    'shops': '../data/tenants/{}/cloudant/shops.json'.format(tenant)
+  }
+
+# seed files of the tenant: FILE;DATABASE pairs for Cloudant and (FILE, KEY[, CACHE]) objects uploaded to the bucket.
+# images are staged first, and view-config and shops are the staged ones when they link the tiles or WebP variants.
+# with content_keys, objects get hashed keys and view-config and shops are rewritten to link them
+def tenant_data(tenant, db_prefix='', content_keys=False):
+  sources = tenant_sources(tenant)
+  cos_objects, rewritten = cos_images.stage(
+    sources['cos'] + [tenant_spatial_index(tenant)], sources['view_config'], '{}/{}/images'.format(BUILD_DIR, tenant),
+    [sources['shops']]
+  )
+  view_config = rewritten.get(sources['view_config'], sources['view_config'])
+  shops = rewritten.get(sources['shops'], sources['shops'])
+  if content_keys:
+    cos_objects, rewritten = cos_content.address(
+      cos_objects, [view_config, shops], '{}/{}/content'.format(BUILD_DIR, tenant)
+    )
+    view_config = rewritten.get(view_config, view_config)
+    shops = rewritten.get(shops, shops)
+
+  cloudant_data = [
+    '{};{}a_notification_template'.format(sources['notification_template'], db_prefix),
+    '{};{}view-config'.format(view_config, db_prefix),
+    '{};{}assets'.format(sources['assets'], db_prefix),
+    '{};{}assets_staff'.format(sources['assets_staff'], db_prefix),
+    '{};{}shops'.format(shops, db_prefix)
+  ]
+  return cloudant_data, cos_objects
+
+# keys of the tenant's objects as the last seed uploaded them, read from the manifests under the build directory.
+# the images are staged again only when there are no manifests, like on another machine
+def tenant_keys(tenant, content_keys=False):
+  staged = cos_images.last_stage('{}/{}/images'.format(BUILD_DIR, tenant))
+  if staged is not None:
+    keys = [x[1] for x in staged['objects']]
+  elif not cos_images.available():
+    keys = [os.path.basename(x) for x in tenant_sources(tenant)['cos']] + [spatial_index.file_name()]
+  else:
+    keys = None
+  manifest = cos_content.last_manifest('{}/{}/content'.format(BUILD_DIR, tenant)) if content_keys else None
+
+  if keys is None or (content_keys and manifest is None):
+    return [x[1] for x in tenant_data(tenant, content_keys=content_keys)[1]]
+  if content_keys:
+    keys = [cos_content.resolve(manifest, x) or x for x in keys] + [cos_content.MANIFEST]
+  return keys
+
+# -d of service_cos for the objects, as FILE;BUCKET;KEY[;CACHE]
+def cos_data(cos_objects, bucket):
+  return ','.join([';'.join((x[0], bucket) + tuple(x[1:])) for x in cos_objects])
+
+# the seed digests are taken over the sources, so a plan stages nothing.
+# what is staged from them changes only with the way images are staged and the version of the spatial index
+def stage_settings(content_keys=False):
+  fmt = cos_images.tile_format() if cos_images.available() else 'raw'
+  return '+{}+v{}'.format(fmt, spatial_index.VERSION) + ('+content' if content_keys else '')
+
+def cos_digest(sources, content_keys=False):
+  return plan.digest(sources['cos'] + [sources['assets']]) + stage_settings(content_keys)
+
+# index definitions of the common and the tenant's databases as FILE;DATABASE pairs
+def tenant_indexes(tenant, db_prefix=''):
+  units = cloudant_indexes.find('../data/common/cloudant', db_prefix)
+  units += cloudant_indexes.find('../data/tenants/{}/cloudant'.format(tenant), db_prefix)
+  return ['{};{}'.format(f, db) for f, db in units]
+
+# the seed digest of Cloudant covers the index definitions, so changing one re-runs the seed.
+# it covers the objects too, as view-config and shops link them. presigned links are written by the seed,
+# so switching them re-runs it
+def cloudant_digest(sources, indexes, presign=False, content_keys=False):
+  files = [v for k, v in sources.items() if k != 'cos'] + sources['cos'] + [x.split(';')[0] for x in indexes]
+  return plan.digest(files) + stage_settings(content_keys) + ('+presign' if presign else '')
+
+# options of service_cloudant for the log databases, given their prefix
+def log_options(args, db_prefix=''):
+  if args.log_period is None:
+    return []
+  return [
+    '-l', ','.join([db_prefix + x for x in LOG_DB.split(',')]),
+    '--log-period', args.log_period, '--retention', str(args.log_retention)
+  ]
+
+# databases a deploy leaves. log databases are the ones of the current and next periods with --log-period
+def live_databases(args, databases):
+  if args.log_period is None:
+    return databases
+  ret = []
+  for database in databases:
+    if any(database.endswith(x) for x in LOG_DB.split(',')):
+      ret.extend(cloudant_rolling.current(database, args.log_period))
+    else:
+      ret.append(database)
+  return ret
+
+# spatial index of the tenant's areas, uploaded next to the floor map
+def tenant_spatial_index(tenant):
+  return spatial_index.build_file(
+    '../data/tenants/{}/cloudant/assets.json'.format(tenant),
+    '{}/{}/{}'.format(BUILD_DIR, tenant, spatial_index.file_name())
   )
 
+'''
+multi-tenant
+'''
+def tenant_list(args):
+  if args.tenants is None:
+    return [args.tenant]
+
+  tenants = [x for x in args.tenants.split(',') if len(x) > 0]
+  for tenant in tenants:
+    if not os.path.isdir('../data/tenants/{}'.format(tenant)):
+      print(util.bcolors.FAIL + 'no data of tenant {}'.format(tenant) + util.bcolors.ENDC)
+      raise Exception('no data of tenant {}'.format(tenant))
+    # it prefixes database names, which Cloudant allows only in lowercase
+    if re.match(r'^[a-z][a-z0-9_$()+-]*$', tenant) is None:
+      print(util.bcolors.FAIL + 'tenant {} cannot be a database name'.format(tenant) + util.bcolors.ENDC)
+      raise Exception('tenant {} cannot be a database name'.format(tenant))
+  return tenants
+
+def tenant_credentials_file(tenant):
+  return '{}.{}'.format(CREDENTIALS_FILE, tenant)
+
+def tenant_databases(tenant):
+  return ['{}_{}'.format(tenant, x) for x in CLOUDANT_DB.split(',')]
+
+# seed the databases and the bucket prefix of a tenant into the shared instances,
+# and write the tenant's credential file with the service credentials and where its data is
+def seed_tenant(args, tenant, bucket):
+  sources = tenant_sources(tenant)
+  cloudant_data, cos_objects = tenant_data(tenant, tenant + '_', args.content_keys)
+  indexes = tenant_indexes(tenant, tenant + '_')
+  nosql.seed([
+    '-c', CREDENTIALS_FILE, '-b', ','.join(tenant_databases(tenant)), '-d', ','.join(cloudant_data)
+  ] + (['-i', ','.join(indexes)] if len(indexes) > 0 else []) + log_options(args, tenant + '_') + (
+    ['--presigned'] if args.presign else []
+  ))
+  if len(cos_objects) > 0:
+    cos.seed([
+      '-r', args.region, '-c', CREDENTIALS_FILE, '-x', tenant + '/', '-d', cos_data(cos_objects, bucket)
+    ])
+
+  shared = credentials.get_store(CREDENTIALS_FILE)
+  values = {k: shared.get(k) for k in shared.keys() if k.endswith('_CREDENTIALS')}
+  values.update({
+    'TENANT': tenant,
+    'CLOUDANT_DB_PREFIX': tenant + '_',
+    UI_COMPONENTS_BUCKET: bucket,
+    'COS_KEY_PREFIX': tenant + '/',
+    'CLOUDANT_LOG_PERIOD': args.log_period or '',
+    'CLOUDANT_SEED_DIGEST': cloudant_digest(sources, indexes, args.presign, args.content_keys),
+    'COS_SEED_DIGEST': cos_digest(sources, args.content_keys)
+  })
+  credentials.get_store(tenant_credentials_file(tenant)).reset(values)
+  if args.presign:
+    cos_presign.refresh_file(tenant_credentials_file(tenant), args.region)
+
+# remove the objects of a tenant and its credential file. its databases go with the shared instance.
+# over the S3 API, everything under the tenant's prefix goes, including hashed keys of older seeds
+def delete_tenant(args, tenant, bucket):
+  hmac_keys = credentials.get_store(CREDENTIALS_FILE).get_cos_hmac_keys('writer')
+  if hmac_keys is not None:
+    client = s3.S3Client(hmac_keys[0], hmac_keys[1], args.region)
+    s3.delete(client, bucket, client.list_objects(bucket, tenant + '/'))
+  else:
+    keys = tenant_keys(tenant, args.content_keys)
+    if len(keys) > 0:
+      cos.switch_auth('IAM')
+      util.delete_objects([(x, bucket, x) for x in keys], args.region, prefix=tenant + '/')
+  credentials.get_store(tenant_credentials_file(tenant)).remove()
+
+# each service is a node of the dependency graph. independent ones are provisioned concurrently
+def build_graph(args):
+  sched = Scheduler(args.jobs)
+  tenants = tenant_list(args)
+  if args.tenants is None:
+    sources = tenant_sources(args.tenant)
+    indexes = tenant_indexes(args.tenant)
+    # images are staged and the spatial index is built once for both seeds, next to the provisioning
+    sched.add('stage', lambda: tenant_data(args.tenant, content_keys=args.content_keys))
+
+  # create UI namespace for app ID
+  def create_namespace():
+    util.create_functions_namespace(COVSAFE_VIEW)
+    view_ns = util.get_functions_namespace_id(COVSAFE_VIEW)
+    return 'https://{}.functions.appdomain.cloud/api/v1/web/{}/covsafe/view/callback'.format(
+      args.region, view_ns.strip()
+    )
+  sched.add('namespace', create_namespace)
+
   # create IBM Event Streams
   # notice that we are creating paid plan!!
-  es.create([
+  sched.add('event_streams', lambda: es.create([
     '-r', args.region, '-g', args.resource_group, '-p', 'standard', '-n', SERVICES['event_streams'],
     '-k', 'event-streams-key', '-c', CREDENTIALS_FILE, '-t', ES_TOPICS
-  ])
+  ]))
 
   # create IBM Cloud Cloudant
-  # FIXME: might need to create index to avoid the query error
-  data = [
-    '../data/common/cloudant/notification-template.json;a_notification_template',
-    '../data/common/cloudant/view-config.json;view-config',
-    '../data/tenants/{}/cloudant/assets.json;assets'.format(args.tenant),
-    '../data/tenants/{}/cloudant/assets_staff.json;assets_staff'.format(args.tenant),
-    '../data/tenants/{}/cloudant/shops.json;shops'.format(args.tenant)
-  ]
-  nosql.create([
-    '-r', args.region, '-g', args.resource_group, '-p', args.plan, '-n', SERVICES['cloudant'],
-    '-k', 'cloudant-key', '-c', CREDENTIALS_FILE, '-b', CLOUDANT_DB,
-    '-d', ','.join(data)
-  ])
+  # indexes defined under indexes/ of the data tree are built before the step ends.
+  # with --presign, image links are signed once the objects are uploaded
+  def create_cloudant():
+    command = [
+      '-r', args.region, '-g', args.resource_group, '-p', args.plan, '-n', SERVICES['cloudant'],
+      '-k', 'cloudant-key', '-c', CREDENTIALS_FILE
+    ]
+    # tenants are seeded by their own steps
+    if args.tenants is not None:
+      return nosql.create(command)
+
+    cloudant_data = sched.results['stage'][0]
+    nosql.create(command + ['-b', CLOUDANT_DB, '-d', ','.join(cloudant_data)] + (
+      ['-i', ','.join(indexes)] if len(indexes) > 0 else []
+    ) + log_options(args) + (['--presigned'] if args.presign else []))
+    if args.presign:
+      cos_presign.refresh_file(CREDENTIALS_FILE, args.region)
+    credentials.get_store(CREDENTIALS_FILE).update({
+      'CLOUDANT_SEED_DIGEST': cloudant_digest(sources, indexes, args.presign, args.content_keys),
+      'CLOUDANT_LOG_PERIOD': args.log_period or ''
+    })
+  sched.add('cloudant', create_cloudant,
+    depends=[] if args.tenants is not None else ['stage'] + (['cos'] if args.presign else [])
+  )
 
   # create IBM Cloud Object Storage
+  # the bucket name is given by init()
   bucket = util.get_credentials_value(CREDENTIALS_FILE, UI_COMPONENTS_BUCKET)
-  cosdir = '../data/tenants/{}/cos'.format(args.tenant)
-  files = ['{}/{}'.format(cosdir, f) for f in os.listdir(cosdir) if os.path.isfile(os.path.join(cosdir, f))]
-  data = ','.join(['{};{}'.format(x, bucket) for x in files])
+  def create_cos():
+    command = [
+      '-r', args.region, '-g', args.resource_group, '-p', args.plan, '-n', SERVICES['cos'],
+      '-k', 'cos-hmac', '-c', CREDENTIALS_FILE, '-b', bucket
+    ]
+    if args.tenants is not None:
+      return cos.create(command)
 
-  cos.create([
-    '-r', args.region, '-g', args.resource_group, '-p', args.plan, '-n', SERVICES['cos'],
-    '-k', 'cos-hmac', '-c', CREDENTIALS_FILE, '-b', bucket, '-d', data
-  ])
+    cos.create(command + ['-d', cos_data(sched.results['stage'][1], bucket)])
+    credentials.get_store(CREDENTIALS_FILE).set('COS_SEED_DIGEST', cos_digest(sources, args.content_keys))
+  sched.add('cos', create_cos, depends=['stage'] if args.tenants is None else [])
 
   # create IBM App ID
   # should be later than deployment of UI, because it requires redirect URL
-  app_id.create([
+  sched.add('app_id', lambda: app_id.create([
     '-r', args.region, '-g', args.resource_group, '-p', 'lite', '-n', SERVICES['app_id'],
-    '-e', 'OFF', '-u', view_api, '-a', APPID_REGISTERED_APP,
+    '-e', 'OFF', '-u', sched.results['namespace'], '-a', APPID_REGISTERED_APP,
     '-s', APPID_REGISTERED_USER
-  ])
+  ]), depends=['namespace'])
 
-  post_create()
+  # tenants sharing the instances, seeded concurrently up to --tenant-jobs
+  if args.tenants is not None:
+    for tenant in tenants:
+      sched.add('tenant:{}'.format(tenant), lambda tenant=tenant: seed_tenant(args, tenant, bucket),
+        depends=['cloudant', 'cos'], group='tenants')
+    sched.limit('tenants', args.tenant_jobs)
+
+  return sched
+
+# resources each step of build_graph() leaves behind
+def desired_state(args):
+  tenants = tenant_list(args) if args.tenants is not None else []
+  if args.tenants is None:
+    sources = tenant_sources(args.tenant)
+    indexes = tenant_indexes(args.tenant)
+  p = plan.Plan(CREDENTIALS_FILE, args.region, {x: tenant_credentials_file(x) for x in tenants})
+
+  p.want('namespace', 'namespaces', COVSAFE_VIEW)
+
+  p.want('event_streams', 'service-instances', SERVICES['event_streams'])
+  p.want('event_streams', 'service-keys', 'event-streams-key-writer', 'event-streams-key-reader')
+  p.want('event_streams', 'credentials', 'EVENT_STREAMS_WRITER_CREDENTIALS', 'EVENT_STREAMS_READER_CREDENTIALS')
+  p.want('event_streams', 'topics', *ES_TOPICS.split(','))
+
+  p.want('cloudant', 'service-instances', SERVICES['cloudant'])
+  p.want('cloudant', 'service-keys', 'cloudant-key-writer', 'cloudant-key-reader')
+  p.want('cloudant', 'credentials', 'CLOUDANT_WRITER_CREDENTIALS', 'CLOUDANT_READER_CREDENTIALS')
+  if args.tenants is None:
+    p.want('cloudant', 'databases', *live_databases(args, CLOUDANT_DB.split(',')))
+    p.want('cloudant', 'seeds',
+      'CLOUDANT_SEED_DIGEST={}'.format(cloudant_digest(sources, indexes, args.presign, args.content_keys))
+    )
+
+  p.want('cos', 'service-instances', SERVICES['cos'])
+  p.want('cos', 'service-keys', 'cos-hmac-writer', 'cos-hmac-reader')
+  p.want('cos', 'credentials', 'COS_WRITER_CREDENTIALS', 'COS_READER_CREDENTIALS')
+  p.want('cos', 'buckets', util.get_credentials_value(CREDENTIALS_FILE, UI_COMPONENTS_BUCKET) or UNNAMED_BUCKET)
+  if args.tenants is None:
+    p.want('cos', 'seeds', 'COS_SEED_DIGEST={}'.format(cos_digest(sources, args.content_keys)))
+
+  p.want('app_id', 'service-instances', SERVICES['app_id'])
+
+  for tenant in tenants:
+    step = 'tenant:{}'.format(tenant)
+    sources = tenant_sources(tenant)
+    p.want(step, 'databases', *live_databases(args, tenant_databases(tenant)))
+    p.want(step, 'seeds',
+      '{}/CLOUDANT_SEED_DIGEST={}'.format(
+        tenant, cloudant_digest(sources, tenant_indexes(tenant, tenant + '_'), args.presign, args.content_keys)
+      ),
+      '{}/COS_SEED_DIGEST={}'.format(tenant, cos_digest(sources, args.content_keys))
+    )
+  return p
 
 def delete(args):
   args = parse_args(args)
-  app_id.delete(['-n', SERVICES['app_id'], '-g', args.resource_group])
+  if args.functions_backend == 'rest':
+    util.use_functions_backend(RestBackend(args.region))
 
   bucket = util.get_credentials_value(CREDENTIALS_FILE, UI_COMPONENTS_BUCKET)
-  cosdir = '../data/tenants/{}/cos'.format(args.tenant)
-  files = [f for f in os.listdir(cosdir) if os.path.isfile(os.path.join(cosdir, f))]
-  data = ','.join(['{};{}'.format(x, bucket) for x in files])
-  cos.delete([
+  tenants = tenant_list(args)
+  # with --tenants, objects are deleted by the tenant steps
+  data = []
+  if args.tenants is None:
+    data = ['-d', cos_data([(x, x) for x in tenant_keys(args.tenant, args.content_keys)], bucket)]
+
+  # the same graph as create(), torn down in reverse topological order.
+  # independent deletions run concurrently, and each waits until its instance is removed
+  sched = Scheduler(args.jobs)
+  sched.add('namespace', lambda: util.delete_functions_namespace(COVSAFE_VIEW))
+  sched.add('event_streams', lambda: es.delete(['-n', SERVICES['event_streams'], '-g', args.resource_group]))
+  sched.add('cloudant', lambda: nosql.delete(['-n', SERVICES['cloudant'], '-g', args.resource_group]))
+  sched.add('cos', lambda: cos.delete([
     '-n', SERVICES['cos'], '-g', args.resource_group, '-r', args.region,
-    '-b', bucket, '-d', data
-  ])
-  nosql.delete(['-n', SERVICES['cloudant'], '-g', args.resource_group])
-  es.delete(['-n', SERVICES['event_streams'], '-g', args.resource_group])
-  util.delete_functions_namespace(COVSAFE_VIEW)
+    '-b', bucket
+  ] + data))
+  sched.add('app_id', lambda: app_id.delete(['-n', SERVICES['app_id'], '-g', args.resource_group]),
+    depends=['namespace'])
+  if args.tenants is not None:
+    for tenant in tenants:
+      sched.add('tenant:{}'.format(tenant), lambda tenant=tenant: delete_tenant(args, tenant, bucket),
+        depends=['cloudant', 'cos'], group='tenants')
+  sched.run(reverse=True)
+  check_deleted()
+  util.inventory.report()
+
   post_delete()
 
+# list the account again, so the command returns only when nothing of the environment is left
+def check_deleted():
+  util.inventory.invalidate('service-instances', 'namespaces')
+  left = [x for x in SERVICES.values() if util.inventory.exists('service-instances', x)]
+  if util.inventory.exists('namespaces', COVSAFE_VIEW):
+    left.append(COVSAFE_VIEW)
+  if len(left) > 0:
+    print(util.bcolors.FAIL + 'not deleted: {}'.format(', '.join(left)) + util.bcolors.ENDC)
+    raise Exception('not deleted: {}'.format(', '.join(left)))
+
 def init():
-  with open(CREDENTIALS_FILE, 'w') as f:
-    f.write('{}={}\n'.format(UI_COMPONENTS_BUCKET, str(uuid.uuid4())))
+  credentials.get_store(CREDENTIALS_FILE).reset({UI_COMPONENTS_BUCKET: str(uuid.uuid4())})
 
 def post_create():
   print('something new')
 
 def post_delete():
-  os.remove(CREDENTIALS_FILE)
+  credentials.get_store(CREDENTIALS_FILE).remove()
 
 
 if __name__ == '__main__':
   args = parse_args(sys.argv[1:])
-  if args.operation == 'create':
-    create(sys.argv[1:])
-  elif args.operation == 'delete':
-    delete(sys.argv[1:])
-  else:
-    print(util.bcolors.WARNING + 'no option. please check usage of this script.' + util.bcolors.ENDC)
+  if args.trace is not None:
+    tracing.enable()
+
+  try:
+    if args.operation == 'create':
+      create(sys.argv[1:])
+    elif args.operation == 'delete':
+      delete(sys.argv[1:])
+    elif args.operation == 'plan':
+      diff(sys.argv[1:])
+    elif args.operation == 'apply':
+      diff(sys.argv[1:], apply=True)
+    else:
+      print(util.bcolors.WARNING + 'no option. please check usage of this script.' + util.bcolors.ENDC)
+  finally:
+    if args.trace is not None:
+      tracing.tracer.write(args.trace)
+      tracing.tracer.summary(args.trace_top)
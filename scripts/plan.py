@@ -0,0 +1,144 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import util
+import credentials
+import s3
+import http_client
+
+
+'''
+Plan and apply.
+the desired state is a list of resources, each owned by a step of the provisioning graph.
+the live state of every kind is read by one concurrent sweep, and a plan is the difference:
+a step has to run only when some of its resources are missing.
+'''
+# kinds read from util.inventory. the others are read by the fetchers below
+INVENTORY_KINDS = list(util.Inventory.KINDS.keys())
+
+class Plan:
+  # tenant_files maps tenants to their credential files, whose seed digests are read as TENANT/KEY=DIGEST
+  def __init__(self, credential_file, region, tenant_files=None):
+    self.credential_file = credential_file
+    self.region = region
+    self.tenant_files = tenant_files or {}
+    # (KIND, NAME, STEP)
+    self.resources = []
+    self.live = {}
+
+  def want(self, step, kind, *names):
+    for name in names:
+      self.resources.append((kind, name, step))
+
+  '''
+  live state
+  '''
+  def sweep(self, workers=8):
+    print(util.bcolors.OKGREEN + 'Starting to read the live state' + util.bcolors.ENDC)
+
+    fetchers = {x: (lambda x=x: set(util.inventory.rows(x).keys())) for x in INVENTORY_KINDS}
+    fetchers.update({
+      'credentials': self.list_credentials,
+      'seeds': self.list_seeds,
+      'databases': self.list_databases,
+      'buckets': self.list_buckets,
+      'topics': self.list_topics,
+    })
+    wanted = set(x[0] for x in self.resources)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      futures = {k: executor.submit(f) for k, f in fetchers.items()}
+      for kind, future in futures.items():
+        try:
+          self.live[kind] = future.result()
+        except Exception as e:
+          # a kind nothing is planned for, like actions without a targeted namespace, is only reported
+          if kind in wanted:
+            raise
+          print(util.bcolors.WARNING + 'cannot read {}: {}'.format(kind, e) + util.bcolors.ENDC)
+          self.live[kind] = set()
+    return self.live
+
+  def credential(self, key):
+    return credentials.get_store(self.credential_file).get_json(key)
+
+  def list_credentials(self):
+    return set(credentials.get_store(self.credential_file).keys())
+
+  def list_seeds(self):
+    store = credentials.get_store(self.credential_file)
+    seeds = set('{}={}'.format(k, store.get(k)) for k in store.keys() if k.endswith('_SEED_DIGEST'))
+    for tenant, path in self.tenant_files.items():
+      store = credentials.get_store(path)
+      seeds.update('{}/{}={}'.format(tenant, k, store.get(k)) for k in store.keys() if k.endswith('_SEED_DIGEST'))
+    return seeds
+
+  # databases and topics are listed by the reader credentials, so they are empty before the first deploy
+  def list_databases(self):
+    cred = self.credential('CLOUDANT_READER_CREDENTIALS')
+    if cred is None:
+      return set()
+    url, auth = util.cloudant_endpoint(cred)
+    res = http_client.session.request('GET', '{}/_all_dbs'.format(url), headers={'Authorization': auth})
+    if res.status != 200:
+      raise Exception('cannot list databases by {}'.format(res.reason))
+    return set(res.json())
+
+  def list_buckets(self):
+    cred = self.credential('COS_READER_CREDENTIALS')
+    if cred is None:
+      return set()
+    keys = cred['cos_hmac_keys']
+    return set(s3.S3Client(keys['access_key_id'], keys['secret_access_key'], self.region).list_buckets())
+
+  def list_topics(self):
+    cred = self.credential('EVENT_STREAMS_READER_CREDENTIALS')
+    if cred is None:
+      return set()
+    res = http_client.session.request(
+      'GET', '{}/admin/topics'.format(cred['kafka_admin_url'].rstrip('/')),
+      headers={'X-Auth-Token': cred['api_key']}
+    )
+    if res.status != 200:
+      raise Exception('cannot list topics by {}'.format(res.reason))
+    return set(x['name'] for x in res.json() or [])
+
+  '''
+  difference
+  '''
+  def missing(self):
+    return [x for x in self.resources if x[1] not in self.live.get(x[0], set())]
+
+  def steps(self):
+    steps = []
+    for _, _, step in self.missing():
+      if step not in steps:
+        steps.append(step)
+    return steps
+
+  def report(self):
+    missing = self.missing()
+    print(util.bcolors.HEADER + '{:<2} {:<18} {:<48} {}'.format('', 'kind', 'name', 'step') + util.bcolors.ENDC)
+    for kind, name, step in self.resources:
+      if (kind, name, step) in missing:
+        print(util.bcolors.WARNING + '{:<2} {:<18} {:<48} {}'.format('+', kind, name, step) + util.bcolors.ENDC)
+      else:
+        print('{:<2} {:<18} {:<48} {}'.format('=', kind, name, step))
+
+    if len(missing) == 0:
+      print(util.bcolors.OKGREEN + 'no changes. the deployment is up to date' + util.bcolors.ENDC)
+    else:
+      print(util.bcolors.OKGREEN + '{} resources to create by steps: {}'.format(
+        len(missing), ', '.join(self.steps())
+      ) + util.bcolors.ENDC)
+
+
+# digest of seed files. a step that uploads them records it once it finished.
+# 64 bits are enough to tell a change and keep the plan readable
+def digest(files):
+  sha = hashlib.sha256()
+  for file in sorted(files):
+    sha.update(os.path.basename(file).encode())
+    with open(file, 'rb') as f:
+      for data in iter(lambda: f.read(1024 * 1024), b''):
+        sha.update(data)
+  return sha.hexdigest()[:16]
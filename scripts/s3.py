@@ -0,0 +1,316 @@
+import os
+import hmac
+import base64
+import time
+import hashlib
+import datetime
+import mimetypes
+from urllib import parse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import util
+import http_client
+
+# reference:
+# https://cloud.ibm.com/docs/cloud-object-storage?topic=cloud-object-storage-hmac-signature
+# COS_ENDPOINT points it to another S3 compatible server, like a local stub
+ENDPOINT = os.environ.get('COS_ENDPOINT', 'https://s3.{}.cloud-object-storage.appdomain.cloud')
+# max keys of a multi-object delete request
+DELETE_CHUNK = 1000
+# objects larger than this are uploaded by parallel parts
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+XMLNS = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+# presigned URLs of the signature v4 live 7 days at most
+MAX_PRESIGN_EXPIRES = 7 * 24 * 3600
+# older Pythons don't know it
+mimetypes.add_type('image/webp', '.webp')
+
+
+'''
+S3 compatible client for Cloud Object Storage signed with the HMAC credentials (AWS signature v4).
+requests go through the pooled HTTP session, so they can be sent concurrently over kept-alive connections.
+'''
+class S3Client:
+  def __init__(self, access_key_id, secret_access_key, region, endpoint=None):
+    self.access_key_id = access_key_id
+    self.secret_access_key = secret_access_key
+    self.region = region
+    self.endpoint = (endpoint or ENDPOINT.format(region)).rstrip('/')
+    self.host = parse.urlsplit(self.endpoint).netloc
+    self.session = http_client.session
+
+  def sign(self, method, path, query, headers, payload_hash):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    datestamp = now.strftime('%Y%m%d')
+
+    headers = {k.lower(): str(v).strip() for k, v in headers.items()}
+    headers['host'] = self.host
+    headers['x-amz-date'] = amz_date
+    headers['x-amz-content-sha256'] = payload_hash
+
+    canonical_query = encode_query(query)
+    signed = sorted(headers.keys())
+    canonical_headers = ''.join('{}:{}\n'.format(k, headers[k]) for k in signed)
+    canonical_request = '\n'.join([
+      method, parse.quote(path, safe='/-_.~'), canonical_query, canonical_headers, ';'.join(signed), payload_hash
+    ])
+
+    scope = '{}/{}/s3/aws4_request'.format(datestamp, self.region)
+    string_to_sign = '\n'.join([
+      'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    signature = hmac.new(
+      self.signing_key(datestamp), string_to_sign.encode(), hashlib.sha256
+    ).hexdigest()
+
+    headers['Authorization'] = 'AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, Signature={}'.format(
+      self.access_key_id, scope, ';'.join(signed), signature
+    )
+    return headers, canonical_query
+
+  # URL that anyone can GET the object with until it expires, signed in the query instead of the headers
+  def presign(self, bucket, key, expires=MAX_PRESIGN_EXPIRES, method='GET'):
+    if expires < 1 or expires > MAX_PRESIGN_EXPIRES:
+      print(util.bcolors.FAIL + 'expiry should be 1 to {} seconds'.format(MAX_PRESIGN_EXPIRES) + util.bcolors.ENDC)
+      raise Exception('expiry should be 1 to {} seconds'.format(MAX_PRESIGN_EXPIRES))
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    datestamp = now.strftime('%Y%m%d')
+    scope = '{}/{}/s3/aws4_request'.format(datestamp, self.region)
+    path = '/{}/{}'.format(bucket, key)
+    canonical_query = encode_query({
+      'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+      'X-Amz-Credential': '{}/{}'.format(self.access_key_id, scope),
+      'X-Amz-Date': amz_date,
+      'X-Amz-Expires': expires,
+      'X-Amz-SignedHeaders': 'host'
+    })
+    canonical_request = '\n'.join([
+      method, parse.quote(path, safe='/-_.~'), canonical_query, 'host:{}\n'.format(self.host), 'host', 'UNSIGNED-PAYLOAD'
+    ])
+    string_to_sign = '\n'.join([
+      'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    signature = hmac.new(
+      self.signing_key(datestamp), string_to_sign.encode(), hashlib.sha256
+    ).hexdigest()
+    return '{}{}?{}&X-Amz-Signature={}'.format(
+      self.endpoint, parse.quote(path, safe='/-_.~'), canonical_query, signature
+    )
+
+  def signing_key(self, datestamp):
+    key = ('AWS4' + self.secret_access_key).encode()
+    for x in [datestamp, self.region, 's3', 'aws4_request']:
+      key = hmac.new(key, x.encode(), hashlib.sha256).digest()
+    return key
+
+  def request(self, method, bucket, key='', query=None, body=b'', headers=None, ok=(200,)):
+    path = '/{}'.format(bucket) + ('/{}'.format(key) if len(key) > 0 else '')
+    headers, canonical_query = self.sign(
+      method, path, query or {}, headers or {}, hashlib.sha256(body).hexdigest()
+    )
+    url = self.endpoint + parse.quote(path, safe='/-_.~')
+    if len(canonical_query) > 0:
+      url = url + '?' + canonical_query
+    res = self.session.request(method, url, body=body if len(body) > 0 else None, headers=headers)
+    if res.status not in ok:
+      raise Exception('{} {} returned {} {}'.format(method, path, res.status, res.body[:200]))
+    return res
+
+  '''
+  buckets
+  '''
+  def list_buckets(self):
+    root = ElementTree.fromstring(self.request('GET', '').body)
+    return [x.findtext(XMLNS + 'Name') for x in root.iter(XMLNS + 'Bucket')]
+
+  '''
+  objects
+  '''
+  def head_object(self, bucket, key):
+    res = self.request('HEAD', bucket, key, ok=(200, 404))
+    if res.status == 404:
+      return None
+    return res.headers.get('ETag', '').strip('"')
+
+  def put_object(self, bucket, key, body, headers=None):
+    self.request('PUT', bucket, key, body=body, headers=headers)
+
+  def upload_file(self, bucket, key, file, headers=None, executor=None, part_size=PART_SIZE):
+    size = os.path.getsize(file)
+    if size <= MULTIPART_THRESHOLD or executor is None:
+      with open(file, 'rb') as f:
+        self.put_object(bucket, key, f.read(), headers)
+      return
+
+    res = self.request('POST', bucket, key, query={'uploads': ''}, headers=headers)
+    upload_id = ElementTree.fromstring(res.body).find(XMLNS + 'UploadId').text
+
+    def upload_part(number, offset):
+      with open(file, 'rb') as f:
+        f.seek(offset)
+        data = f.read(part_size)
+      res = self.request('PUT', bucket, key, query={'partNumber': number, 'uploadId': upload_id}, body=data)
+      return number, res.headers.get('ETag')
+
+    try:
+      parts = list(executor.map(
+        lambda x: upload_part(*x),
+        [(i + 1, offset) for i, offset in enumerate(range(0, size, part_size))]
+      ))
+      body = '<CompleteMultipartUpload>{}</CompleteMultipartUpload>'.format(''.join(
+        '<Part><PartNumber>{}</PartNumber><ETag>{}</ETag></Part>'.format(n, etag) for n, etag in parts
+      )).encode()
+      self.request('POST', bucket, key, query={'uploadId': upload_id}, body=body)
+    except Exception:
+      self.request('DELETE', bucket, key, query={'uploadId': upload_id}, ok=(200, 204, 404))
+      raise
+
+  # yield keys of the bucket page by page (ListObjectsV2 returns 1000 keys at most)
+  def list_objects(self, bucket, prefix=''):
+    token = None
+    while True:
+      query = {'list-type': '2', 'max-keys': DELETE_CHUNK}
+      if len(prefix) > 0:
+        query['prefix'] = prefix
+      if token is not None:
+        query['continuation-token'] = token
+      root = ElementTree.fromstring(self.request('GET', bucket, query=query).body)
+
+      yield [x.find(XMLNS + 'Key').text for x in root.findall(XMLNS + 'Contents')]
+
+      token = root.findtext(XMLNS + 'NextContinuationToken')
+      if root.findtext(XMLNS + 'IsTruncated') != 'true' or token is None:
+        return
+
+  # delete up to 1000 keys by one request and return keys that failed
+  def delete_objects(self, bucket, keys):
+    body = '<Delete><Quiet>true</Quiet>{}</Delete>'.format(''.join(
+      '<Object><Key>{}</Key></Object>'.format(escape(x)) for x in keys
+    )).encode()
+    res = self.request('POST', bucket, query={'delete': ''}, body=body, headers={
+      'Content-MD5': base64.b64encode(hashlib.md5(body).digest()).decode(),
+      'Content-Type': 'application/xml'
+    })
+    root = ElementTree.fromstring(res.body)
+    return [x.findtext(XMLNS + 'Key') for x in root.findall(XMLNS + 'Error')]
+
+
+def encode_query(query):
+  return '&'.join(
+    '{}={}'.format(parse.quote(k, safe='-_.~'), parse.quote(str(v), safe='-_.~'))
+    for k, v in sorted(query.items())
+  )
+
+def md5_file(file):
+  md5 = hashlib.md5()
+  with open(file, 'rb') as f:
+    for data in iter(lambda: f.read(1024 * 1024), b''):
+      md5.update(data)
+  return md5.hexdigest()
+
+# ETag that COS gives to the file: MD5 for a single upload, MD5 of part MD5s for a multipart upload
+def local_etag(file, part_size=PART_SIZE):
+  if os.path.getsize(file) <= MULTIPART_THRESHOLD:
+    return md5_file(file)
+
+  digests = []
+  with open(file, 'rb') as f:
+    for data in iter(lambda: f.read(part_size), b''):
+      digests.append(hashlib.md5(data).digest())
+  return '{}-{}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+'''
+concurrent uploader
+'''
+# browsers need the type of images, like image/webp, which COS doesn't guess from the key
+def content_headers(key, headers=None):
+  content_type = mimetypes.guess_type(key)[0]
+  if content_type is None or 'Content-Type' in (headers or {}):
+    return headers
+  return dict(headers or {}, **{'Content-Type': content_type})
+
+# objects are (FILE, BUCKET, KEY) or (FILE, BUCKET, KEY, HEADERS) with headers of the object
+def upload(client, objects, workers=8, headers=None):
+  print(util.bcolors.OKGREEN + 'Starting to upload {} objects'.format(len(objects)) + util.bcolors.ENDC)
+
+  report = []
+  # parts have their own pool, so an object waiting for its parts never blocks them
+  with ThreadPoolExecutor(max_workers=workers) as parts:
+    def upload_one(obj):
+      file, bucket, key = obj[:3]
+      own = dict(headers or {}, **obj[3]) if len(obj) > 3 else headers
+      size = os.path.getsize(file)
+      etag = local_etag(file)
+      start = time.monotonic()
+      if client.head_object(bucket, key) == etag:
+        return {'key': key, 'bucket': bucket, 'bytes': size, 'seconds': 0, 'skipped': True}
+
+      client.upload_file(bucket, key, file, content_headers(key, own), parts)
+      return {
+        'key': key, 'bucket': bucket, 'bytes': size, 'seconds': time.monotonic() - start, 'skipped': False
+      }
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      report = list(executor.map(upload_one, objects))
+
+  for r in report:
+    if r['skipped']:
+      print(util.bcolors.OKBLUE + '{}/{}: unchanged, skipped'.format(r['bucket'], r['key']) + util.bcolors.ENDC)
+    else:
+      print(util.bcolors.OKBLUE + '{}/{}: {} bytes in {:.2f}s ({:.0f} bytes/s)'.format(
+        r['bucket'], r['key'], r['bytes'], r['seconds'], r['bytes'] / max(r['seconds'], 1e-6)
+      ) + util.bcolors.ENDC)
+  return report
+
+def chunks(pages, size=DELETE_CHUNK):
+  chunk = []
+  for page in pages:
+    for key in page:
+      chunk.append(key)
+      if len(chunk) == size:
+        yield chunk
+        chunk = []
+  if len(chunk) > 0:
+    yield chunk
+
+# delete keys in chunks of 1000 over concurrent requests.
+# pages is an iterable of key lists, like the one list_objects returns
+def delete(client, bucket, pages, workers=8):
+  print(util.bcolors.OKGREEN + 'Starting to delete objects in {}'.format(bucket) + util.bcolors.ENDC)
+
+  start = time.monotonic()
+  deleted = 0
+  failed = []
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    pending = set()
+
+    def collect(future):
+      nonlocal deleted
+      keys, errors = future.result()
+      deleted += len(keys) - len(errors)
+      failed.extend(errors)
+      print(util.bcolors.OKBLUE + '{}: {} objects deleted ({:.0f} objects/s)'.format(
+        bucket, deleted, deleted / max(time.monotonic() - start, 1e-6)
+      ) + util.bcolors.ENDC)
+
+    for chunk in chunks(pages):
+      # keep listing ahead of deletion, but not the whole bucket in memory
+      if len(pending) >= workers * 2:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          collect(future)
+      pending.add(executor.submit(lambda c: (c, client.delete_objects(bucket, c)), chunk))
+
+    for future in pending:
+      collect(future)
+
+  if len(failed) > 0:
+    print(util.bcolors.FAIL + 'cannot delete {} objects in {}'.format(len(failed), bucket) + util.bcolors.ENDC)
+    raise Exception('cannot delete {} objects in {}'.format(len(failed), bucket))
+  return deleted
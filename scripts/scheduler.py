@@ -0,0 +1,182 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import util
+import tracing
+import checkpoint
+
+
+'''
+Dependency graph scheduler for the provisioning steps.
+each node is a callable without arguments, and it runs once all nodes it depends on have finished.
+independent nodes run concurrently on a bounded worker pool. nodes of a group can be limited further,
+like seeding tenants that share a service instance.
+with the checkpoint journal on, nodes completed by an earlier run are skipped with their recorded results.
+'''
+class Node:
+  def __init__(self, name, func, depends, group=None):
+    self.name = name
+    self.func = func
+    self.depends = list(depends)
+    self.group = group
+    self.start = None
+    self.end = None
+    self.status = 'pending'
+
+  def elapsed(self):
+    if self.start is None or self.end is None:
+      return None
+    return self.end - self.start
+
+
+class Scheduler:
+  def __init__(self, max_workers=4):
+    self.max_workers = max(1, int(max_workers))
+    self.nodes = {}
+    self.results = {}
+    self.limits = {}
+    # set when a node fails. waits and journal steps of the running nodes check it to give up early
+    self.cancelled = util.cancelled
+
+  def add(self, name, func, depends=(), group=None):
+    if name in self.nodes:
+      raise Exception('node {} is already registered'.format(name))
+    self.nodes[name] = Node(name, func, depends, group)
+
+  # at most n nodes of the group run at once, within max_workers
+  def limit(self, group, n):
+    self.limits[group] = max(1, int(n))
+
+  # keep only the given nodes and the nodes they depend on, like the steps a plan requires
+  def select(self, names):
+    keep = set()
+    stack = list(names)
+    while stack:
+      name = stack.pop()
+      if name not in keep:
+        keep.add(name)
+        stack = stack + self.nodes[name].depends
+    self.nodes = {k: v for k, v in self.nodes.items() if k in keep}
+
+  def order(self, reverse=False):
+    # Kahn's algorithm. the order of registration is kept among independent nodes
+    for node in self.nodes.values():
+      for dep in node.depends:
+        if dep not in self.nodes:
+          raise Exception('node {} depends on unknown node {}'.format(node.name, dep))
+
+    deps = self._dependencies(reverse)
+    done = []
+    remaining = list(self.nodes.keys())
+    while remaining:
+      ready = [x for x in remaining if all(d in done for d in deps[x])]
+      if len(ready) == 0:
+        raise Exception('dependency cycle among {}'.format(', '.join(remaining)))
+      done = done + ready
+      remaining = [x for x in remaining if x not in ready]
+
+    return done
+
+  def run(self, reverse=False):
+    # validate the graph before starting anything
+    self.order(reverse)
+    deps = self._dependencies(reverse)
+
+    print(
+      util.bcolors.OKGREEN +
+      'Starting to run {} steps with {} workers'.format(len(self.nodes), self.max_workers) +
+      util.bcolors.ENDC
+    )
+
+    failure = None
+    running = {}
+    self.cancelled.clear()
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      while True:
+        if failure is None:
+          for name in self._ready(deps):
+            node = self.nodes[name]
+            node.status = 'running'
+            running[executor.submit(self._execute, node)] = node
+
+        if len(running) == 0:
+          break
+
+        finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+        for future in finished:
+          node = running.pop(future)
+          try:
+            self.results[node.name] = future.result()
+            node.status = 'done'
+          except util.Cancelled:
+            node.status = 'cancelled'
+          except Exception as e:
+            node.status = 'failed'
+            if failure is None:
+              # fail fast: nothing new is submitted, running nodes are left to finish
+              failure = (node.name, e)
+              self.cancelled.set()
+              print(
+                util.bcolors.FAIL + 'step {} failed: {}. cancelling the rest'.format(node.name, e) +
+                util.bcolors.ENDC
+              )
+
+    for node in self.nodes.values():
+      if node.status == 'pending':
+        node.status = 'cancelled'
+
+    self.report()
+
+    if failure is not None:
+      raise Exception('step {} failed: {}'.format(failure[0], failure[1])) from failure[1]
+
+    return self.results
+
+  def report(self):
+    print(util.bcolors.HEADER + '{:<24} {:<10} {:>10}'.format('step', 'status', 'seconds') + util.bcolors.ENDC)
+    for node in self.nodes.values():
+      elapsed = node.elapsed()
+      status = 'resumed' if node.status == 'done' and node.name in checkpoint.journal.resumed else node.status
+      print('{:<24} {:<10} {:>10}'.format(
+        node.name, status, '-' if elapsed is None else '{:.1f}'.format(elapsed)
+      ))
+
+  def _execute(self, node):
+    node.start = time.monotonic()
+    print(util.bcolors.OKBLUE + 'step {} started'.format(node.name) + util.bcolors.ENDC)
+    try:
+      with tracing.tracer.span(node.name, 'step'):
+        return checkpoint.journal.step(node.name, node.func)
+    finally:
+      node.end = time.monotonic()
+      print(
+        util.bcolors.OKBLUE + 'step {} finished in {:.1f}s'.format(node.name, node.elapsed()) +
+        util.bcolors.ENDC
+      )
+
+  def _dependencies(self, reverse):
+    if not reverse:
+      return {name: node.depends for name, node in self.nodes.items()}
+
+    # on teardown, a node waits for all nodes that depended on it
+    deps = {name: [] for name in self.nodes.keys()}
+    for node in self.nodes.values():
+      for dep in node.depends:
+        deps[dep].append(node.name)
+    return deps
+
+  def _ready(self, deps):
+    running = {}
+    for node in self.nodes.values():
+      if node.status == 'running' and node.group is not None:
+        running[node.group] = running.get(node.group, 0) + 1
+
+    ready = []
+    for name, node in self.nodes.items():
+      if node.status != 'pending' or not all(self.nodes[d].status == 'done' for d in deps[name]):
+        continue
+      if node.group in self.limits:
+        if running.get(node.group, 0) >= self.limits[node.group]:
+          continue
+        running[node.group] = running.get(node.group, 0) + 1
+      ready.append(name)
+    return ready
@@ -6,10 +6,15 @@
 import argparse
 import subprocess
 import os
+import sys
 import json
-from urllib import request
 import util
+import credentials
+import checkpoint
+import http_client
 
+# APPID_API_HOST points it to another App ID management API, like a local stub
+API_HOST = os.environ.get('APPID_API_HOST', 'https://{}.appid.cloud.ibm.com')
 
 # get arguments
 def parse_args(args):
@@ -61,67 +66,69 @@ def parse_args(args):
 
   return parser.parse_args(args)
 
+# each part is a step of the checkpoint journal, so a resumed deploy goes on from the one that failed
 def create(args):
   args = parse_args(args)
+  journal = checkpoint.journal
 
-  util.create_service_instance(args.instance_name, 'appid', args.service_plan, args.region)
-
-  tenant_id = util.get_tenant_id(args.instance_name)
+  def create_instance():
+    util.create_service_instance(args.instance_name, 'appid', args.service_plan, args.region)
+    util.wait_for_service_instance(args.instance_name)
+    return {'tenant_id': util.get_tenant_id(args.instance_name)}
+  tenant_id = journal.step('{}/instance'.format(args.instance_name), create_instance)['tenant_id']
 
   token = util.get_IAM_token()
   headers = {'Authorization': token, 'Content-Type': 'application/json'}
+  session = http_client.session
+  management = '{}/management/v4/{}'.format(API_HOST.format(args.region), tenant_id)
 
   # configurations: disable facebook/google association
-  print(
-    util.bcolors.OKGREEN +
-    'Starting to disable Facebook and Google identification association' +
-    util.bcolors.ENDC
-  )
-
-  def disableIDP(idp):
-    req = request.Request(
-      'https://{}.appid.cloud.ibm.com/management/v4/{}/config/idps/{}'.format(args.region, tenant_id, idp),
-      data = data, method = 'PUT', headers = headers
+  def disable_idps():
+    print(
+      util.bcolors.OKGREEN +
+      'Starting to disable Facebook and Google identification association' +
+      util.bcolors.ENDC
     )
-    with request.urlopen(req) as res:
-      j = json.loads(res.read())
-      if j['isActive'] is True:
+
+    def disableIDP(idp):
+      res = session.request('PUT', '{}/config/idps/{}'.format(management, idp), body=data, headers=headers)
+      if res.status != 200:
+        raise Exception('Failed to disable {} association by {}'.format(idp, res.reason))
+      if res.json()['isActive'] is True:
         raise Exception('{} association is still active'.format(idp))
 
-  data = '{\"isActive\": false}'.encode()
-  disableIDP('facebook')
-  disableIDP('google')
+    data = '{\"isActive\": false}'.encode()
+    disableIDP('facebook')
+    disableIDP('google')
+  journal.step('{}/idps'.format(args.instance_name), disable_idps)
 
   # config cloud directory
   # we have less security at MVP so that we don't accept for users to sign up on our app
-  print(util.bcolors.OKGREEN + 'Starting to configure the Cloud Directory' + util.bcolors.ENDC)
-  data = {
-    'isActive': True,
-    'config': {
-      'selfServiceEnabled': True,
-      'signupEnabled': False,
-      'interactions': {
-        'identityConfirmation': {
-          'accessMode': args.email_confirmation,
-          'methods': ['email']
+  def configure_cloud_directory():
+    print(util.bcolors.OKGREEN + 'Starting to configure the Cloud Directory' + util.bcolors.ENDC)
+    data = {
+      'isActive': True,
+      'config': {
+        'selfServiceEnabled': True,
+        'signupEnabled': False,
+        'interactions': {
+          'identityConfirmation': {
+            'accessMode': args.email_confirmation,
+            'methods': ['email']
+          },
+          'welcomeEnabled': False,
+          'resetPasswordEnabled': False,
+          'resetPasswordNotificationEnable': False
         },
-        'welcomeEnabled': False,
-        'resetPasswordEnabled': False,
-        'resetPasswordNotificationEnable': False
-      },
-      'identityField': 'email'
+        'identityField': 'email'
+      }
     }
-  }
-  data = json.dumps(data).encode()
-  req = request.Request(
-    'https://{}.appid.cloud.ibm.com/management/v4/{}/config/idps/cloud_directory'.format(
-      args.region, tenant_id
-    ),
-    data = data, method = 'PUT', headers = headers
-  )
-  with request.urlopen(req) as res:
+    res = session.request(
+      'PUT', '{}/config/idps/cloud_directory'.format(management), body=data, headers=headers
+    )
     if res.status != 200:
       raise Exception('Failed to add redirect URLs by {}'.format(res.reason))
+  journal.step('{}/cloud-directory'.format(args.instance_name), configure_cloud_directory)
 
   # enable MFA
   # FIXME: Multi-factor authentication can be enabled only on "Graduated tier" plan.
@@ -131,12 +138,10 @@ def create(args):
   # we use cURL command instead of requests/urllib python libraries
   # because the file upload request from python lib is not accepted by App ID.
   # I tried it with several patterns of parameters but any didn't work.
-  if args.logo_path is not None:
+  def upload_logo():
     print(util.bcolors.OKGREEN + 'Starting to upload the company logo' + util.bcolors.ENDC)
 
-    url = 'https://{}.appid.cloud.ibm.com/management/v4/{}/config/ui/media?mediaType=logo'.format(
-      args.region, tenant_id
-    )
+    url = '{}/config/ui/media?mediaType=logo'.format(management)
     command = ['curl', '-s', '-o', '/dev/null', '-w', '%{http_code}', '-X', 'POST', url]
     command = command + ['-H', 'Authorization: {}'.format(token)]
     command = command + ['-H', 'Content-Type: multipart/form-data']
@@ -145,92 +150,82 @@ def create(args):
     res = int(res.decode('utf-8'))
     if res < 200 and res > 299:
       raise Exception('failed to upload company logo')
+  if args.logo_path is not None:
+    journal.step('{}/logo'.format(args.instance_name), upload_logo)
 
   # add redirect URLs
-  print(util.bcolors.OKGREEN + 'Starting to add redirect URLs' + util.bcolors.ENDC)
   urls = args.redirect_urls.split(',')
-  data = {'redirectUris': urls}
-  data = json.dumps(data).encode()
-  req = request.Request(
-    'https://{}.appid.cloud.ibm.com/management/v4/{}/config/redirect_uris'.format(args.region, tenant_id),
-    data = data, method = 'PUT', headers = headers
-  )
-  with request.urlopen(req) as res:
+  def add_redirect_urls():
+    print(util.bcolors.OKGREEN + 'Starting to add redirect URLs' + util.bcolors.ENDC)
+    data = {'redirectUris': urls}
+    res = session.request('PUT', '{}/config/redirect_uris'.format(management), body=data, headers=headers)
     if res.status != 204:
       raise Exception('Failed to add redirect URLs by {}'.format(res.reason))
+    return {'redirect_urls': urls}
+  journal.step('{}/redirect-urls'.format(args.instance_name), add_redirect_urls)
 
   # register your app and get credentials that includes secret, used by the client
-  print(util.bcolors.OKGREEN + 'Starting to register applicatinos' + util.bcolors.ENDC)
-  apps = args.application_names.split(',')
-  # check if there is a same app
-  req = request.Request(
-    'https://{}.appid.cloud.ibm.com/management/v4/{}/applications'.format(args.region, tenant_id),
-    headers = headers
-  )
-  with request.urlopen(req) as res:
+  def register_apps():
+    print(util.bcolors.OKGREEN + 'Starting to register applicatinos' + util.bcolors.ENDC)
+    apps = args.application_names.split(',')
+    # check if there is a same app
+    res = session.request('GET', '{}/applications'.format(management), headers=headers)
     if res.status != 200:
       raise Exception('Failed to get existing apps by {}'.format(res.reason))
-    existing_apps = json.loads(res.read())
-  # register apps
-  for i, app in enumerate(apps):
-    if app not in [x['name'] for x in existing_apps['applications']]:
-      print(util.bcolors.OKBLUE + 'registering ' + app + util.bcolors.ENDC)
-      data = {'name': app}
-      data = json.dumps(data).encode()
-      req = request.Request(
-        'https://{}.appid.cloud.ibm.com/management/v4/{}/applications'.format(args.region, tenant_id),
-        data = data, method = 'POST', headers = headers
-      )
-      with request.urlopen(req) as res:
+    existing_apps = res.json()
+    # register apps
+    registered = {}
+    for i, app in enumerate(apps):
+      if app not in [x['name'] for x in existing_apps['applications']]:
+        print(util.bcolors.OKBLUE + 'registering ' + app + util.bcolors.ENDC)
+        data = {'name': app}
+        res = session.request('POST', '{}/applications'.format(management), body=data, headers=headers)
         if res.status != 200:
           raise Exception('Failed to add redirect URLs by {}'.format(res.reason))
 
-        data = json.loads(res.read())
+        data = res.json()
         prefix = app.upper().replace('-', '_')
-        with open(args.credential_file, 'a') as f:
-          f.write('{}_CLIENT_ID={}\n'.format(prefix, data['clientId']))
-          f.write('{}_TENANT_ID={}\n'.format(prefix, data['tenantId']))
-          f.write('{}_SECRET={}\n'.format(prefix, data['secret']))
-          f.write('{}_OAUTH_SERVER_URL={}\n'.format(prefix, data['oAuthServerUrl']))
-          f.write('{}_REDIRECT_URI={}\n'.format(prefix, urls[i]))
+        credentials.get_store(args.credential_file).update({
+          '{}_CLIENT_ID'.format(prefix): data['clientId'],
+          '{}_TENANT_ID'.format(prefix): data['tenantId'],
+          '{}_SECRET'.format(prefix): data['secret'],
+          '{}_OAUTH_SERVER_URL'.format(prefix): data['oAuthServerUrl'],
+          '{}_REDIRECT_URI'.format(prefix): urls[i]
+        })
+        registered[app] = {'client_id': data['clientId'], 'oauth_server_url': data['oAuthServerUrl']}
+    return {'applications': registered}
+  journal.step('{}/applications'.format(args.instance_name), register_apps)
 
   # add users
-  print(util.bcolors.OKGREEN + 'Starting to add users' + util.bcolors.ENDC)
-  users = [x.split(':') for x in args.application_users.split(',')]
-  # check if there is a same users
-  req = request.Request(
-    'https://{}.appid.cloud.ibm.com/management/v4/{}/cloud_directory/Users'.format(
-      args.region, tenant_id
-    ),
-    headers = headers
-  )
-  with request.urlopen(req) as res:
+  def add_users():
+    print(util.bcolors.OKGREEN + 'Starting to add users' + util.bcolors.ENDC)
+    users = [x.split(':') for x in args.application_users.split(',')]
+    # check if there is a same users
+    res = session.request('GET', '{}/cloud_directory/Users'.format(management), headers=headers)
     if res.status != 200:
       raise Exception('Failed to get existing apps by {}'.format(res.reason))
-    existing_users = json.loads(res.read())
-  # add users
-  for user in users:
-    if user[0] not in [x['displayName'] for x in existing_users['Resources']]:
-      print(util.bcolors.OKBLUE + 'registering ' + user[0] + util.bcolors.ENDC)
-      data = {
-        'active': True,
-        'emails': [{
-          'value': user[0],
-          'primary': True
-        }],
-        'userName': user[1],
-        'password': user[2]
-      }
-      data = json.dumps(data).encode()
-      req = request.Request(
-        'https://{}.appid.cloud.ibm.com/management/v4/{}/cloud_directory/sign_up?shouldCreateProfile=true&language=en'.format(args.region, tenant_id),
-        data = data, method = 'POST', headers = headers
-      )
-      with request.urlopen(req) as res:
+    existing_users = res.json()
+    # add users
+    for user in users:
+      if user[0] not in [x['displayName'] for x in existing_users['Resources']]:
+        print(util.bcolors.OKBLUE + 'registering ' + user[0] + util.bcolors.ENDC)
+        data = {
+          'active': True,
+          'emails': [{
+            'value': user[0],
+            'primary': True
+          }],
+          'userName': user[1],
+          'password': user[2]
+        }
+        res = session.request(
+          'POST', '{}/cloud_directory/sign_up?shouldCreateProfile=true&language=en'.format(management),
+          body=data, headers=headers
+        )
         if res.status != 201:
           raise Exception('Failed to add redirect URLs by {}'.format(res.reason))
-
-        data = json.loads(res.read())
+    return {'users': [x[0] for x in users]}
+  journal.step('{}/users'.format(args.instance_name), add_users)
 
 def delete(args):
   args = parse_args(args)
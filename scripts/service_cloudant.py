@@ -3,10 +3,14 @@ import subprocess
 import json
 import sys
 import re
-import time
 from os import path
 from cloudant.client import Cloudant
 import util
+import credentials
+import checkpoint
+import cloudant_loader
+import cloudant_indexes
+import cloudant_rolling
 
 
 # get arguments
@@ -14,7 +18,11 @@ def parse_args(args):
   parser = argparse.ArgumentParser(description="""
   create IBM Cloud Cloudant.
   """)
-  parser.add_argument('-o', '--operation', default='create', help='create|delete a instance')
+  parser.add_argument('-o', '--operation', default='create',
+    help='''
+    create|delete a instance, seed to write data with the credentials of an instance created before,
+    or rotate to create the log databases of the current period and drop the expired ones
+    ''')
   parser.add_argument('-r', '--region', default='jp-tok', help='region Name')
   parser.add_argument('-g', '--resource-group', default='c4c-covid-19', help='resource group name')
   parser.add_argument('-n', '--instance-name', default='cloudantnodqldb', help='instance name')
@@ -26,88 +34,166 @@ def parse_args(args):
   parser.add_argument('-b', '--database', help='comma-separated list of database created')
   parser.add_argument('-d', '--data',
     help='comma-and-colon-separated list that has files uploaded. it should FILE1;DB1,FILE2;DB2')
+  parser.add_argument('-w', '--workers', default=4, type=int,
+    help='number of databases written concurrently')
+  parser.add_argument('--batch-docs', default=cloudant_loader.BATCH_DOCS, type=int,
+    help='max number of documents in a bulk request')
+  parser.add_argument('--batch-bytes', default=cloudant_loader.BATCH_BYTES, type=int,
+    help='max size of documents in a bulk request')
+  parser.add_argument('-i', '--indexes',
+    help='comma-and-colon-separated list of index definition files. it should FILE1;DB1,FILE2;DB2')
+  parser.add_argument('--index-timeout', default=cloudant_indexes.BUILD_TIMEOUT, type=int,
+    help='seconds to wait for the indexes of a database to be built')
+  parser.add_argument('-l', '--log-databases',
+    help='comma-separated list of log databases split by --log-period, like log_risk_calculation')
+  parser.add_argument('--log-period',
+    help='{}. each log database has one database per period. not given, they are single databases'.format(
+      '|'.join(cloudant_rolling.PERIODS)
+    ))
+  parser.add_argument('--retention', default=cloudant_rolling.RETENTION, type=int,
+    help='number of periods of log databases kept, counting the current one')
+  parser.add_argument('--ahead', default=cloudant_rolling.AHEAD, type=int,
+    help='number of periods of log databases created ahead')
+  parser.add_argument('-m', '--seed-mode', default='diff',
+    help='''
+    diff|append.
+    diff writes only new or changed documents, keyed by their _id, id or name.
+    append posts all documents as they are.
+    ''')
+  parser.add_argument('--prune', action='store_true',
+    help='''
+    with -m diff, delete the documents of the seeded databases that aren't in the seed data, keeping design docs.
+    run it once on a database seeded with -m append or by an older version, whose documents have generated ids
+    ''')
+  parser.add_argument('--presigned', action='store_true',
+    help='image links in the databases are presigned by cos_presign.py. diff keeps them while they point at the same keys')
 
   return parser.parse_args(args)
 
+# each part is a step of the checkpoint journal, so a resumed deploy goes on from the one that failed
 def create(args):
   args = parse_args(args)
-
-  util.create_service_instance(args.instance_name, 'cloudantnosqldb', args.service_plan, args.region)
-  # sometimes craeting cloudant instance takes time so that should wait for a while
-  # FIXME: should check it's active or not, not waiting for fixed amount of time
-  print('wait for cloudant provisioning...')
-  time.sleep(40)
-
-  wcred = util.create_service_credential(
-    args.keyname_prefix, 'Writer', args.instance_name
-  )
-  rcred = util.create_service_credential(
-    args.keyname_prefix, 'Reader', args.instance_name
-  )
-  with open(args.credential_file, 'a') as f:
-    f.write('CLOUDANT_WRITER_CREDENTIALS={}\n'.format(json.dumps(wcred[0]['credentials'])))
-    f.write('CLOUDANT_READER_CREDENTIALS={}\n'.format(json.dumps(rcred[0]['credentials'])))
+  journal = checkpoint.journal
+
+  def create_instance():
+    util.create_service_instance(args.instance_name, 'cloudantnosqldb', args.service_plan, args.region)
+    # sometimes craeting cloudant instance takes time so that should wait until it's active
+    util.wait_for_service_instance(args.instance_name)
+  journal.step('{}/instance'.format(args.instance_name), create_instance)
+
+  def create_credentials():
+    wcred = util.create_service_credential(
+      args.keyname_prefix, 'Writer', args.instance_name
+    )
+    rcred = util.create_service_credential(
+      args.keyname_prefix, 'Reader', args.instance_name
+    )
+    credentials.get_store(args.credential_file).update({
+      'CLOUDANT_WRITER_CREDENTIALS': json.dumps(wcred[0]['credentials']),
+      'CLOUDANT_READER_CREDENTIALS': json.dumps(rcred[0]['credentials'])
+    })
+    return {
+      'credentials': ['CLOUDANT_WRITER_CREDENTIALS', 'CLOUDANT_READER_CREDENTIALS'],
+      'url': wcred[0]['credentials'].get('url')
+    }
+  journal.step('{}/credentials'.format(args.instance_name), create_credentials)
 
   # write data
-  if args.database is not None and args.data is not None:
-
-    # get each from credentials
-    url = wcred[0]['credentials']['url']
-    m = re.match('https://(.*):(.*)@(.*)$', url)
-    if m is not None:
-      sc_username = m.group(1)
-      sc_password = m.group(2)
-      sc_url = 'https://{}'.format(m.group(3))
+  if args.database is not None and (args.data is not None or args.indexes is not None):
+    cred = credentials.get_store(args.credential_file).get_service_credentials('CLOUDANT', 'writer')
+    journal.step('{}/data'.format(args.instance_name), lambda: write(cred, args))
+
+# write databases and data of an existing instance, with the writer credentials in the credential file
+def seed(args):
+  args = parse_args(args)
+
+  cred = credentials.get_store(args.credential_file).get_service_credentials('CLOUDANT', 'writer')
+  if cred is None:
+    print(util.bcolors.FAIL + 'no Cloudant credentials in {}'.format(args.credential_file) + util.bcolors.ENDC)
+    raise Exception('no Cloudant credentials in {}'.format(args.credential_file))
+
+  if args.database is not None and (args.data is not None or args.indexes is not None):
+    write(cred, args)
+
+def connect(cred):
+  # get each from credentials
+  url = cred['url']
+  m = re.match('https://(.*):(.*)@(.*)$', url)
+  if m is not None:
+    sc_username = m.group(1)
+    sc_password = m.group(2)
+    sc_url = 'https://{}'.format(m.group(3))
+  else:
+    sc_username = cred['username']
+    sc_password = cred['apikey']
+    sc_url = cred['url']
+
+  # the key is a secret. it is shared by every script that connects, so only the URL is shown
+  print(util.bcolors.OKBLUE + 'connecting to {}'.format(sc_url) + util.bcolors.ENDC)
+  # create client
+  client = Cloudant(sc_username, sc_password, url=sc_url)
+  client.connect()
+  return client
+
+# create the databases, stream the seed files into them and build their indexes
+def write(cred, args):
+  client = connect(cred)
+
+  # create database
+  # log databases split by period are created by the rotation below
+  logs = log_databases(args)
+  databases = [x for x in args.database.split(',') if x not in logs]
+  for database in databases:
+    db = client.create_database(database)
+    if db.exists():
+      print(util.bcolors.OKBLUE + 'created {}'.format(database) + util.bcolors.ENDC)
     else:
-      sc_username = wcred[0]['credentials']['username']
-      sc_password = wcred[0]['credentials']['apikey']
-      sc_url = wcred[0]['credentials']['url']
-
-    print(sc_username)
-    print(sc_password)
-    print(sc_url)
-    # create client
-    client = Cloudant(sc_username, sc_password, url=sc_url)
-    client.connect()
-
-    # create database
-    databases = args.database.split(',')
-    for database in databases:
-      db = client.create_database(database)
-      if db.exists():
-        print(util.bcolors.OKBLUE + 'created {}'.format(database) + util.bcolors.ENDC)
-      else:
-        print(util.bcolors.FAIL + 'failed to create database {}'.format(database) + util.bcolors.ENDC)
-        raise Exception('failed to create database {}'.format(database))
-
-    # write data
-    units = args.data.split(',')
-    for unit in units:
-      file, database = unit.split(';')
-      with open(file) as f:
-        data = json.load(f)
-      ret = client.get(database).bulk_docs(data)
-      if len(ret) != len(data):
-        print(util.bcolors.FAIL + 'might not write all data' + util.bcolors.ENDC)
-        raise Exception('might not write all data')
-
-      if 'error' in ret:
-        print(
-          util.bcolors.FAIL +
-          'failed to write data to {} due to {}'.format(database, ret.reason) +
-          util.bcolors.ENDC
-        )
-        raise Exception('failed to write data to {}'.format(database))
-
-      check = list(filter(lambda x: x['ok'] is not True, ret))
-      if len(check) != 0:
-        print(util.bcolors.FAIL + 'failed to write some data' + util.bcolors.ENDC)
-        raise Exception('failed to write some data')
-
-      print(util.bcolors.OKBLUE + 'write all data to {}'.format(database) + util.bcolors.ENDC)
-
-    # closing
-    client.disconnect()
+      print(util.bcolors.FAIL + 'failed to create database {}'.format(database) + util.bcolors.ENDC)
+      raise Exception('failed to create database {}'.format(database))
+
+  # write data
+  # seed files are streamed in size-bounded batches, and databases are written concurrently
+  if args.data is not None:
+    units = [x.split(';') for x in args.data.split(',')]
+    cloudant_loader.load(
+      client, units, args.workers, args.batch_docs, args.batch_bytes, args.seed_mode == 'diff', args.presigned,
+      args.prune
+    )
+
+  # indexes are built after the data is written, so that they're built once
+  units = [x.split(';') for x in args.indexes.split(',')] if args.indexes is not None else []
+  if len([x for x in units if x[1] not in logs]) > 0:
+    cloudant_indexes.apply(cred, [x for x in units if x[1] not in logs], args.workers, args.index_timeout)
+
+  bases = [x for x in args.database.split(',') if x in logs]
+  if len(bases) > 0:
+    cloudant_rolling.rotate(client, cred, bases, args.log_period, args.retention, args.ahead, units)
+
+  # closing
+  client.disconnect()
+
+def log_databases(args):
+  if args.log_period is None or args.log_databases is None:
+    return []
+  return args.log_databases.split(',')
+
+# create the log databases of the current and next periods, and drop the expired ones.
+# run it at least once a period, like from cron, or by -o apply of main.py
+def rotate(args):
+  args = parse_args(args)
+
+  cred = credentials.get_store(args.credential_file).get_service_credentials('CLOUDANT', 'writer')
+  if cred is None:
+    print(util.bcolors.FAIL + 'no Cloudant credentials in {}'.format(args.credential_file) + util.bcolors.ENDC)
+    raise Exception('no Cloudant credentials in {}'.format(args.credential_file))
+  if len(log_databases(args)) == 0:
+    print(util.bcolors.FAIL + 'rotate needs --log-databases and --log-period' + util.bcolors.ENDC)
+    raise Exception('rotate needs --log-databases and --log-period')
+
+  client = connect(cred)
+  units = [x.split(';') for x in args.indexes.split(',')] if args.indexes is not None else []
+  cloudant_rolling.rotate(client, cred, log_databases(args), args.log_period, args.retention, args.ahead, units)
+  client.disconnect()
 
 def delete(args):
   args = parse_args(args)
@@ -120,5 +206,9 @@ if __name__ == '__main__':
     create(sys.argv[1:])
   elif args.operation == 'delete':
     delete(sys.argv[1:])
+  elif args.operation == 'seed':
+    seed(sys.argv[1:])
+  elif args.operation == 'rotate':
+    rotate(sys.argv[1:])
   else:
     print(util.bcolors.WARNING + 'no option. please check usage of this script.' + util.bcolors.ENDC)
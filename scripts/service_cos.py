@@ -9,6 +9,8 @@ import sys
 import json
 from os import path
 import util
+import credentials
+import checkpoint
 
 # get arguments
 def parse_args(args):
@@ -16,7 +18,8 @@ def parse_args(args):
   create IBM Cloud Object Storage.
   This requires an environment variable ${APIKEY} as your IAM API key.
   """)
-  parser.add_argument('-o', '--operation', default='create', help='create|delete a COS instance')
+  parser.add_argument('-o', '--operation', default='create',
+    help='create|delete a COS instance, or seed to upload data with the HMAC keys of an instance created before')
   parser.add_argument('-r', '--region', default='jp-tok', help='region name')
   parser.add_argument('-g', '--resource-group', default='c4c-covid-19', help='resource group name')
   parser.add_argument('-n', '--instance-name', default='cos', help='cloud object storage instance name')
@@ -35,40 +38,82 @@ def parse_args(args):
   parser.add_argument(
     '-c', '--credential-file', default='./.credentials', help='file path to store the service credentials'
   )
+  parser.add_argument('-x', '--key-prefix', default='', help='prefix of the object keys, like TENANT/')
+  parser.add_argument('-w', '--workers', default=8, type=int,
+    help='number of concurrent uploads or delete requests')
 
   return parser.parse_args(args)
 
+# each part is a step of the checkpoint journal, so a resumed deploy goes on from the one that failed
 def create(args):
   args = parse_args(args)
+  journal = checkpoint.journal
 
-  util.create_service_instance(
-    args.instance_name, 'cloud-object-storage', args.service_plan, 'global', legacy=False
-  )
-
-  tenant_id = util.get_tenant_id(args.instance_name)
+  def create_instance():
+    util.create_service_instance(
+      args.instance_name, 'cloud-object-storage', args.service_plan, 'global', legacy=False
+    )
+    util.wait_for_service_instance(args.instance_name)
+    return {'tenant_id': util.get_tenant_id(args.instance_name)}
+  tenant_id = journal.step('{}/instance'.format(args.instance_name), create_instance)['tenant_id']
 
   switch_auth('IAM')
 
-  util.create_buckets(args.buckets.split(','), args.region, tenant_id)
-
-  util.put_objects([x.split(';') for x in args.data.split(',')], args.region)
+  journal.step(
+    '{}/buckets'.format(args.instance_name),
+    lambda: util.create_buckets(args.buckets.split(','), args.region, tenant_id)
+  )
 
   # generate HMAC credentials
-  for role in ['Reader', 'Writer']:
-    cred = util.create_service_credential(
-      args.keyname_prefix, role, args.instance_name, '--parameters', '{"HMAC":true}'
-    )
-
-    with open(args.credential_file, 'a') as f:
-      f.write('COS_{}_CREDENTIALS={}\n'.format(role.upper(), json.dumps(cred[0]['credentials'])))
+  def create_credentials():
+    for role in ['Reader', 'Writer']:
+      cred = util.create_service_credential(
+        args.keyname_prefix, role, args.instance_name, '--parameters', '{"HMAC":true}'
+      )
+      credentials.get_store(args.credential_file).set_json(
+        'COS_{}_CREDENTIALS'.format(role.upper()), cred[0]['credentials']
+      )
+    return {'credentials': ['COS_READER_CREDENTIALS', 'COS_WRITER_CREDENTIALS']}
+  journal.step('{}/credentials'.format(args.instance_name), create_credentials)
+
+  # upload over the S3 API with the writer HMAC keys
+  if args.data is not None:
+    def upload():
+      hmac_keys = credentials.get_store(args.credential_file).get_cos_hmac_keys('writer')
+      objects = [x.split(';') for x in args.data.split(',')]
+      util.put_objects(objects, args.region, hmac_keys, args.workers, args.key_prefix)
+      return {'objects': len(objects)}
+    journal.step('{}/objects'.format(args.instance_name), upload)
 
   switch_auth('HMAC')
 
+# upload data to the buckets of an existing instance, with the writer HMAC keys in the credential file.
+# it doesn't touch the CLI config, so tenants sharing the instance can be seeded concurrently
+def seed(args):
+  args = parse_args(args)
+
+  hmac_keys = credentials.get_store(args.credential_file).get_cos_hmac_keys('writer')
+  if hmac_keys is None:
+    print(util.bcolors.FAIL + 'no COS HMAC keys in {}'.format(args.credential_file) + util.bcolors.ENDC)
+    raise Exception('no COS HMAC keys in {}'.format(args.credential_file))
+
+  if args.data is not None:
+    util.put_objects(
+      [x.split(';') for x in args.data.split(',')], args.region, hmac_keys, args.workers, args.key_prefix
+    )
+
 def delete(args):
   args = parse_args(args)
   switch_auth('IAM')
-  util.delete_objects([x.split(';') for x in args.data.split(',')], args.region)
-  util.delete_buckets(args.buckets.split(','), args.region)
+
+  # buckets are emptied over the S3 API when the writer HMAC keys are still known
+  hmac_keys = credentials.get_store(args.credential_file).get_cos_hmac_keys('writer')
+
+  if args.data is not None:
+    util.delete_objects(
+      [x.split(';') for x in args.data.split(',')], args.region, hmac_keys, args.workers, args.key_prefix
+    )
+  util.delete_buckets(args.buckets.split(','), args.region, hmac_keys, args.workers)
   util.delete_service_instance(args.instance_name, args.resource_group)
 
 def switch_auth(method):
@@ -88,5 +133,7 @@ if __name__ == '__main__':
     create(sys.argv[1:])
   elif args.operation == 'delete':
     delete(sys.argv[1:])
+  elif args.operation == 'seed':
+    seed(sys.argv[1:])
   else:
     print(util.bcolors.WARNING + 'no option. please check usage of this script.' + util.bcolors.ENDC)
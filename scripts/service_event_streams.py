@@ -4,6 +4,8 @@ import json
 import sys
 from os import path
 import util
+import credentials
+import checkpoint
 
 
 # get arguments
@@ -25,21 +27,34 @@ def parse_args(args):
 
   return parser.parse_args(args)
 
+# each part is a step of the checkpoint journal, so a resumed deploy goes on from the one that failed
 def create(args):
   args = parse_args(args)
+  journal = checkpoint.journal
 
-  util.create_service_instance(args.instance_name, 'messagehub', args.service_plan, args.region)
+  def create_instance():
+    util.create_service_instance(args.instance_name, 'messagehub', args.service_plan, args.region)
+    util.wait_for_service_instance(args.instance_name)
+  journal.step('{}/instance'.format(args.instance_name), create_instance)
 
-  wcred = util.create_service_credential(args.keyname_prefix, 'Writer', args.instance_name)
-  rcred = util.create_service_credential(args.keyname_prefix, 'Reader', args.instance_name)
-  with open(args.credential_file, 'a') as f:
-    f.write('EVENT_STREAMS_WRITER_CREDENTIALS={}\n'.format(json.dumps(wcred[0]['credentials'])))
-    f.write('EVENT_STREAMS_READER_CREDENTIALS={}\n'.format(json.dumps(rcred[0]['credentials'])))
+  def create_credentials():
+    wcred = util.create_service_credential(args.keyname_prefix, 'Writer', args.instance_name)
+    rcred = util.create_service_credential(args.keyname_prefix, 'Reader', args.instance_name)
+    credentials.get_store(args.credential_file).update({
+      'EVENT_STREAMS_WRITER_CREDENTIALS': json.dumps(wcred[0]['credentials']),
+      'EVENT_STREAMS_READER_CREDENTIALS': json.dumps(rcred[0]['credentials'])
+    })
+    # w and r has same admin url
+    return {
+      'credentials': ['EVENT_STREAMS_WRITER_CREDENTIALS', 'EVENT_STREAMS_READER_CREDENTIALS'],
+      'kafka_admin_url': wcred[0]['credentials']['kafka_admin_url']
+    }
+  admin_url = journal.step('{}/credentials'.format(args.instance_name), create_credentials)['kafka_admin_url']
 
-  # w and r has same admin url
-  util.event_streams_init(args.instance_name, wcred[0]['credentials']['kafka_admin_url'])
-
-  util.create_topic(args.topics.split(','))
+  def create_topics():
+    util.event_streams_init(args.instance_name, admin_url)
+    util.create_topic(args.topics.split(','))
+  journal.step('{}/topics'.format(args.instance_name), create_topics)
 
 def delete(args):
   args = parse_args(args)
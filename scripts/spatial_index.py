@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import util
+import plan
+import cloudant_loader
+
+VERSION = 1
+# a floor is split into at most this many cells, whatever the size of its areas
+MAX_CELLS = 1 << 20
+
+
+'''
+Spatial index from points on a floor map to the congestion areas there.
+areas are rectangles of mapCoordinate, lat and lng being the top and left and height and width their size.
+each floor, or any asset whose belongings have areas like the outside, gets a uniform grid
+whose cell is as large as its smallest area. a cell lists the areas overlapping it,
+so a lookup is one division and a containment test of a few rectangles.
+the index is a JSON artifact with its format version and the digest of the assets it's built from.
+'''
+# docs are read once, and only the rectangles of areas and the belongings of the others are kept
+def build(docs, source=None):
+  areas = {}
+  containers = []
+  for doc in docs:
+    if doc.get('type') == 'area':
+      rect = rectangle(doc.get('mapCoordinate'))
+      if rect is not None:
+        areas[doc['id']] = rect
+    elif len(doc.get('belongings') or []) > 0:
+      containers.append((doc['id'], doc['belongings'], rectangle(doc.get('mapCoordinate'))))
+
+  floors = {}
+  for floor, belongings, bounds in containers:
+    belongings = [x for x in belongings if x in areas]
+    if len(belongings) > 0:
+      floors[floor] = build_floor([[x] + areas[x] for x in belongings], bounds)
+  return {'version': VERSION, 'source': source, 'floors': floors}
+
+# [lat, lng, height, width] of a mapCoordinate, or None when it isn't one
+def rectangle(coordinate):
+  if not isinstance(coordinate, dict):
+    return None
+  try:
+    rect = [float(coordinate[x]) for x in ['lat', 'lng', 'height', 'width']]
+  except (KeyError, TypeError, ValueError):
+    return None
+  return rect if rect[2] > 0 and rect[3] > 0 else None
+
+def build_floor(areas, bounds=None):
+  top = min([x[1] for x in areas] + ([bounds[0]] if bounds else []))
+  left = min([x[2] for x in areas] + ([bounds[1]] if bounds else []))
+  bottom = max([x[1] + x[3] for x in areas] + ([bounds[0] + bounds[2]] if bounds else []))
+  right = max([x[2] + x[4] for x in areas] + ([bounds[1] + bounds[3]] if bounds else []))
+
+  cell = [min(x[3] for x in areas), min(x[4] for x in areas)]
+  scale = math.sqrt(((bottom - top) / cell[0]) * ((right - left) / cell[1]) / MAX_CELLS)
+  if scale > 1:
+    cell = [cell[0] * scale, cell[1] * scale]
+  rows = max(1, math.ceil((bottom - top) / cell[0] - 1e-9))
+  cols = max(1, math.ceil((right - left) / cell[1] - 1e-9))
+
+  grid = [[] for _ in range(rows * cols)]
+  for n, (_, lat, lng, height, width) in enumerate(areas):
+    r0, r1 = span(lat - top, height, cell[0], rows)
+    c0, c1 = span(lng - left, width, cell[1], cols)
+    for r in range(r0, r1):
+      for c in range(c0, c1):
+        grid[r * cols + c].append(n)
+
+  # cells are flattened into offsets and area numbers, cell k having cells[offsets[k]:offsets[k + 1]]
+  offsets = [0]
+  cells = []
+  for x in grid:
+    cells.extend(x)
+    offsets.append(len(cells))
+  return {
+    'origin': [top, left], 'cell': cell, 'rows': rows, 'cols': cols,
+    'areas': areas, 'offsets': offsets, 'cells': cells
+  }
+
+# cells [first, last) covering [start, start + size)
+def span(start, size, cell, count):
+  first = max(0, int(math.floor(start / cell + 1e-9)))
+  last = min(count, int(math.ceil((start + size) / cell - 1e-9)))
+  return first, max(first + 1, last) if first < count else first
+
+class SpatialIndex:
+  def __init__(self, index):
+    if index.get('version') != VERSION:
+      print(util.bcolors.FAIL + 'spatial index version {} is not supported'.format(index.get('version')) + util.bcolors.ENDC)
+      raise Exception('spatial index version {} is not supported'.format(index.get('version')))
+    self.source = index.get('source')
+    self.floors = index['floors']
+
+  # id of the area of a floor that has the point, or None
+  def lookup(self, floor, lat, lng):
+    f = self.floors.get(floor)
+    if f is None:
+      return None
+    r = int((lat - f['origin'][0]) // f['cell'][0])
+    c = int((lng - f['origin'][1]) // f['cell'][1])
+    if r < 0 or c < 0 or r >= f['rows'] or c >= f['cols']:
+      return None
+    k = r * f['cols'] + c
+    offsets = f['offsets']
+    for n in f['cells'][offsets[k]:offsets[k + 1]]:
+      area, top, left, height, width = f['areas'][n]
+      if top <= lat < top + height and left <= lng < left + width:
+        return area
+    return None
+
+def load(path):
+  with open(path) as f:
+    return SpatialIndex(json.load(f))
+
+# the index of an assets file, rebuilt only when the file has changed since the last build.
+# the digest of the last build is kept next to the index, so an up-to-date index isn't read
+def build_file(assets_file, path):
+  source = plan.digest([assets_file])
+  if os.path.exists(path) and os.path.exists(path + '.source'):
+    with open(path + '.source') as f:
+      if f.read() == '{}:{}'.format(VERSION, source):
+        return path
+
+  docs = (doc for doc, _ in cloudant_loader.iter_file(assets_file))
+  os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+  with open(path + '.tmp', 'w') as f:
+    json.dump(build(docs, source), f, separators=(',', ':'))
+  os.replace(path + '.tmp', path)
+  with open(path + '.source', 'w') as f:
+    f.write('{}:{}'.format(VERSION, source))
+  return path
+
+def file_name():
+  return 'spatial-index-v{}.json'.format(VERSION)
+
+
+'''
+linear scan, which consumers did without the index
+'''
+def linear_lookup(docs, floor, lat, lng):
+  belongings = set(next((x.get('belongings') or [] for x in docs if x.get('id') == floor), []))
+  for doc in docs:
+    rect = rectangle(doc.get('mapCoordinate'))
+    if doc.get('type') != 'area' or doc['id'] not in belongings or rect is None:
+      continue
+    if rect[0] <= lat < rect[0] + rect[2] and rect[1] <= lng < rect[1] + rect[3]:
+      return doc['id']
+  return None
+
+def benchmark(docs, index, count):
+  rng = random.Random(0)
+  points = []
+  for floor, f in index.floors.items():
+    height, width = f['rows'] * f['cell'][0], f['cols'] * f['cell'][1]
+    points.extend(
+      (floor, f['origin'][0] + rng.random() * height, f['origin'][1] + rng.random() * width)
+      for _ in range(count // max(1, len(index.floors)))
+    )
+
+  start = time.perf_counter()
+  found = [index.lookup(*x) for x in points]
+  indexed = time.perf_counter() - start
+
+  # the scan is slow, so it's timed for a sample
+  sample = points[:max(1, min(len(points), 10000))]
+  start = time.perf_counter()
+  scanned = [linear_lookup(docs, *x) for x in sample]
+  linear = (time.perf_counter() - start) * len(points) / len(sample)
+
+  if scanned != found[:len(sample)]:
+    print(util.bcolors.FAIL + 'the index and the linear scan disagree' + util.bcolors.ENDC)
+    raise Exception('the index and the linear scan disagree')
+  print('{} lookups: index {:.3f}s ({:.0f}/s), linear scan {:.3f}s ({:.0f}/s), {:.0f}x'.format(
+    len(points), indexed, len(points) / indexed, linear, len(points) / linear, linear / indexed
+  ))
+
+
+def parse_args(args):
+  parser = argparse.ArgumentParser(description="""
+  build the spatial index of areas from assets.json, look up points or benchmark it against a linear scan.
+  """)
+  parser.add_argument('-a', '--assets', default='../data/tenants/c4c/cloudant/assets.json', help='assets.json')
+  parser.add_argument('-o', '--output', help='file path to write the index')
+  parser.add_argument('-f', '--floor', help='floor of --point')
+  parser.add_argument('-q', '--point', help='LAT,LNG to look up')
+  parser.add_argument('-n', '--benchmark', type=int, help='number of random points to look up for a benchmark')
+
+  return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv[1:])
+  with open(args.assets) as f:
+    docs = json.load(f)
+  index = SpatialIndex(build(docs, plan.digest([args.assets])))
+
+  if args.output is not None:
+    build_file(args.assets, args.output)
+  if args.point is not None:
+    lat, lng = [float(x) for x in args.point.split(',')]
+    floors = [args.floor] if args.floor is not None else list(index.floors.keys())
+    for floor in floors:
+      print('{}: {}'.format(floor, index.lookup(floor, lat, lng)))
+  if args.benchmark is not None:
+    benchmark(docs, index, args.benchmark)
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import threading
+import subprocess
+from urllib import parse
+import util
+
+# number of the slowest spans printed by the summary
+TOP_N = 10
+
+
+'''
+Deploy tracing.
+spans are recorded for every subprocess call, HTTP request, provisioning wait and scheduler step,
+and written as a Chrome trace-event JSON that chrome://tracing or Perfetto opens.
+tracing is off unless enable() is called, and a span costs nothing then.
+'''
+class Span:
+  def __init__(self, tracer, name, cat, args):
+    self.tracer = tracer
+    self.name = name
+    self.cat = cat
+    self.args = args
+    self.tid = threading.get_ident()
+    self.start = time.monotonic()
+    self.end = None
+
+  def set(self, **args):
+    self.args.update(args)
+
+  def finish(self):
+    if self.end is None:
+      self.end = time.monotonic()
+      self.tracer.record(self)
+
+  def duration(self):
+    return None if self.end is None else self.end - self.start
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    if exc is not None:
+      self.args['error'] = str(exc)
+    self.finish()
+
+
+class NullSpan:
+  def set(self, **args):
+    pass
+
+  def finish(self):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    pass
+
+
+class Tracer:
+  def __init__(self):
+    self.enabled = False
+    self.spans = []
+    # spans started per category, including processes whose exit was never waited for, like 'grep' in a pipe
+    self.started = {}
+    self.origin = time.monotonic()
+    self.lock = threading.Lock()
+    self.null = NullSpan()
+
+  def span(self, name, cat, **args):
+    if not self.enabled:
+      return self.null
+    with self.lock:
+      self.started[cat] = self.started.get(cat, 0) + 1
+    return Span(self, name, cat, args)
+
+  def record(self, span):
+    with self.lock:
+      self.spans.append(span)
+
+  '''
+  output
+  '''
+  def events(self):
+    with self.lock:
+      spans = list(self.spans)
+    tids = {}
+    events = []
+    for s in sorted(spans, key=lambda x: x.start):
+      tid = tids.setdefault(s.tid, len(tids) + 1)
+      events.append({
+        'name': s.name, 'cat': s.cat, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+        'ts': int((s.start - self.origin) * 1e6), 'dur': int(s.duration() * 1e6),
+        'args': {k: v if isinstance(v, (int, float, bool)) or v is None else str(v) for k, v in s.args.items()}
+      })
+    return events
+
+  def write(self, path):
+    with open(path, 'w') as f:
+      json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, f)
+    print(util.bcolors.OKGREEN + 'wrote trace to {}'.format(path) + util.bcolors.ENDC)
+
+  def summary(self, top=TOP_N):
+    with self.lock:
+      spans = list(self.spans)
+
+    print(util.bcolors.HEADER + '{:<10} {:>8} {:>10} {:>14}'.format('category', 'calls', 'seconds', 'bytes') + util.bcolors.ENDC)
+    for cat in sorted(self.started.keys()):
+      xs = [x for x in spans if x.cat == cat]
+      print('{:<10} {:>8} {:>10.1f} {:>14}'.format(
+        cat, self.started[cat], sum(x.duration() for x in xs),
+        sum(x.args.get('bytes_in', 0) + x.args.get('bytes_out', 0) for x in xs)
+      ))
+
+    print(util.bcolors.HEADER + 'top {} slowest spans'.format(top) + util.bcolors.ENDC)
+    for s in sorted(spans, key=lambda x: x.duration(), reverse=True)[:top]:
+      print('{:>8.2f}s  {:<8} {}'.format(s.duration(), s.cat, s.name))
+
+tracer = Tracer()
+
+# traces are shared to find slow steps, so they never carry API keys, tokens or passwords
+def redact_command(args):
+  out = []
+  for i, x in enumerate(args):
+    x = str(x)
+    if i > 0 and str(args[i - 1]) == '--apikey':
+      x = '***'
+    elif x.lower().startswith('authorization:'):
+      x = 'Authorization: ***'
+    out.append(x)
+  return ' '.join(out)
+
+def redact_url(url):
+  u = parse.urlsplit(url)
+  if u.username is None and u.password is None:
+    return url
+  return parse.urlunsplit((u.scheme, u.hostname + ('' if u.port is None else ':{}'.format(u.port)), u.path, u.query, u.fragment))
+
+
+'''
+subprocess calls.
+the scripts run the CLI by subprocess.Popen all over, so enable() swaps it for a subclass
+that opens a span when a process starts and finishes it once its exit code is known.
+'''
+class TracedPopen(subprocess.Popen):
+  def __init__(self, args, *rest, **kwargs):
+    if tracer.enabled:
+      command = redact_command(args.split() if isinstance(args, str) else list(args))
+      # 'ibmcloud fn action list' is more telling than the whole command line
+      self.span = tracer.span(' '.join(command.split()[:4]), 'cli', command=command)
+    else:
+      self.span = tracer.null
+    super().__init__(args, *rest, **kwargs)
+
+  def communicate(self, input=None, timeout=None):
+    out = super().communicate(input, timeout)
+    self.span.set(
+      bytes_out=len(input or b''),
+      bytes_in=sum(len(x) for x in out if x is not None)
+    )
+    self._finish_span()
+    return out
+
+  def wait(self, timeout=None):
+    code = super().wait(timeout)
+    self._finish_span()
+    return code
+
+  def poll(self):
+    code = super().poll()
+    if code is not None:
+      self._finish_span()
+    return code
+
+  def _finish_span(self):
+    if self.returncode is not None:
+      self.span.set(exit_code=self.returncode)
+      self.span.finish()
+
+Popen = subprocess.Popen
+
+def enable():
+  tracer.enabled = True
+  subprocess.Popen = TracedPopen
+
+def disable():
+  tracer.enabled = False
+  subprocess.Popen = Popen
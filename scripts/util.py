@@ -3,7 +3,16 @@ import re
 import os
 import json
 import uuid
-from urllib import request
+import time
+import random
+import base64
+import hashlib
+import threading
+from urllib import parse
+import http_client
+import s3
+import credentials
+import tracing
 
 class bcolors:
   HEADER = '\033[95m'
@@ -16,6 +25,164 @@ class bcolors:
   UNDERLINE = '\033[4m'
 
 
+'''
+Cancellation of a run.
+the scheduler sets it when a step fails. the other running steps give up at their next wait or step,
+instead of polling on or starting more CLI work.
+'''
+class Cancelled(Exception):
+  pass
+
+cancelled = threading.Event()
+
+def check_cancelled():
+  if cancelled.is_set():
+    print(bcolors.WARNING + 'cancelled as another step failed' + bcolors.ENDC)
+    raise Cancelled('cancelled as another step failed')
+
+# sleep that returns early and raises when the run is cancelled
+def sleep(seconds):
+  cancelled.wait(max(0, seconds))
+  check_cancelled()
+
+
+'''
+Inventory of existing resources.
+each resource list is fetched once per run and existence checks are answered from the snapshot.
+helpers below update the snapshot after they create or delete a resource.
+'''
+def _parse_json_names(out):
+  items = json.loads(out or 'null') or []
+  return {x['name']: x for x in items}
+
+# functions lists look like "/NAMESPACE_ID/PACKAGE/ACTION  private  nodejs:10" after a title line
+def _parse_functions_table(out):
+  rows = {}
+  for line in out.split('\n')[1:]:
+    cols = line.split()
+    if len(cols) == 0:
+      continue
+    name = cols[0]
+    if name.startswith('/'):
+      name = '/'.join(name.split('/')[2:])
+    rows[name] = cols
+  return rows
+
+# namespace list has a header line "name type id description"
+def _parse_namespace_table(out):
+  return {x.split()[0]: x.split() for x in out.split('\n')[1:] if len(x.strip()) > 0}
+
+# path of an api URL, which is BASE_PATH/API_PATH after the host of the gateway,
+# or after /gws/apigateway/api/ID on the older gateway
+def _api_url_path(url):
+  return re.sub('^/gws/apigateway/api/[^/]+', '', parse.urlsplit(url).path)
+
+# api list rows look like "ACTION VERB API_NAME URL". they are named "VERB BASE_PATH/API_PATH"
+def _parse_api_table(out):
+  rows = {}
+  for line in out.split('\n'):
+    cols = line.split()
+    if len(cols) > 2 and cols[-1].startswith('http'):
+      rows['{} {}'.format(cols[1].lower(), _api_url_path(cols[-1]))] = cols
+  return rows
+
+class Inventory:
+  KINDS = {
+    'service-instances': (['ibmcloud', 'resource', 'service-instances', '--output', 'json'], _parse_json_names),
+    'service-keys': (['ibmcloud', 'resource', 'service-keys', '--output', 'json'], _parse_json_names),
+    'namespaces': (['ibmcloud', 'fn', 'namespace', 'list'], _parse_namespace_table),
+    'packages': (['ibmcloud', 'fn', 'package', 'list'], _parse_functions_table),
+    'actions': (['ibmcloud', 'fn', 'action', 'list'], _parse_functions_table),
+    'triggers': (['ibmcloud', 'fn', 'trigger', 'list'], _parse_functions_table),
+    'rules': (['ibmcloud', 'fn', 'rule', 'list'], _parse_functions_table),
+    'apis': (['ibmcloud', 'fn', 'api', 'list'], _parse_api_table),
+  }
+  # these lists depend on the namespace targeted by 'ibmcloud fn property set'
+  FUNCTIONS_KINDS = ['packages', 'actions', 'triggers', 'rules', 'apis']
+
+  def __init__(self):
+    self.snapshots = {}
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    self.kind_locks = {x: threading.Lock() for x in self.KINDS.keys()}
+    # callables used in place of the CLI list commands, like the ones of a Functions backend
+    self.fetchers = {}
+
+  def get(self, kind, name):
+    snapshot = self._snapshot(kind)
+    with self.lock:
+      return snapshot.get(name)
+
+  def exists(self, kind, name):
+    snapshot = self._snapshot(kind)
+    with self.lock:
+      return name in snapshot
+
+  # a copy, as other threads add and remove rows of the snapshot
+  def rows(self, kind):
+    snapshot = self._snapshot(kind)
+    with self.lock:
+      return dict(snapshot)
+
+  def _snapshot(self, kind):
+    with self.kind_locks[kind]:
+      with self.lock:
+        if kind in self.snapshots:
+          self.hits += 1
+          return self.snapshots[kind]
+        self.misses += 1
+
+      if kind in self.fetchers:
+        rows = self.fetchers[kind]()
+      else:
+        command, parse = self.KINDS[kind]
+        p1 = subprocess.Popen(command, stdout=subprocess.PIPE)
+        wait = p1.communicate()
+        if p1.returncode != 0:
+          print(bcolors.FAIL + 'cannot list {}'.format(kind) + bcolors.ENDC)
+          raise Exception('cannot list {}'.format(kind))
+        rows = parse(wait[0].decode('utf-8'))
+
+      with self.lock:
+        self.snapshots[kind] = rows
+      return rows
+
+  def add(self, kind, name, row=None):
+    with self.lock:
+      if kind in self.snapshots:
+        self.snapshots[kind][name] = row
+
+  def remove(self, kind, name):
+    with self.lock:
+      if kind in self.snapshots:
+        self.snapshots[kind].pop(name, None)
+
+  def invalidate(self, *kinds):
+    with self.lock:
+      for kind in kinds if len(kinds) > 0 else list(self.snapshots.keys()):
+        self.snapshots.pop(kind, None)
+
+  def report(self):
+    print(
+      bcolors.OKBLUE +
+      'inventory cache: {} hits, {} misses (list calls)'.format(self.hits, self.misses) +
+      bcolors.ENDC
+    )
+
+inventory = Inventory()
+
+# Functions helpers below are dispatched to this backend when it is installed.
+# otherwise, they run the ibmcloud fn CLI.
+functions_backend = None
+
+def use_functions_backend(backend):
+  global functions_backend
+  functions_backend = backend
+  inventory.fetchers.update(backend.fetchers())
+  inventory.invalidate(*backend.fetchers().keys())
+
+
 '''
 Fundamental Functions For IBM Cloud, like login and service creation
 '''
@@ -29,12 +196,7 @@ def login(region, resource_group):
 def create_service_instance(instance_name, service, service_plan, region, legacy=True):
   print(bcolors.OKGREEN + 'Starting to create a instance {}'.format(instance_name) + bcolors.ENDC)
 
-  p1 = subprocess.Popen(['ibmcloud', 'resource', 'service-instances'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen(['grep', instance_name], stdin=p1.stdout, stdout=subprocess.PIPE)
-  p3 = subprocess.Popen(['wc', '-l'], stdin=p2.stdout, stdout=subprocess.PIPE)
-  res = p3.communicate()[0]
-
-  if int(res.decode('utf-8').strip()) == 0:
+  if not inventory.exists('service-instances', instance_name):
     # create an instance
     legacyOption = ['-p', '{{"legacyCredentials": {}}}'.format('true' if legacy is True else 'false')]
     p1 = subprocess.Popen([
@@ -46,9 +208,80 @@ def create_service_instance(instance_name, service, service_plan, region, legacy
     if p1.returncode != 0:
       print(bcolors.FAIL + 'failed to create instance {}'.format(instance_name) + bcolors.ENDC)
       raise Exception('failed to create instance {}'.format(instance_name))
+    inventory.add('service-instances', instance_name)
   else:
     print(bcolors.OKGREEN + 'skip to create an instance {}'.format(instance_name) + bcolors.ENDC)
 
+def get_service_instance_state(instance_name):
+  p1 = subprocess.Popen([
+    'ibmcloud', 'resource', 'service-instance', instance_name, '--output', 'json'
+  ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+  wait = p1.communicate()
+  if p1.returncode != 0:
+    return None, None
+
+  instances = json.loads(wait[0].decode('utf-8') or 'null')
+  if not instances:
+    return None, None
+
+  last_operation = instances[0].get('last_operation') or {}
+  return instances[0].get('state'), last_operation.get('state')
+
+# poll the instance state with exponential backoff and jitter until it is active.
+# timeout is the overall deadline in seconds.
+def wait_for_service_instance(instance_name, state='active', timeout=900, interval=2, max_interval=30):
+  print(
+    bcolors.OKGREEN + 'Waiting for an instance {} to be {}'.format(instance_name, state) +
+    bcolors.ENDC
+  )
+
+  with tracing.tracer.span('wait {}'.format(instance_name), 'wait', instance=instance_name) as span:
+    _wait_for_service_instance(instance_name, [state], timeout, interval, max_interval, span)
+
+# states of an instance that is deleted. None is an instance that isn't found any more.
+# a deleted instance can be kept for reclamation, but it isn't an instance of the account then
+REMOVED_STATES = [None, 'removed', 'pending_reclamation']
+
+# poll a deleted instance the same way until it is gone, so that it can be created again right away
+def wait_for_service_instance_removal(instance_name, timeout=900, interval=2, max_interval=30):
+  print(bcolors.OKGREEN + 'Waiting for an instance {} to be removed'.format(instance_name) + bcolors.ENDC)
+
+  with tracing.tracer.span('wait removal {}'.format(instance_name), 'wait', instance=instance_name) as span:
+    _wait_for_service_instance(instance_name, REMOVED_STATES, timeout, interval, max_interval, span, 'remove')
+
+def _wait_for_service_instance(instance_name, states, timeout, interval, max_interval, span, action='provision'):
+  started = time.monotonic()
+  deadline = started + timeout
+  delay = interval
+  polls = 0
+  while True:
+    current, operation = get_service_instance_state(instance_name)
+    polls += 1
+    span.set(polls=polls, state=current)
+    if current in states:
+      print(
+        bcolors.OKGREEN +
+        'instance {} is {} after {:.0f}s'.format(instance_name, current or 'gone', time.monotonic() - started) +
+        bcolors.ENDC
+      )
+      return
+
+    if operation == 'failed':
+      print(bcolors.FAIL + 'failed to {} instance {}'.format(action, instance_name) + bcolors.ENDC)
+      raise Exception('failed to {} instance {}'.format(action, instance_name))
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      print(
+        bcolors.FAIL + 'instance {} is still {} after {}s'.format(instance_name, current, timeout) +
+        bcolors.ENDC
+      )
+      raise Exception('instance {} is not {} within {}s'.format(instance_name, '|'.join(str(x) for x in states), timeout))
+
+    # equal jitter keeps parallel waiters from polling in lockstep
+    sleep(min(remaining, delay / 2 + random.uniform(0, delay / 2)))
+    delay = min(max_interval, delay * 2)
+
 def get_tenant_id(instance_name):
   print(bcolors.OKGREEN + 'Starting to get a tenant id of {}'.format(instance_name) + bcolors.ENDC)
 
@@ -63,16 +296,94 @@ def get_tenant_id(instance_name):
   print(bcolors.OKGREEN + 'got a tenant id {}'.format(tenant_id) + bcolors.ENDC)
   return tenant_id
 
+def get_resource_group_id(resource_group):
+  p1 = subprocess.Popen(['ibmcloud', 'resource', 'group', resource_group, '--id'], stdout=subprocess.PIPE)
+  wait = p1.communicate()
+  id = wait[0].decode('utf-8').strip()
+  if p1.returncode != 0 or len(id) == 0:
+    print(bcolors.FAIL + 'cannot get id of resource group {}'.format(resource_group) + bcolors.ENDC)
+    raise Exception('cannot get id of resource group {}'.format(resource_group))
+
+  return id
+
+# IAM_TOKEN_URL points it to another token server, like a local stub
+IAM_TOKEN_URL = os.environ.get('IAM_TOKEN_URL', 'https://iam.cloud.ibm.com/oidc/token')
+# IAM tokens live for an hour. a cached token is refreshed when it is this close to its expiry
+IAM_TOKEN_REFRESH_MARGIN = 300
+
+# tokens are kept per API key, like the deploy key and the Cloudant one, keyed by a hash of the key
+class IAMTokenCache:
+  def __init__(self, path=None):
+    # a file lets sub-scripts run as separate processes share the tokens in one run
+    self.path = path
+    self.tokens = {}
+    self.lock = threading.Lock()
+
+  def get(self, apikey):
+    key = hashlib.sha256((apikey or '').encode()).hexdigest()
+    with self.lock:
+      if self._fresh(key):
+        return self.tokens[key]['token']
+
+      self._load()
+      if self._fresh(key):
+        return self.tokens[key]['token']
+
+      print(bcolors.OKGREEN + 'Starting to get an IAM token' + bcolors.ENDC)
+      data = parse.urlencode({
+        'grant_type': 'urn:ibm:params:oauth:grant-type:apikey', 'apikey': apikey
+      }).encode()
+      res = http_client.session.request(
+        'POST', IAM_TOKEN_URL, body=data,
+        headers={'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'},
+        timeout=30
+      )
+      if res.status != 200:
+        print(bcolors.FAIL + 'failed to get an IAM token by {}'.format(res.reason) + bcolors.ENDC)
+        raise Exception('failed to get an IAM token by {}'.format(res.reason))
+
+      j = res.json()
+      self.tokens[key] = {
+        'token': 'Bearer ' + j['access_token'],
+        'expiration': j.get('expiration', time.time() + j.get('expires_in', 3600))
+      }
+      self._save()
+      return self.tokens[key]['token']
+
+  def _fresh(self, key):
+    return key in self.tokens and time.time() < self.tokens[key]['expiration'] - IAM_TOKEN_REFRESH_MARGIN
+
+  def _load(self):
+    if self.path is None or not os.path.exists(self.path):
+      return
+    with open(self.path) as f:
+      j = json.load(f)
+    # tokens written by other processes, which might have refreshed them
+    self.tokens.update(j.get('tokens', {}))
+
+  def _save(self):
+    if self.path is None:
+      return
+    fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+      json.dump({'tokens': self.tokens}, f)
+
+iam_token_cache = IAMTokenCache(os.environ.get('IAM_TOKEN_CACHE'))
+
 def get_IAM_token():
-  print(bcolors.OKGREEN + 'Starting to get an IAM token' + bcolors.ENDC)
+  return iam_token_cache.get(os.environ.get('APIKEY'))
 
-  data = 'grant_type=urn:ibm:params:oauth:grant-type:apikey&apikey={}'.format(os.environ.get('APIKEY')).encode()
-  headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-  req = request.Request('https://iam.cloud.ibm.com/oidc/token', data = data, headers = headers)
-  r = request.urlopen(req)
-  token = 'Bearer ' + json.loads(r.read())['access_token']
-  
-  return token
+# base URL and Authorization header of Cloudant credentials. legacy ones sign in by the password,
+# which might be in the URL, and IAM ones by a token of the API key
+def cloudant_endpoint(cred):
+  m = re.match('https://(.*):(.*)@(.*)$', cred['url'])
+  if m is not None:
+    url, username, password = 'https://{}'.format(m.group(3)), m.group(1), m.group(2)
+  else:
+    url, username, password = cred['url'], cred.get('username'), cred.get('password')
+  if password is None:
+    return url.rstrip('/'), iam_token_cache.get(cred['apikey'])
+  return url.rstrip('/'), 'Basic ' + base64.b64encode('{}:{}'.format(username, password).encode()).decode()
 
 def create_service_credential(keyname_prefix, role, instance_name, *args):
   print(
@@ -82,14 +393,8 @@ def create_service_credential(keyname_prefix, role, instance_name, *args):
   )
 
   # check if the key exists
-  p1 = subprocess.Popen(['ibmcloud', 'resource', 'service-keys'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen([
-    'awk', '/{}-{}/ {{print $2}}'.format(keyname_prefix, role.lower())
-  ], stdin=p1.stdout, stdout=subprocess.PIPE)
-  p3 = subprocess.Popen(['wc', '-l'], stdin=p2.stdout, stdout=subprocess.PIPE)
-  res = p3.communicate()[0]
-
-  if int(res.decode('utf-8').strip()) == 0:
+  keyname = '{}-{}'.format(keyname_prefix, role.lower())
+  if not inventory.exists('service-keys', keyname):
     # create a credential
     p1 = subprocess.Popen([
       'ibmcloud', 'resource', 'service-key-create', '{}-{}'.format(keyname_prefix, role.lower()),
@@ -103,6 +408,7 @@ def create_service_credential(keyname_prefix, role, instance_name, *args):
         bcolors.ENDC
       )
       raise Exception('cannot create {} service credentials for {}'.format(role, instance_name))
+    inventory.add('service-keys', keyname)
     print(
       bcolors.OKGREEN + 'created a {} credential for {}'.format(role, instance_name) +
       bcolors.ENDC
@@ -156,17 +462,15 @@ def create_s3_hmac_credential(keyname_prefix, role, instance_name):
     cre[0]['credentials']['endpoints']
   )
 
-def delete_service_instance(instance_name, resource_group):
+# the deletion runs in the background of IBM Cloud, so it waits until the instance is removed
+def delete_service_instance(instance_name, resource_group, timeout=900):
   print(
     bcolors.OKGREEN + 'Starting to delete an instance {}'.format(instance_name) +
     bcolors.ENDC
   )
 
   # check if it is
-  p1 = subprocess.Popen(['ibmcloud', 'resource', 'service-instance', instance_name], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen(['awk', '-F:', '/^ID/ {print $9}'], stdin=p1.stdout, stdout=subprocess.PIPE)
-  wait = p2.communicate()
-  if len(wait[0].decode('utf-8').strip()) == 0:
+  if not inventory.exists('service-instances', instance_name):
     print(bcolors.FAIL + 'no instance {}, skip this operation'.format(instance_name) + bcolors.ENDC)
     return
 
@@ -184,34 +488,49 @@ def delete_service_instance(instance_name, resource_group):
   else:
     print(bcolors.OKGREEN + wait[0].decode('utf-8') + bcolors.ENDC)
 
+  wait_for_service_instance_removal(instance_name, timeout)
+
+  # credentials are deleted together with --recursive
+  inventory.remove('service-instances', instance_name)
+  inventory.invalidate('service-keys')
+
 '''
 Functions for IBM Cloud Functions
 '''
 def create_functions_namespace(namespace):
   print(bcolors.OKGREEN + 'Starting to create a functions namespace' + bcolors.ENDC)
 
-  p1 = subprocess.Popen(['ibmcloud', 'fn', 'namespace', 'list'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen(['grep', namespace], stdin=p1.stdout, stdout=subprocess.PIPE)
-  wait = p2.communicate()
-  if p2.returncode != 0:
+  if functions_backend is not None:
+    functions_backend.create_functions_namespace(namespace)
+    # helpers given CLI options, like a periodical trigger, still run the CLI, so it targets the namespace too
+    set_functions_cli_namespace(namespace)
+    return
+
+  if not inventory.exists('namespaces', namespace):
     p1 = subprocess.Popen(['ibmcloud', 'fn', 'namespace', 'create', namespace], stdout=subprocess.PIPE)
     wait = p1.communicate()
     print(wait[0].decode('utf-8'))
     if p1.returncode != 0:
       print(bcolors.FAIL + 'cannot create namespace {}'.format(namespace) + bcolors.ENDC)
       raise Exception('cannot create namespace {}'.format(namespace))
+    # the id is given by the service, so the list is fetched again on the next lookup
+    inventory.invalidate('namespaces')
+
+  set_functions_cli_namespace(namespace)
+  inventory.invalidate(*Inventory.FUNCTIONS_KINDS)
 
+def set_functions_cli_namespace(namespace):
   p1 = subprocess.Popen(['ibmcloud', 'fn', 'property', 'set', '--namespace', namespace], stdout=subprocess.PIPE)
   print(p1.communicate()[0].decode('utf-8'))
+  if p1.returncode != 0:
+    print(bcolors.FAIL + 'cannot target namespace {}'.format(namespace) + bcolors.ENDC)
+    raise Exception('cannot target namespace {}'.format(namespace))
 
 def get_functions_namespace_id(namespace):
   print(bcolors.OKGREEN + 'Starting to get a functions namespace id' + bcolors.ENDC)
 
-  p1 = subprocess.Popen(['ibmcloud', 'fn', 'namespace', 'list'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen(['awk', '/^{}/ {{print $3}}'.format(namespace)],
-    stdin=p1.stdout, stdout=subprocess.PIPE)
-  wait = p2.communicate()
-  id = wait[0].decode('utf-8')
+  row = inventory.get('namespaces', namespace)
+  id = row[2] if row is not None and len(row) > 2 else ''
   if len(id) == 0:
     print(bcolors.FAIL + 'cannot get id of {}'.format(namespace) + bcolors.ENDC)
     raise Exception('cannot get id of {}'.format(namespace))
@@ -222,13 +541,7 @@ def get_functions_namespace_id(namespace):
 def check_functions_package_exists(package):
   print(bcolors.OKGREEN + 'Starting to check if {} exists'.format(package) + bcolors.ENDC)
 
-  p1 = subprocess.Popen(
-    ['ibmcloud', 'fn', 'package', 'list'], stdout=subprocess.PIPE
-  )
-  p2 = subprocess.Popen(['grep', package], stdin=p1.stdout, stdout=subprocess.PIPE)
-  p2.communicate()
-
-  if p2.returncode != 0:
+  if not inventory.exists('packages', package):
     print(bcolors.OKGREEN + 'no {} package'.format(package) + bcolors.ENDC)
     return False
 
@@ -238,41 +551,50 @@ def check_functions_package_exists(package):
 def create_functions_package(package):
   print(bcolors.OKGREEN + 'Starting to create a functions package' + bcolors.ENDC)
 
-  p1 = subprocess.Popen(['ibmcloud', 'fn', 'package', 'list'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen(['grep', package], stdin=p1.stdout, stdout=subprocess.PIPE)
-  wait = p2.communicate()
-  if p2.returncode != 0:
+  if functions_backend is not None:
+    return functions_backend.create_functions_package(package)
+
+  if not inventory.exists('packages', package):
     p1 = subprocess.Popen(['ibmcloud', 'fn', 'package', 'create', package], stdout=subprocess.PIPE)
     wait = p1.communicate()
     print(wait[0].decode('utf-8'))
     if p1.returncode != 0:
       print(bcolors.FAIL + 'cannot create package {}'.format(package) + bcolors.ENDC)
       raise Exception('cannot create package {}'.format(package))
+    inventory.add('packages', package)
 
-def create_functions_action(package, action, file, kind, timeout):
+# parameters is a dict of default parameters of the action
+def create_functions_action(package, action, file, kind, timeout, parameters=None):
   print(bcolors.OKGREEN + 'Starting to create a functions action' + bcolors.ENDC)
 
-  p1 = subprocess.Popen(['ibmcloud', 'fn', 'action', 'list'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen([
-    'grep', '{}/{}'.format(package, action)
-  ], stdin=p1.stdout, stdout=subprocess.PIPE)
-  wait = p2.communicate()
+  if functions_backend is not None:
+    return functions_backend.create_functions_action(package, action, file, kind, timeout, parameters)
+
+  exists = inventory.exists('actions', '{}/{}'.format(package, action))
+
+  params = []
+  for k, v in (parameters or {}).items():
+    params = params + ['--param', k, v if isinstance(v, str) else json.dumps(v)]
 
   p1 = subprocess.Popen([
-    'ibmcloud', 'fn', 'action', 'create' if p1.returncode == 0 else 'update',
+    'ibmcloud', 'fn', 'action', 'update' if exists else 'create',
     '{}/{}'.format(package, action), file,
     '--kind', kind,
     '--timeout', timeout
-  ], stdout=subprocess.PIPE)
+  ] + params, stdout=subprocess.PIPE)
   wait = p1.communicate()
   print(wait[0].decode('utf-8'))
   if p1.returncode != 0:
     print(bcolors.FAIL + 'cannot create/update action {}/{}'.format(package, action) + bcolors.ENDC)
     raise Exception('cannot create/update action {}/{}'.format(package, action))
+  inventory.add('actions', '{}/{}'.format(package, action))
 
 def update_functions_action_to_web(package, action, web_type):
   print(bcolors.OKGREEN + 'Starting to update a functions action to web' + bcolors.ENDC)
 
+  if functions_backend is not None:
+    return functions_backend.update_functions_action_to_web(package, action, web_type)
+
   p1 = subprocess.Popen([
     'ibmcloud', 'fn', 'action', 'update', '{}/{}'.format(package, action),
     '--web', web_type
@@ -288,14 +610,11 @@ def update_functions_action_to_web(package, action, web_type):
 def create_functions_trigger(trigger, *args):
   print(bcolors.OKGREEN + 'Starting to create a trigger {}'.format(trigger) + bcolors.ENDC)
 
-  p1 = subprocess.Popen(
-    ['ibmcloud', 'fn', 'trigger', 'list'], stdout=subprocess.PIPE
-  )
-  p2 = subprocess.Popen(['grep', trigger], stdin=p1.stdout, stdout=subprocess.PIPE)
-  p3 = subprocess.Popen(['wc', '-l'], stdin=p2.stdout, stdout=subprocess.PIPE)
-  res = p3.communicate()[0]
+  # feeds are registered by the CLI
+  if functions_backend is not None and len(args) == 0:
+    return functions_backend.create_functions_trigger(trigger)
 
-  if int(res.decode('utf-8').strip()) == 0:
+  if not inventory.exists('triggers', trigger):
     # create
     p1 = subprocess.Popen(
       ['ibmcloud', 'fn', 'trigger', 'create', trigger] + list(args),
@@ -307,6 +626,7 @@ def create_functions_trigger(trigger, *args):
       raise Exception('cannot create/update trigger {}'.format(trigger))
     else:
       print(wait[0].decode('utf-8'))
+      inventory.add('triggers', trigger)
   else:
     print(
       bcolors.OKBLUE + 'the trigger {} already exists. skip to create it'.format(trigger) +
@@ -327,6 +647,9 @@ def create_functions_rule(rule, trigger, package, action):
   # ibmcloud fn rule create myRule everyOneMinute hello
   print(bcolors.OKGREEN + 'Starting to create a rule {}'.format(rule) + bcolors.ENDC)
 
+  if functions_backend is not None:
+    return functions_backend.create_functions_rule(rule, trigger, package, action)
+
   p1 = subprocess.Popen(
     ['ibmcloud', 'fn', 'rule', 'create', rule, trigger, '{}/{}'.format(package, action)],
     stdout=subprocess.PIPE
@@ -337,18 +660,15 @@ def create_functions_rule(rule, trigger, package, action):
     raise Exception('cannot create/update a rule {}'.format(rule))
   else:
     print(wait[0].decode('utf-8'))
+    inventory.add('rules', rule)
 
 def create_functions_sequence(sequence, actions, *args):
   print(bcolors.OKGREEN + 'Starting to create a sequece {}'.format(sequence) + bcolors.ENDC)
 
-  p1 = subprocess.Popen(['ibmcloud', 'fn', 'action', 'list'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen(
-    ['grep', '{}'.format(sequence)], stdin=p1.stdout, stdout=subprocess.PIPE
-  )
-  p3 = subprocess.Popen(['wc', '-l'], stdin=p2.stdout, stdout=subprocess.PIPE)
-  res = p3.communicate()[0]
+  if functions_backend is not None and len(args) == 0:
+    return functions_backend.create_functions_sequence(sequence, actions)
 
-  if int(res.decode('utf-8').strip()) == 0:
+  if not inventory.exists('actions', sequence):
     p1 = subprocess.Popen([
       'ibmcloud', 'fn', 'action', 'create', sequence, '--sequence', ','.join(actions)
     ] + list(args), stdout=subprocess.PIPE)
@@ -358,6 +678,7 @@ def create_functions_sequence(sequence, actions, *args):
       raise Exception('cannot create/update sequence {}'.format(sequence))
     else:
       print(wait[0].decode('utf-8'))
+      inventory.add('actions', sequence)
   else:
     print(bcolors.OKBLUE + 'skip to create sequence {}'.format(sequence) + bcolors.ENDC)
 
@@ -365,14 +686,11 @@ def create_functions_sequence(sequence, actions, *args):
 def create_functions_api(api_name, base_path, api_path, api_verb, action, response_type, *args):
   print(bcolors.OKGREEN + 'Starting to create an api {}'.format(api_name) + bcolors.ENDC)
 
-  p1 = subprocess.Popen(['ibmcloud', 'fn', 'api', 'list'], stdout=subprocess.PIPE)
-  p2 = subprocess.Popen(
-    ['grep', '{}{}'.format(base_path, api_path)], stdin=p1.stdout, stdout=subprocess.PIPE
-  )
-  p3 = subprocess.Popen(['wc', '-l'], stdin=p2.stdout, stdout=subprocess.PIPE)
-  res = p3.communicate()[0]
+  # extra options are passed to the CLI
+  if functions_backend is not None and len(args) == 0:
+    return functions_backend.create_functions_api(api_name, base_path, api_path, api_verb, action, response_type)
 
-  if int(res.decode('utf-8').strip()) == 0:
+  if not inventory.exists('apis', '{} {}{}'.format(api_verb.lower(), base_path, api_path)):
     p1 = subprocess.Popen([
       'ibmcloud', 'fn', 'api', 'create', base_path, api_path, api_verb, action,
       '--apiname', api_name, '--response-type', response_type
@@ -384,6 +702,8 @@ def create_functions_api(api_name, base_path, api_path, api_verb, action, respon
       raise Exception('cannot create api {}'.format(api_name))
     else:
       print(wait[0].decode('utf-8'))
+      # the url is given by the gateway, so the list is fetched again on the next lookup
+      inventory.invalidate('apis')
   else:
     print(bcolors.OKBLUE + 'Skip to craete an api {}'.format(api_name) + bcolors.ENDC)
 
@@ -396,6 +716,9 @@ def bind_functions_to_service_credentials(target, service, key):
     bcolors.ENDC
   )
 
+  if functions_backend is not None:
+    return functions_backend.bind_functions_to_service_credentials(target, service, key)
+
   p1 = subprocess.Popen([
     'ibmcloud', 'fn', 'service', 'bind', service, target, '--keyname', key
   ], stdout=subprocess.PIPE)
@@ -417,6 +740,9 @@ def bind_functions_predefined_to(target, package):
     bcolors.ENDC
   )
 
+  if functions_backend is not None:
+    return functions_backend.bind_functions_predefined_to(target, package)
+
   p1 = subprocess.Popen([
     'ibmcloud', 'fn', 'package', 'bind', target, package
   ], stdout=subprocess.PIPE)
@@ -438,10 +764,14 @@ def get_functions_action_list(namespace, package):
     bcolors.ENDC
   )
 
+  if functions_backend is not None:
+    return functions_backend.get_functions_action_list(namespace, package)
+
   p1 = subprocess.Popen([
     'ibmcloud', 'fn', 'property', 'set', '--namespace', namespace
   ], stdout=subprocess.PIPE)
   wait = p1.communicate()
+  inventory.invalidate(*Inventory.FUNCTIONS_KINDS)
   if p1.returncode == 0:
     # ibmcloud fn action list event-streams | awk '/event-streams/ {print $1}' | sed -e 's@.*/event-streams/\(.*\)@\1@g'
     p1 = subprocess.Popen(
@@ -465,6 +795,9 @@ def get_functions_package_or_action_parameters(isAction, target):
     bcolors.OKGREEN + 'Starting to get params of {}'.format(target) + bcolors.ENDC
   )
 
+  if functions_backend is not None:
+    return functions_backend.get_functions_package_or_action_parameters(isAction, target)
+
   p1 = subprocess.Popen([
     'ibmcloud', 'fn', '{}'.format('action' if isAction is True else 'package'),
     'get', target, 'parameters'
@@ -482,34 +815,54 @@ def get_functions_package_or_action_parameters(isAction, target):
 def delete_functions_action(package, action):
   print(bcolors.OKGREEN + 'Starting to delete a functions action' + bcolors.ENDC)
 
+  if functions_backend is not None:
+    return functions_backend.delete('actions', '{}/{}'.format(package, action), 'actions')
+
   p1 = subprocess.Popen([
     'ibmcloud', 'fn', 'action', 'delete', '{}/{}'.format(package, action)
   ], stdout=subprocess.PIPE)
   print(p1.communicate()[0].decode('utf-8'))
+  inventory.remove('actions', '{}/{}'.format(package, action))
 
 def delete_functions_package(package):
   print(bcolors.OKGREEN + 'Starting to delete a functions package' + bcolors.ENDC)
 
+  if functions_backend is not None:
+    return functions_backend.delete('packages', package, 'packages')
+
   p1 = subprocess.Popen(['ibmcloud', 'fn', 'package', 'delete', package], stdout=subprocess.PIPE)
   print(p1.communicate()[0].decode('utf-8'))
+  inventory.remove('packages', package)
 
 def delete_functions_namespace(namespace):
   print(bcolors.OKGREEN + 'Starting to delete a functions namespace' + bcolors.ENDC)
 
+  if functions_backend is not None:
+    return functions_backend.delete_functions_namespace(namespace)
+
   p1 = subprocess.Popen(['ibmcloud', 'fn', 'namespace', 'delete', namespace], stdout=subprocess.PIPE)
   print(p1.communicate()[0].decode('utf-8'))
+  inventory.remove('namespaces', namespace)
 
 def delete_functions_trigger(trigger):
-  print(bcolors.OKGREEN + 'Starting to delete a functions rule' + bcolors.ENDC)
+  print(bcolors.OKGREEN + 'Starting to delete a functions trigger' + bcolors.ENDC)
+
+  if functions_backend is not None:
+    return functions_backend.delete('triggers', trigger, 'triggers')
 
   p1 = subprocess.Popen(['ibmcloud', 'fn', 'trigger', 'delete', trigger], stdout=subprocess.PIPE)
   print(p1.communicate()[0].decode('utf-8'))
+  inventory.remove('triggers', trigger)
 
 def delete_functions_rule(rule):
   print(bcolors.OKGREEN + 'Starting to delete a functions rule' + bcolors.ENDC)
 
+  if functions_backend is not None:
+    return functions_backend.delete('rules', rule, 'rules')
+
   p1 = subprocess.Popen(['ibmcloud', 'fn', 'rule', 'delete', rule], stdout=subprocess.PIPE)
   print(p1.communicate()[0].decode('utf-8'))
+  inventory.remove('rules', rule)
 
 
 '''
@@ -536,7 +889,9 @@ def create_buckets(buckets, region, tenant_id):
         print(bcolors.FAIL + 'cannot create bucket {}'.format(bucket) + bcolors.ENDC)
         raise Exception('cannot create bucket {}'.format(bucket))
 
-def delete_buckets(buckets, region):
+# with HMAC keys, buckets are emptied over the S3 API before they are deleted,
+# so a bucket holding any number of objects can be deleted
+def delete_buckets(buckets, region, hmac_keys=None, workers=8):
   print(bcolors.OKGREEN + 'Starting to delete buckets' + bcolors.ENDC)
 
   for bucket in buckets:
@@ -548,6 +903,10 @@ def delete_buckets(buckets, region):
 
     # delete a bucket
     if p1.returncode == 0:
+      if hmac_keys is not None:
+        client = s3.S3Client(hmac_keys[0], hmac_keys[1], region)
+        s3.delete(client, bucket, client.list_objects(bucket), workers)
+
       p1 = subprocess.Popen([
         'ibmcloud', 'cos', 'delete-bucket', '--bucket', bucket, '--region', region, '--force'
       ], stdout=subprocess.PIPE)
@@ -556,14 +915,49 @@ def delete_buckets(buckets, region):
         print(bcolors.FAIL + 'cannot delete bucket {}'.format(bucket) + bcolors.ENDC)
         raise Exception('cannot delete bucket {}'.format(bucket))
 
-def put_objects(objects, region):
+# objects are (FILE, BUCKET) pairs keyed by the file name, or (FILE, BUCKET, KEY) for a path like tiles/0/0/0.webp.
+# (FILE, BUCKET, KEY, CACHE) gives the object one of the cache policies below
+CACHE_CONTROL = {
+  'immutable': 'public, max-age=31536000, immutable',
+  'no-cache': 'no-cache'
+}
+
+def object_key(obj):
+  return obj[2] if len(obj) > 2 and len(obj[2]) > 0 else os.path.basename(obj[0])
+
+def object_headers(obj):
+  headers = dict(s3.content_headers(object_key(obj)) or {})
+  if len(obj) > 3 and len(obj[3]) > 0:
+    if obj[3] not in CACHE_CONTROL:
+      print(bcolors.FAIL + 'no cache policy {}. it should be one of {}'.format(obj[3], '|'.join(CACHE_CONTROL)) + bcolors.ENDC)
+      raise Exception('no cache policy {}'.format(obj[3]))
+    headers['Cache-Control'] = CACHE_CONTROL[obj[3]]
+  return headers
+
+# with HMAC keys as (ACCESS_KEY_ID, SECRET_ACCESS_KEY), objects are uploaded over the S3 API
+# concurrently, in parallel parts when they are large, and skipped when the ETag already matches.
+# otherwise, they are uploaded one by one by the CLI. keys are the object keys after the prefix, like TENANT/
+def put_objects(objects, region, hmac_keys=None, workers=8, prefix=''):
+  if hmac_keys is not None:
+    targets = []
+    for obj in objects:
+      f, bucket = obj[:2]
+      if os.path.exists(f) is True:
+        targets.append((f, bucket, prefix + object_key(obj), object_headers(obj)))
+      else:
+        print(bcolors.FAIL + 'there is no data {}'.format(f) + bcolors.ENDC)
+    return s3.upload(s3.S3Client(hmac_keys[0], hmac_keys[1], region), targets, workers)
+
   for obj in objects:
-    f, bucket = obj
+    f, bucket = obj[:2]
     if os.path.exists(f) is True:
+      headers = object_headers(obj)
       p1 = subprocess.Popen([
-        'ibmcloud', 'cos', 'put-object', '--bucket', bucket, '--key', os.path.basename(f),
+        'ibmcloud', 'cos', 'put-object', '--bucket', bucket, '--key', prefix + object_key(obj),
         '--body', f, '--region', region
-      ], stdout=subprocess.PIPE)
+      ] + (['--content-type', headers['Content-Type']] if 'Content-Type' in headers else [])
+        + (['--cache-control', headers['Cache-Control']] if 'Cache-Control' in headers else []),
+        stdout=subprocess.PIPE)
       wait = p1.communicate()
       
       if p1.returncode != 0:
@@ -575,30 +969,39 @@ def put_objects(objects, region):
     else:
       print(bcolors.FAIL + 'there is no data {}'.format(f) + bcolors.ENDC)
 
-def delete_objects(objects, region):
+# keys are deleted in chunks of 1000, which is the limit of a delete request.
+# with HMAC keys, chunks are deleted concurrently over the S3 API. otherwise, one by one by the CLI
+def delete_objects(objects, region, hmac_keys=None, workers=8, prefix=''):
   obj = {}
   for o in objects:
-    f, bucket = o
+    bucket = o[1]
     if bucket in obj.keys():
-      obj[bucket].append(os.path.basename(f))
+      obj[bucket].append(prefix + object_key(o))
     else:
-      obj[bucket] = [os.path.basename(f)]
-  
+      obj[bucket] = [prefix + object_key(o)]
+
+  if hmac_keys is not None:
+    client = s3.S3Client(hmac_keys[0], hmac_keys[1], region)
+    for key in obj.keys():
+      s3.delete(client, key, [obj[key]], workers)
+    return
+
   for key in obj.keys():
-    s = 'Objects=[' + ','.join([ '{{Key="{}"}}'.format(x) for x in obj[key] ]) + '],Quiet=false'
-    p1 = subprocess.Popen([
-        'ibmcloud', 'cos', 'delete-objects', '--bucket', key, '--delete', s,
-        '--region', region
-      ], stdout=subprocess.PIPE)
-    wait = p1.communicate()
+    for chunk in s3.chunks([obj[key]]):
+      s = 'Objects=[' + ','.join([ '{{Key="{}"}}'.format(x) for x in chunk ]) + '],Quiet=false'
+      p1 = subprocess.Popen([
+          'ibmcloud', 'cos', 'delete-objects', '--bucket', key, '--delete', s,
+          '--region', region
+        ], stdout=subprocess.PIPE)
+      wait = p1.communicate()
 
-    if p1.returncode != 0:
-      print(
-        bcolors.FAIL + 'no keys in cos or cannot delete keys {} due to {}'.format(obj[key], wait[0]) +
-        bcolors.ENDC
-      )
-    else:
-      print(wait[0].decode('utf-8'))
+      if p1.returncode != 0:
+        print(
+          bcolors.FAIL + 'no keys in cos or cannot delete keys {} due to {}'.format(chunk, wait[0]) +
+          bcolors.ENDC
+        )
+      else:
+        print(wait[0].decode('utf-8'))
 
 
 '''
@@ -654,32 +1057,18 @@ def get_topic_detail(topic):
 Utils
 '''
 def get_credentials_value(src, key):
-  if os.path.exists(src) is True:
-    with open(src) as f:
-      line = f.readline()
-      while line:
-        kv = line.strip().split('=')
-        if kv[0] == key:
-          return kv[1]
-
-        line = f.readline()
-
-  return None
+  return credentials.get_store(src).get(key)
 
 def copy_credentials_to_each(src, dst, map, addon):
   print(bcolors.OKGREEN + 'Copying credeitials to each json' + bcolors.ENDC)
 
   out = {}
+  store = credentials.get_store(src)
   if os.path.exists(src) is True:
-    with open(src) as f:
-      line = f.readline()
-      while line:
-        kv = line.strip().split('=')
-        for m in map:
-          if kv[0] == m[0]:
-            out[m[1]] = kv[1]
-
-        line = f.readline()
+    for m in map:
+      value = store.get(m[0])
+      if value is not None:
+        out[m[1]] = value
 
     if addon is not None:
       for k, v in addon.items():